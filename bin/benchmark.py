@@ -0,0 +1,60 @@
+#!/usr/bin/python
+import os
+import sys
+import argparse
+
+current_directory = os.path.dirname(os.path.abspath(__file__))
+current_directory = os.path.dirname(current_directory)
+sys.path.insert(0, current_directory)
+from mlreco.benchmark.core import BenchmarkResults, compare
+from mlreco.benchmark import components, imports, inference, server, training
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark mlreco components on synthetic events (CPU)')
+    parser.add_argument('--suites', nargs='+', default=['components', 'imports'],
+                        choices=['components', 'imports', 'inference', 'server', 'training'])
+    parser.add_argument('--model', default='uresnet_ppn', choices=sorted(inference.MODELS.keys()),
+                        help='model for the inference, server and training suites')
+    parser.add_argument('--clients', type=int, nargs='+', default=[1, 4],
+                        help='numbers of concurrent clients for the server suite')
+    parser.add_argument('--device', default='cpu', help="GPU ids or 'cpu' for the inference, server and training suites")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000],
+                        help='total number of voxels per minibatch')
+    parser.add_argument('--batch_size', type=int, default=4)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--max_dbscan_size', type=int, default=2000,
+                        help='skip the pure python DBScan above this size')
+    parser.add_argument('--output', default='benchmark.json', help='JSON file to write the results to')
+    parser.add_argument('--compare', default=None, help='JSON file of a previous run to compare with')
+    args = parser.parse_args()
+
+    results = BenchmarkResults()
+    if 'components' in args.suites:
+        components.run(args.sizes, batch_size=args.batch_size, repeat=args.repeat,
+                       seed=args.seed, max_dbscan_size=args.max_dbscan_size, results=results)
+    if 'imports' in args.suites:
+        imports.run(repeat=args.repeat, results=results)
+    if 'inference' in args.suites:
+        inference.run(args.model, num_voxels=args.sizes, batch_size=args.batch_size,
+                      device=args.device, repeat=args.repeat, results=results)
+    if 'training' in args.suites:
+        training.run(args.model, num_voxels=args.sizes, batch_size=args.batch_size,
+                     device=args.device, repeat=args.repeat, results=results)
+    if 'server' in args.suites:
+        for size in args.sizes:
+            cfg = inference.make_config(args.model, size, 1, args.device)
+            cfg['model']['network_input'] = cfg['model']['network_input'][:1]
+            server.run(cfg, num_clients=args.clients, num_voxels=size, results=results)
+    results.save(args.output)
+    print('Results saved to', args.output)
+
+    if args.compare is not None:
+        baseline = BenchmarkResults.load(args.compare)
+        print('\n%-40s %10s %12s %12s %8s' % ('name', 'size', 'baseline', 'current', 'ratio'))
+        for name, size, base, current, ratio in compare(baseline, results):
+            print('%-40s %10s %12.6f %12.6f %8.2f' % (name, size, base, current, ratio))
+
+if __name__ == '__main__':
+    main()
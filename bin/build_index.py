@@ -0,0 +1,38 @@
+#!/usr/bin/python
+import os
+import sys
+import argparse
+import yaml
+
+current_directory = os.path.dirname(os.path.abspath(__file__))
+current_directory = os.path.dirname(current_directory)
+sys.path.insert(0, current_directory)
+from mlreco.iotools.factories import datasets
+from mlreco.iotools.index import build_index
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Write the per-event statistics index of the dataset of a config')
+    parser.add_argument('config')
+    parser.add_argument('output', help='index file (.npz)')
+    parser.add_argument('--num_workers', type=int, default=1)
+    parser.add_argument('--num_classes', type=int, default=5)
+    args = parser.parse_args()
+
+    cfg_file = args.config
+    if not os.path.isfile(cfg_file):
+        cfg_file = os.path.join(current_directory, 'config', args.config)
+    if not os.path.isfile(cfg_file):
+        print(args.config, 'not found...')
+        sys.exit(1)
+    cfg = yaml.load(open(cfg_file, 'r'), Loader=yaml.Loader)
+
+    # The index covers the full dataset, whatever the query
+    params = cfg['iotool']['dataset']
+    ds = datasets[params['name']].create(params)
+    index = build_index(ds, params['schema'], args.output, num_workers=args.num_workers,
+                        num_classes=args.num_classes, roles=params.get('index_keys', None))
+    print('Indexed %d events to %s' % (len(index), args.output))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,29 @@
+#!/usr/bin/python
+import os
+import sys
+import glob
+import argparse
+
+current_directory = os.path.dirname(os.path.abspath(__file__))
+current_directory = os.path.dirname(current_directory)
+sys.path.insert(0, current_directory)
+from mlreco.utils.cost_model import CostModel
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Fit the cost model of the cost logs of a log_dir (training.cost_log)')
+    parser.add_argument('log_dir')
+    parser.add_argument('output', help='cost model file (.json)')
+    args = parser.parse_args()
+
+    filenames = sorted(glob.glob(os.path.join(args.log_dir, '*cost_batches-*.csv')))
+    if not filenames:
+        print('No cost log in', args.log_dir)
+        sys.exit(1)
+    model = CostModel.fit(filenames)
+    model.save(args.output)
+    for target, (intercept, per_event, per_voxel) in sorted(model.coefficients.items()):
+        print('%s = %g + %g * events + %g * voxels' % (target, intercept, per_event, per_voxel))
+
+if __name__ == '__main__':
+    main()
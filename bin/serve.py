@@ -0,0 +1,36 @@
+#!/usr/bin/python
+import os
+import sys
+import yaml
+
+current_directory = os.path.dirname(os.path.abspath(__file__))
+current_directory = os.path.dirname(current_directory)
+sys.path.insert(0, current_directory)
+from mlreco.main_funcs import process_config
+from mlreco.server import InferenceServer
+from mlreco.utils.cost_model import CostModel
+
+
+def main():
+    cfg_file = sys.argv[1]
+    if not os.path.isfile(cfg_file):
+        cfg_file = os.path.join(current_directory, 'config', sys.argv[1])
+    if not os.path.isfile(cfg_file):
+        print(sys.argv[1], 'not found...')
+        sys.exit(1)
+
+    cfg = yaml.load(open(cfg_file, 'r'), Loader=yaml.Loader)
+
+    process_config(cfg)
+    server_cfg = cfg.get('server', {})
+    server = InferenceServer(cfg,
+                             address=server_cfg.get('address', 'localhost:5555'),
+                             max_latency=float(server_cfg.get('max_latency', 0.01)),
+                             max_voxels=int(server_cfg.get('max_voxels', 1000000)),
+                             max_batch_size=int(server_cfg.get('max_batch_size', 64)),
+                             cost_model=CostModel.load(server_cfg['cost_model']) if 'cost_model' in server_cfg else None,
+                             max_time=server_cfg.get('max_time', None))
+    server.serve_forever()
+
+if __name__ == '__main__':
+    main()
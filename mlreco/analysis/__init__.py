@@ -1 +1,6 @@
-from mlreco.analysis.track_clustering import track_clustering
+from mlreco.utils.registry import Registry
+
+# Analysis scripts, imported when referenced by model.analysis in the config
+scripts = Registry('analysis script', {
+    'track_clustering': 'mlreco.analysis.track_clustering:track_clustering'
+})
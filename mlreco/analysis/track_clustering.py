@@ -89,7 +89,7 @@ def track_clustering(data_blob, res, cfg, idx):
             # dbscan_points = np.stack(dbscan_points)
             # print(dbscan_points.shape)
             print("Predicted points: ", event_points.shape)
-            keep = nms_numpy(event_points, event_scores, 0.1, 5)
+            keep = nms_numpy(event_points, event_scores[:, 1], 0.1, 5)
             dbscan_points = event_points[keep]
             print("Remaining predicted points: ", dbscan_points.shape)
 
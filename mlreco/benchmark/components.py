@@ -0,0 +1,224 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+import io
+import shutil
+import tempfile
+import contextlib
+import numpy as np
+import torch
+from mlreco.benchmark.core import measure, BenchmarkResults
+from mlreco.iotools.synthetic import SyntheticEventGenerator
+
+# Same schema as config/test_chain.cfg
+SCHEMA = [('input_data', 'parse_sparse3d_scn', False),
+          ('segment_label', 'parse_sparse3d_scn', True),
+          ('particles_label', 'parse_particles', False),
+          ('clusters_label', 'parse_cluster3d', False)]
+NUM_CLASSES = 5
+NUM_STRIDES = 5
+DATA_DIM = 3
+
+
+def make_samples(generator, num_voxels, batch_size):
+    """
+    Returns a list of batch_size samples, each in the format returned by
+    LArCVDataset.__getitem__ for SCHEMA (without the index).
+    Each event has num_voxels / batch_size voxels.
+    """
+    samples = []
+    for _ in range(batch_size):
+        event = generator.generate(max(int(num_voxels / batch_size), 1))
+        samples.append(tuple([generator.parse(event, parser, is_label)
+                              for _, parser, is_label in SCHEMA]))
+    return samples
+
+
+def collate(samples):
+    from mlreco.iotools.collates import CollateSparse
+    data = CollateSparse(samples)
+    return dict([(key, data[i]) for i, (key, _, _) in enumerate(SCHEMA)])
+
+
+def _strided(coords, stride):
+    """
+    Active sites of an SCN tensor after `stride` convolutions of size 2,
+    stride 2. coords is (N, dim + batch id).
+    """
+    scaled = coords.copy()
+    scaled[:, :DATA_DIM] = np.floor(scaled[:, :DATA_DIM] / 2**stride)
+    return np.unique(scaled, axis=0)
+
+
+def fake_ppn_outputs(blob, rng):
+    """
+    Random network outputs with the shapes returned by PPNUResNet
+    (uresnet_ppn) for the collated blob.
+    """
+    data = blob['input_data']
+    n = data.shape[0]
+    coords = data[:, :DATA_DIM+1]
+    ppn1 = _strided(coords, NUM_STRIDES - 1)
+    ppn2 = _strided(coords, int(NUM_STRIDES / 2))
+    t = lambda x: torch.as_tensor(np.asarray(x, dtype=np.float32))
+    return {
+        'points': t(rng.normal(size=(n, DATA_DIM + 2))),
+        'ppn1': t(np.concatenate([ppn1, rng.normal(size=(len(ppn1), 2))], axis=1)),
+        'ppn2': t(np.concatenate([ppn2, rng.normal(size=(len(ppn2), 2))], axis=1)),
+        'segmentation': t(rng.normal(size=(n, NUM_CLASSES))),
+        'mask': t(rng.uniform(size=(n, 1)) > 0.8)
+    }
+
+
+def bench_collate(results, generator, size, batch_size, repeat):
+    samples = make_samples(generator, size, batch_size)
+    results.add('collate_sparse', size, measure(lambda: collate(samples), repeat=repeat),
+                batch_size=batch_size)
+
+
+def bench_losses(results, generator, size, batch_size, repeat, rng):
+    from mlreco.models import uresnet, uresnet_lonely, uresnet_ppn, ppn
+    blob = collate(make_samples(generator, size, batch_size))
+    out = fake_ppn_outputs(blob, rng)
+    label = [torch.as_tensor(blob['segment_label'])]
+    particles = [torch.as_tensor(blob['particles_label'])]
+    seg = [out['segmentation']]
+    cfg = {'modules': dict([(name, {'data_dim': DATA_DIM, 'num_strides': NUM_STRIDES, 'num_classes': NUM_CLASSES})
+                            for name in ['uresnet', 'uresnet_lonely', 'uresnet_ppn', 'ppn']])}
+
+    loss = uresnet.SegmentationLoss(cfg)
+    results.add('loss/uresnet', size, measure(lambda: loss([seg], label), repeat=repeat))
+    loss_lonely = uresnet_lonely.SegmentationLoss(cfg)
+    results.add('loss/uresnet_lonely', size, measure(lambda: loss_lonely([seg], label), repeat=repeat))
+    loss_ppn = uresnet_ppn.SegmentationLoss(cfg)
+    segmentation = [[out['points']], [out['ppn1']], [out['ppn2']], seg, [out['mask']], [out['mask']]]
+    results.add('loss/uresnet_ppn', size,
+                measure(lambda: loss_ppn(segmentation, label, particles), repeat=repeat))
+    loss_ppn_only = ppn.PPNLoss(cfg)
+    segmentation = [[out['points']], [out['ppn1']], [out['ppn2']], [out['mask']], [out['mask']]]
+    results.add('loss/ppn', size,
+                measure(lambda: loss_ppn_only(segmentation, label, particles), repeat=repeat))
+
+
+def dbscan_input(blob, rng, one_hot):
+    """
+    (N, dim + batch id + feature + num_classes) input of the DBSCAN layers,
+    using the true labels as predicted scores.
+    """
+    data = blob['input_data']
+    classes = blob['segment_label'][:, -1].astype(np.int64)
+    scores = np.eye(NUM_CLASSES)[classes]
+    if not one_hot:
+        scores = scores + rng.uniform(0, 0.1, size=scores.shape)
+    return torch.as_tensor(np.concatenate([data, scores], axis=1))
+
+
+def bench_dbscan(results, generator, size, batch_size, repeat, rng, max_size):
+    from mlreco.models.layers.dbscan import DBScan, DBScanClusts
+    cfg = {'epsilon': 1.999, 'minPoints': 1, 'num_classes': NUM_CLASSES, 'data_dim': DATA_DIM}
+    blob = collate(make_samples(generator, size, batch_size))
+    x = dbscan_input(blob, rng, one_hot=True)
+    clusts = DBScanClusts(cfg)
+    results.add('dbscan/DBScanClusts', size, measure(lambda: clusts(x), repeat=repeat))
+    if size > max_size:
+        results.add('dbscan/DBScan', size, skipped='size > %d (pure python)' % max_size)
+        return
+    dbscan = DBScan(cfg)
+    x = dbscan_input(blob, rng, one_hot=False).double()
+    with contextlib.redirect_stdout(io.StringIO()):
+        timing = measure(lambda: dbscan(x), repeat=repeat)
+    results.add('dbscan/DBScan', size, timing)
+
+
+def bench_nms(results, size, repeat, rng):
+    from mlreco.output_formatters.uresnet_ppn import nms_numpy
+    proposals = rng.uniform(0, 512, size=(size, DATA_DIM))
+    scores = rng.uniform(size=size)
+    results.add('nms_numpy', size, measure(lambda: nms_numpy(proposals, scores, 0.01, 5), repeat=repeat))
+
+
+def bench_add_labels(results, size, repeat):
+    try:
+        import sparseconvnet as scn
+    except ImportError:
+        results.add('add_labels', size, skipped='sparseconvnet not available')
+        return
+    from mlreco.models.layers.extract_feature_map import AddLabels
+    generator = SyntheticEventGenerator(seed=0)
+    event = generator.generate(size)
+    coords = torch.as_tensor(np.concatenate([event['voxels'], np.zeros((size, 1))], axis=1)).long()
+    layer = scn.InputLayer(DATA_DIM, 512, mode=3)
+    attention = layer((coords, torch.zeros((size, 1))))
+    label = torch.as_tensor(np.concatenate([event['particles'], np.zeros((len(event['particles']), 1))], axis=1)).long()
+    add_labels = AddLabels()
+    results.add('add_labels', size, measure(lambda: add_labels(attention, label), repeat=repeat))
+
+
+def bench_outputs(results, generator, size, repeat, rng):
+    from mlreco.utils import utils
+    from mlreco.output_formatters.input import input as input_formatter
+    from mlreco.output_formatters.uresnet_ppn import uresnet_ppn
+    blob = collate(make_samples(generator, size, 1))
+    out = fake_ppn_outputs(blob, rng)
+    res = dict([(key, value.numpy()) for key, value in out.items()])
+    res['mask'] = res['mask'].astype(np.float32)
+    log_dir = tempfile.mkdtemp()
+    try:
+        def run(f):
+            csv_logger = utils.CSVData('%s/output.csv' % log_dir)
+            with contextlib.redirect_stdout(io.StringIO()):
+                f(csv_logger, blob, res)
+            csv_logger.close()
+        results.add('output/input', size, measure(lambda: run(input_formatter), repeat=repeat))
+        results.add('output/uresnet_ppn', size, measure(lambda: run(uresnet_ppn), repeat=repeat))
+    finally:
+        shutil.rmtree(log_dir)
+
+
+def bench_track_clustering(results, generator, size, repeat, rng):
+    try:
+        from mlreco.analysis.track_clustering import track_clustering
+    except ImportError as e:
+        results.add('analysis/track_clustering', size, skipped='%s not available' % e.name)
+        return
+    blob = collate(make_samples(generator, size, 1))
+    out = fake_ppn_outputs(blob, rng)
+    data = blob['input_data']
+    # Predicted clusters: true clusters of track voxels, in the format
+    # returned by Chain (data + class id + cluster id)
+    classes = blob['segment_label'][:, -1]
+    track = (classes == 0) | (classes == 1)
+    clusters = np.concatenate([data[track], classes[track][:, None], blob['clusters_label'][track][:, -1:]], axis=1)
+    points = out['points'].numpy()
+    points[:, DATA_DIM] = 0.  # batch id is read from column 3
+    res = {'clusters': [clusters],
+           'points': [points],
+           'segmentation': [out['segmentation'].numpy()]}
+    data_blob = dict([(key, [[value]]) for key, value in blob.items()])
+    log_dir = tempfile.mkdtemp()
+    cfg = {'model': {}, 'training': {'log_dir': log_dir}}
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            timing = measure(lambda: track_clustering(data_blob, res, cfg, 0), repeat=repeat)
+        results.add('analysis/track_clustering', size, timing)
+    finally:
+        shutil.rmtree(log_dir)
+
+
+def run(sizes, batch_size=4, repeat=5, seed=0, max_dbscan_size=2000, results=None):
+    """
+    Runs every component benchmark for each problem size (total number of
+    voxels in a minibatch). Returns a BenchmarkResults.
+    """
+    results = BenchmarkResults() if results is None else results
+    generator = SyntheticEventGenerator(seed=seed)
+    rng = np.random.RandomState(seed)
+    for size in sizes:
+        bench_collate(results, generator, size, batch_size, repeat)
+        bench_losses(results, generator, size, batch_size, repeat, rng)
+        bench_dbscan(results, generator, size, batch_size, repeat, rng, max_dbscan_size)
+        bench_nms(results, size, repeat, rng)
+        bench_add_labels(results, size, repeat)
+        bench_outputs(results, generator, size, repeat, rng)
+        bench_track_clustering(results, generator, size, repeat, rng)
+    return results
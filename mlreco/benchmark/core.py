@@ -0,0 +1,106 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+import os
+import sys
+import time
+import json
+import socket
+import platform
+import datetime
+import numpy as np
+
+
+def measure(fn, repeat=5, warmup=1):
+    """
+    Runs fn() warmup + repeat times, returns timing statistics in seconds
+    for the repeat runs.
+    """
+    for _ in range(warmup):
+        fn()
+    times = []
+    for _ in range(repeat):
+        tstart = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - tstart)
+    times = np.array(times)
+    return {
+        'median': float(np.median(times)),
+        'min': float(times.min()),
+        'mean': float(times.mean()),
+        'repeat': repeat
+    }
+
+
+def environment():
+    """
+    Describes the machine and library versions, stored with the results
+    so that runs can be compared meaningfully.
+    """
+    env = {
+        'host': socket.gethostname(),
+        'platform': platform.platform(),
+        'python': sys.version.split()[0],
+        'numpy': np.__version__,
+        'cpu_count': os.cpu_count(),
+        'date': datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    }
+    try:
+        import torch
+        env['torch'] = torch.__version__
+        env['cuda'] = torch.cuda.is_available()
+    except ImportError:
+        env['torch'] = None
+    return env
+
+
+class BenchmarkResults(object):
+    """
+    List of benchmark records, saved to / loaded from JSON.
+    Each record has a name, a problem size, timing statistics (or the
+    reason why it was skipped) and optional extra measurements.
+    """
+    def __init__(self, meta=None, results=None):
+        self.meta = environment() if meta is None else meta
+        self.results = [] if results is None else results
+
+    def add(self, name, size, timing=None, skipped=None, **extra):
+        record = {'name': name, 'size': size}
+        if timing is not None:
+            record.update(timing)
+        if skipped is not None:
+            record['skipped'] = skipped
+        record.update(extra)
+        self.results.append(record)
+        if skipped is not None:
+            print('%-40s %10s   skipped: %s' % (name, size, skipped))
+        else:
+            print('%-40s %10s   %.6f s' % (name, size, record['median']))
+        sys.stdout.flush()
+        return record
+
+    def save(self, filename):
+        with open(filename, 'w') as f:
+            json.dump({'meta': self.meta, 'results': self.results}, f, indent=2)
+
+    @staticmethod
+    def load(filename):
+        with open(filename, 'r') as f:
+            d = json.load(f)
+        return BenchmarkResults(meta=d['meta'], results=d['results'])
+
+
+def compare(baseline, current):
+    """
+    Returns a list of (name, size, baseline median, current median, ratio)
+    for the records present in both BenchmarkResults.
+    ratio > 1 means the current run is slower.
+    """
+    base = dict([((r['name'], r['size']), r) for r in baseline.results if 'median' in r])
+    rows = []
+    for r in current.results:
+        key = (r['name'], r['size'])
+        if key in base and 'median' in r:
+            rows.append((r['name'], r['size'], base[key]['median'], r['median'],
+                         r['median'] / base[key]['median'] if base[key]['median'] > 0 else float('inf')))
+    return rows
@@ -0,0 +1,59 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+import os
+import sys
+import json
+import subprocess
+from mlreco.benchmark.core import measure, BenchmarkResults
+
+TOP_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+HEAVY_MODULES = ['torch', 'scipy', 'sklearn', 'sparseconvnet', 'larcv', 'ROOT']
+
+# What bin/run.py imports before reading the config
+RUN_STARTUP = 'import mlreco.main_funcs'
+# What a DataLoader worker started with 'spawn' imports to unpickle the dataset
+WORKER_STARTUP = 'import mlreco.iotools.datasets, mlreco.iotools.collates, mlreco.iotools.samplers'
+# Same, but resolving every registry entry (what used to be imported eagerly)
+EAGER = """
+for registry in [models, formatters, scripts]:
+    for name in registry:
+        try:
+            registry[name]
+        except ImportError:
+            pass
+try:
+    import mlreco.iotools.parsers
+except ImportError:
+    pass
+"""
+EAGER_STARTUP = RUN_STARTUP + """
+from mlreco.models import models
+from mlreco.output_formatters import formatters
+from mlreco.analysis import scripts
+""" + EAGER
+
+
+def _run(statement):
+    """
+    Runs statement in a fresh interpreter, returns the heavy modules it loaded.
+    """
+    code = statement + '\nimport sys, json\nprint(json.dumps([m for m in %r if m in sys.modules]))' % HEAVY_MODULES
+    out = subprocess.check_output([sys.executable, '-c', code], cwd=TOP_DIR,
+                                  env=dict(os.environ, PYTHONPATH=TOP_DIR))
+    return json.loads(out.decode().strip().split('\n')[-1])
+
+
+def run(repeat=5, results=None):
+    """
+    Cold start time of a new Python process for bin/run.py and for DataLoader
+    workers, with lazy registries and with every entry imported.
+    """
+    results = BenchmarkResults() if results is None else results
+    for name, statement in [('import/baseline', 'pass'),
+                            ('import/run', RUN_STARTUP),
+                            ('import/run_eager', EAGER_STARTUP),
+                            ('import/worker', WORKER_STARTUP)]:
+        modules = _run(statement)
+        results.add(name, 0, measure(lambda: _run(statement), repeat=repeat, warmup=0), modules=modules)
+    return results
@@ -0,0 +1,77 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+import copy
+import torch
+from mlreco.benchmark.core import measure, BenchmarkResults
+
+MODULE_CONFIG = {'num_strides': 5, 'filters': 16, 'num_classes': 5, 'data_dim': 3, 'spatial_size': 512}
+SCHEMA = {'input_data': ['parse_sparse3d_scn', 'sparse3d_data'],
+          'segment_label': ['parse_sparse3d_scn', 'sparse3d_fivetypes'],
+          'particles_label': ['parse_particles', 'sparse3d_data', 'particle_mcst']}
+# network_input, loss_input and the segmentation output of each model
+MODELS = {
+    'uresnet_ppn': (['input_data', 'particles_label'], ['segment_label', 'particles_label'], 3),
+    'uresnet_lonely': (['input_data'], ['segment_label'], 0),
+    'uresnet': (['input_data'], ['segment_label'], 0)
+}
+
+
+def make_config(model_name, num_voxels, batch_size, device):
+    network_input, loss_input, segmentation = MODELS[model_name]
+    return {
+        'iotool': {'batch_size': batch_size, 'shuffle': False, 'num_workers': 0, 'collate_fn': 'CollateSparse',
+                   'dataset': {'name': 'SyntheticDataset', 'num_events': 1000, 'num_voxels': num_voxels,
+                               'schema': copy.deepcopy(SCHEMA)}},
+        'model': {'name': model_name, 'modules': {model_name: dict(MODULE_CONFIG)},
+                  'network_input': network_input, 'loss_input': loss_input,
+                  'analysis_keys': {'segmentation': segmentation}},
+        'training': {'seed': 0, 'learning_rate': 0.001, 'gpus': device, 'weight_prefix': '',
+                     'iterations': 1, 'report_step': 1, 'checkpoint_step': 0, 'log_dir': '',
+                     'model_path': '', 'train': False, 'debug': False, 'minibatch_size': batch_size}
+    }
+
+
+def _trainer(cfg, inference_mode):
+    from mlreco.trainval import trainval
+    from mlreco.iotools.factories import loader_factory
+    from mlreco.utils.device import parse_gpus
+    cfg = copy.deepcopy(cfg)
+    cfg['training']['device'], cfg['training']['gpus'] = parse_gpus(cfg['training']['gpus'])
+    cfg['training']['inference_mode'] = inference_mode
+    if inference_mode:
+        # Lean path: no labels at all
+        network_input = cfg['model']['network_input'][:1]
+        cfg['model']['network_input'] = network_input
+        cfg['iotool']['dataset']['schema'] = dict([(key, cfg['iotool']['dataset']['schema'][key]) for key in network_input])
+    loader, cfg['data_keys'] = loader_factory(cfg)
+    trainer = trainval(cfg)
+    trainer.initialize()
+    batch = next(iter(loader))
+    data_blob = dict([(key, [[batch[i]]]) for i, key in enumerate(cfg['data_keys'])])
+    return trainer, data_blob
+
+
+def run(model_name='uresnet_ppn', num_voxels=[10000], batch_size=4, device='cpu', repeat=5, results=None):
+    """
+    Latency per event (and peak GPU memory) of trainval.forward in eval
+    mode, with and without training.inference_mode.
+    """
+    results = BenchmarkResults() if results is None else results
+    for size in num_voxels:
+        cfg = make_config(model_name, size, batch_size, device)
+        for inference_mode in [False, True]:
+            name = 'inference/%s/%s' % (model_name, 'inference_mode' if inference_mode else 'eval')
+            try:
+                trainer, data_blob = _trainer(cfg, inference_mode)
+            except ImportError as e:
+                results.add(name, size, skipped=repr(e))
+                continue
+            if torch.cuda.is_available() and device != 'cpu':
+                torch.cuda.reset_peak_memory_stats()
+            timing = measure(lambda: trainer.forward(copy.copy(data_blob)), repeat=repeat)
+            extra = {'per_event': timing['median'] / batch_size}
+            if torch.cuda.is_available() and device != 'cpu':
+                extra['max_memory'] = torch.cuda.max_memory_allocated() / 1.e9
+            results.add(name, size, timing, **extra)
+    return results
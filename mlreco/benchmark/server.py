@@ -0,0 +1,68 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+import os
+import time
+import threading
+import numpy as np
+from mlreco.benchmark.core import BenchmarkResults
+from mlreco.iotools.synthetic import SyntheticEventGenerator
+
+
+def _client(address, authkey, events, latencies, pipeline):
+    from mlreco.server import InferenceClient
+    client = InferenceClient(address, authkey=authkey)
+    for i in range(0, len(events), pipeline):
+        tstart = time.perf_counter()
+        client.infer_many(events[i:i+pipeline])
+        latencies.append(time.perf_counter() - tstart)
+    client.close()
+
+
+def run(cfg, num_clients=[1, 4], num_requests=20, num_voxels=10000, pipeline=1,
+        max_latency=0.01, max_voxels=1000000, max_batch_size=64, seed=0, results=None):
+    """
+    Starts an InferenceServer in this process and num_clients client
+    threads, each sending num_requests synthetic events (pipeline at a
+    time). Records the request latency and the throughput in events/s.
+    """
+    from mlreco.server import InferenceServer
+    results = BenchmarkResults() if results is None else results
+    authkey = os.urandom(16)
+    try:
+        server = InferenceServer(cfg, authkey=authkey, max_latency=max_latency, max_voxels=max_voxels,
+                                 max_batch_size=max_batch_size).start()
+    except ImportError as e:
+        results.add('server', num_voxels, skipped=repr(e))
+        return results
+    generator = SyntheticEventGenerator(seed=seed)
+    input_key = cfg['model']['network_input'][0]
+    schema = cfg['iotool']['dataset']['schema']
+    try:
+        for n in num_clients:
+            events = []
+            for _ in range(num_requests):
+                event = generator.generate(num_voxels)
+                events.append({input_key: generator.parse(event, schema[input_key][0])})
+            # Warm up
+            _client(server.address, authkey, events[:1], [], 1)
+            latencies, threads = [], []
+            num_batches, num_events = server.num_batches, server.num_events
+            tstart = time.perf_counter()
+            for _ in range(n):
+                t = threading.Thread(target=_client, args=(server.address, authkey, events, latencies, pipeline))
+                t.start()
+                threads.append(t)
+            for t in threads:
+                t.join()
+            duration = time.perf_counter() - tstart
+            latencies = np.array(latencies)
+            results.add('server/clients=%d' % n, num_voxels,
+                        {'median': float(np.median(latencies)), 'min': float(latencies.min()),
+                         'mean': float(latencies.mean()), 'repeat': len(latencies)},
+                        p95=float(np.percentile(latencies, 95)),
+                        throughput=n * num_requests / duration,
+                        mean_batch_size=(server.num_events - num_events) / max(server.num_batches - num_batches, 1))
+    finally:
+        server.close()
+    return results
@@ -0,0 +1,71 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+import copy
+import torch
+from mlreco.benchmark.core import measure, BenchmarkResults
+from mlreco.benchmark.inference import make_config
+
+
+def saved_bytes(fn):
+    """
+    Bytes of the tensors saved for backward while running fn() (activations
+    kept alive until backward), counted with saved tensor hooks.
+    """
+    total = [0]
+
+    def pack(tensor):
+        total[0] += tensor.numel() * tensor.element_size()
+        return tensor
+
+    with torch.autograd.graph.saved_tensors_hooks(pack, lambda tensor: tensor):
+        fn()
+    return total[0]
+
+
+def _trainer(cfg):
+    from mlreco.trainval import trainval
+    from mlreco.iotools.factories import loader_factory
+    from mlreco.utils.device import parse_gpus
+    cfg = copy.deepcopy(cfg)
+    cfg['training']['device'], cfg['training']['gpus'] = parse_gpus(cfg['training']['gpus'])
+    loader, cfg['data_keys'] = loader_factory(cfg)
+    trainer = trainval(cfg)
+    trainer.initialize()
+    batch = next(iter(loader))
+    data_blob = dict([(key, [[batch[i]]]) for i, key in enumerate(cfg['data_keys'])])
+    return trainer, data_blob
+
+
+def run(model_name='uresnet_ppn', num_voxels=[10000], batch_size=4, device='cpu', repeat=5, results=None):
+    """
+    Time of a training step (forward + backward), bytes saved for backward
+    and peak GPU memory, with and without activation checkpointing of the
+    encoder/decoder blocks (module option checkpoint).
+    """
+    results = BenchmarkResults() if results is None else results
+    for size in num_voxels:
+        for checkpoint in [False, True]:
+            cfg = make_config(model_name, size, batch_size, device)
+            cfg['training']['train'] = True
+            cfg['model']['modules'][model_name]['checkpoint'] = checkpoint
+            name = 'training/%s/%s' % (model_name, 'checkpoint' if checkpoint else 'default')
+            try:
+                trainer, data_blob = _trainer(cfg)
+            except ImportError as e:
+                results.add(name, size, skipped=repr(e))
+                continue
+            extra = {'saved_bytes': saved_bytes(lambda: trainer.forward(copy.copy(data_blob)))}
+            trainer.backward()
+            if torch.cuda.is_available() and device != 'cpu':
+                torch.cuda.reset_peak_memory_stats()
+
+            def step():
+                trainer.forward(copy.copy(data_blob))
+                trainer.backward()
+            timing = measure(step, repeat=repeat)
+            if torch.cuda.is_available() and device != 'cpu':
+                extra['max_memory'] = torch.cuda.max_memory_allocated() / 1.e9
+            results.add(name, size, timing, **extra)
+            print('%-40s %10s   %.1f MB saved for backward' % (name, size, extra['saved_bytes'] / 1.e6))
+    return results
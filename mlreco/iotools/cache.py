@@ -0,0 +1,208 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+import os
+import atexit
+import pickle
+import multiprocessing
+import numpy as np
+from multiprocessing import shared_memory
+from torch.utils.data import Dataset
+
+# Header of the shared table
+_CLOCK, _BYTES, _HITS, _MISSES, _EVICTIONS = range(5)
+
+
+def untracked_shared_memory(name, create=False, size=0):
+    """
+    Shared memory block that is not tracked by the multiprocessing resource
+    tracker: cached events outlive the DataLoader workers that wrote them,
+    the cache unlinks its blocks itself.
+    """
+    try:
+        return shared_memory.SharedMemory(name=name, create=create, size=size, track=False)
+    except TypeError:  # Python < 3.13
+        from multiprocessing import resource_tracker
+        shm = shared_memory.SharedMemory(name=name, create=create, size=size)
+        resource_tracker.unregister(shm._name, 'shared_memory')
+        return shm
+
+
+def unlink_shared_memory(shm):
+    """
+    SharedMemory.unlink() without unregistering from the resource tracker
+    (the block is not registered, see untracked_shared_memory)
+    """
+    try:
+        import _posixshmem
+    except ImportError:  # Windows: freed with the last handle
+        return
+    _posixshmem.shm_unlink(shm._name)
+
+
+class SharedEventCache(object):
+    """
+    Parsed events shared by all DataLoader workers, up to max_bytes in total.
+    Each cached event is a pickled tuple in its own shared memory block; a
+    shared table holds the size and last access of every entry, and the
+    least recently used entries are evicted to make room for new ones.
+    Hits, misses and evictions are counted across processes (stats()).
+    """
+    def __init__(self, num_entries, max_bytes):
+        self.num_entries = int(num_entries)
+        self.max_bytes = int(max_bytes)
+        self._prefix = 'mlreco_%d_%s' % (os.getpid(), os.urandom(4).hex())
+        self._lock = multiprocessing.Lock()
+        # Table: header, then per entry size (0: absent, < 0: being written) and last access
+        self._table_shm = untracked_shared_memory(self._prefix, create=True, size=8 * (5 + 2 * self.num_entries))
+        self._attach_table()
+        self._table[:] = 0
+        self._owner = os.getpid()
+        atexit.register(self.close)
+
+    def _attach_table(self):
+        table = np.ndarray((5 + 2 * self.num_entries,), dtype=np.int64, buffer=self._table_shm.buf)
+        self._table = table
+        self._header = table[:5]
+        self._sizes = table[5:5 + self.num_entries]
+        self._ticks = table[5 + self.num_entries:]
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for key in ['_table_shm', '_table', '_header', '_sizes', '_ticks']:
+            del state[key]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._table_shm = untracked_shared_memory(self._prefix)
+        self._attach_table()
+
+    def _name(self, idx):
+        return '%s_%d' % (self._prefix, idx)
+
+    def get(self, idx):
+        """
+        Returns the cached event idx, or None
+        """
+        with self._lock:
+            size = int(self._sizes[idx])
+            if size <= 0:
+                self._header[_MISSES] += 1
+                return None
+            self._header[_CLOCK] += 1
+            self._ticks[idx] = self._header[_CLOCK]
+            self._header[_HITS] += 1
+        try:
+            shm = untracked_shared_memory(self._name(idx))
+        except FileNotFoundError:  # Evicted in the meantime
+            with self._lock:
+                self._header[_HITS] -= 1
+                self._header[_MISSES] += 1
+            return None
+        buf = shm.buf[:size]
+        try:
+            return pickle.loads(buf)
+        finally:
+            buf.release()
+            shm.close()
+
+    def put(self, idx, event):
+        data = pickle.dumps(event, protocol=pickle.HIGHEST_PROTOCOL)
+        size = len(data)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if self._sizes[idx] != 0:
+                return  # Cached or being cached by another worker
+            self._evict(size)
+            self._sizes[idx] = -size
+            self._header[_BYTES] += size
+        try:
+            shm = untracked_shared_memory(self._name(idx), create=True, size=size)
+            shm.buf[:size] = data
+            shm.close()
+        except Exception:
+            with self._lock:
+                self._sizes[idx] = 0
+                self._header[_BYTES] -= size
+            raise
+        with self._lock:
+            self._sizes[idx] = size
+            self._header[_CLOCK] += 1
+            self._ticks[idx] = self._header[_CLOCK]
+
+    def _evict(self, size):
+        """
+        Frees least recently used entries until size more bytes fit (lock held)
+        """
+        if self._header[_BYTES] + size <= self.max_bytes:
+            return
+        cached = np.nonzero(self._sizes > 0)[0]
+        for idx in cached[np.argsort(self._ticks[cached])]:
+            self._unlink(idx)
+            self._header[_BYTES] -= self._sizes[idx]
+            self._header[_EVICTIONS] += 1
+            self._sizes[idx] = 0
+            if self._header[_BYTES] + size <= self.max_bytes:
+                break
+
+    def _unlink(self, idx):
+        try:
+            shm = untracked_shared_memory(self._name(idx))
+            shm.close()
+            unlink_shared_memory(shm)
+        except FileNotFoundError:
+            pass
+
+    def stats(self):
+        with self._lock:
+            header = self._header.copy()
+        return {'hits': int(header[_HITS]), 'misses': int(header[_MISSES]),
+                'evictions': int(header[_EVICTIONS]), 'bytes': int(header[_BYTES])}
+
+    def close(self):
+        """
+        Unlinks every block (only in the process that created the cache)
+        """
+        if os.getpid() != self._owner or self._table_shm is None:
+            return
+        for idx in np.nonzero(self._sizes != 0)[0]:
+            self._unlink(idx)
+        self._table = self._header = self._sizes = self._ticks = None
+        self._table_shm.close()
+        unlink_shared_memory(self._table_shm)
+        self._table_shm = None
+
+
+class CachedDataset(Dataset):
+    """
+    Reads events of dataset through a SharedEventCache of max_bytes.
+    """
+    def __init__(self, dataset, max_bytes):
+        self._dataset = dataset
+        self.cache = SharedEventCache(len(dataset), max_bytes)
+
+    def data_keys(self):
+        return self._dataset.data_keys()
+
+    def __len__(self):
+        return len(self._dataset)
+
+    def __getitem__(self, idx):
+        event = self.cache.get(idx)
+        if event is None:
+            event = self._dataset[idx]
+            self.cache.put(idx, event)
+        return event
+
+
+def find_cache(dataset):
+    """
+    SharedEventCache under a dataset and its wrappers (EventSubset), or None
+    """
+    while dataset is not None:
+        if getattr(dataset, 'cache', None) is not None:
+            return dataset.cache
+        dataset = getattr(dataset, '_dataset', None)
+    return None
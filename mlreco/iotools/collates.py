@@ -2,34 +2,57 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 import numpy as np
+from mlreco.utils.profiling import profiler
 
-def CollateSparse(batch):
-    concat = np.concatenate
-    result  = []
-    for i in range(len(batch[0])):
-        if isinstance(batch[0][i], tuple) and isinstance(batch[0][i][0], np.ndarray) and len(batch[0][i][0].shape)==2:
-            # handle SCN input batch
-            voxels = concat( [ concat( [sample[i][0],
-                                        np.full(shape=[len(sample[i][0]),1], fill_value=batch_id, dtype=np.int32)],
-                                      axis=1 ) for batch_id, sample in enumerate(batch) ],
-                            axis = 0)
-            data = concat([sample[i][1] for sample in batch], axis=0)
-            result.append( concat([voxels, data], axis=1) )
+def CollateSparse(batch, alloc=np.empty):
+    """
+    Concatenates the events of batch, with the batch id as an extra column.
+    Output arrays are allocated with alloc(shape, dtype) and filled in place,
+    so that they can be written directly to shared memory (see iotools.transport).
+    """
+    with profiler.scope('collate'):
+        result  = []
+        for i in range(len(batch[0])):
+            if isinstance(batch[0][i], tuple) and len(batch[0][i])==1:
+                # values of a sparse tensor sharing the voxels of another key (see iotools.shared)
+                values = [sample[i][0] for sample in batch]
+                out    = alloc((sum([len(v) for v in values]), values[0].shape[1]), np.result_type(*[v.dtype for v in values]))
+                start  = 0
+                for v in values:
+                    out[start:start + len(v)] = v
+                    start += len(v)
+                result.append(out)
+
+            elif isinstance(batch[0][i], tuple) and isinstance(batch[0][i][0], np.ndarray) and len(batch[0][i][0].shape)==2:
+                # handle SCN input batch
+                voxels = [sample[i][0] for sample in batch]
+                data   = [sample[i][1] for sample in batch]
+                dtype  = np.result_type(*([v.dtype for v in voxels] + [np.int32] + [d.dtype for d in data]))
+                ndim   = voxels[0].shape[1]
+                out    = alloc((sum([len(v) for v in voxels]), ndim + 1 + data[0].shape[1]), dtype)
+                start  = 0
+                for batch_id, (v, d) in enumerate(zip(voxels, data)):
+                    end = start + len(v)
+                    out[start:end, :ndim]   = v
+                    out[start:end, ndim]    = batch_id
+                    out[start:end, ndim+1:] = d
+                    start = end
+                result.append(out)
 
-        elif isinstance(batch[0][i],np.ndarray) and len(batch[0][i].shape)==1:
-            result.append( concat( [ concat( [np.expand_dims(sample[i],1),
-                                              np.full(shape=[len(sample[i]),1],fill_value=batch_id,dtype=np.float32)],
-                                             axis=1 ) for batch_id,sample in enumerate(batch) ],
-                                   axis=0)
-                           )
-        elif isinstance(batch[0][i],np.ndarray) and len(batch[0][i].shape)==2:
-            result.append( concat( [ concat( [sample[i],
-                                              np.full(shape=[len(sample[i]),1],fill_value=batch_id,dtype=np.float32)],
-                                             axis=1 ) for batch_id,sample in enumerate(batch) ],
-                                   axis=0)
-                           )
-        else:
-            result.append([sample[i] for sample in batch])
+            elif isinstance(batch[0][i],np.ndarray) and len(batch[0][i].shape) in [1, 2]:
+                samples = [sample[i] if len(sample[i].shape) == 2 else np.expand_dims(sample[i],1) for sample in batch]
+                dtype   = np.result_type(*([s.dtype for s in samples] + [np.float32]))
+                ncol    = samples[0].shape[1]
+                out     = alloc((sum([len(s) for s in samples]), ncol + 1), dtype)
+                start   = 0
+                for batch_id, sample in enumerate(samples):
+                    end = start + len(sample)
+                    out[start:end, :ncol] = sample
+                    out[start:end, ncol]  = batch_id
+                    start = end
+                result.append(out)
+            else:
+                result.append([sample[i] for sample in batch])
     return result
 
 
@@ -0,0 +1,134 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+import numpy as np
+import torch
+from mlreco.iotools.collates import CollateSparse
+from mlreco.utils.profiling import profiler
+
+_ALIGNMENT = 8
+_TORCH_DTYPES = {np.dtype(np.uint8): torch.uint8, np.dtype(np.int16): torch.int16, np.dtype(np.int32): torch.int32,
+                 np.dtype(np.int64): torch.int64, np.dtype(np.float32): torch.float32}
+
+
+def _aligned(nbytes):
+    return (nbytes + _ALIGNMENT - 1) // _ALIGNMENT * _ALIGNMENT
+
+
+def _minimal_dtype(values):
+    """
+    Smallest dtype that holds values exactly: uint8 or int16 for integer
+    values (e.g. labels), float32 otherwise.
+    """
+    if not len(values) or not np.all(np.mod(values, 1) == 0):
+        return np.dtype(np.float32)
+    lo, hi = values.min(), values.max()
+    if lo >= 0 and hi < 256:
+        return np.dtype(np.uint8)
+    if lo >= -2**15 and hi < 2**15:
+        return np.dtype(np.int16)
+    return np.dtype(np.float32)
+
+
+class CompactSparseTensor(object):
+    """
+    Batch of sparse tensors packed in one byte buffer: the number of voxels
+    of each event (instead of a batch id column), int16 (or int32)
+    coordinates, and values in their minimal dtype. to(device) copies the
+    buffer once and expands it on the device into the usual (N, 3+1+C)
+    tensor of CollateSparse, in float32; numpy() does the same on the host.
+    """
+    __slots__ = ('buffer', 'num_events', 'num_voxels', 'num_values', 'coord_dtype', 'value_dtype')
+
+    def __init__(self, buffer, num_events, num_voxels, num_values, coord_dtype, value_dtype):
+        self.buffer = buffer
+        self.num_events = num_events
+        self.num_voxels = num_voxels
+        self.num_values = num_values
+        self.coord_dtype = np.dtype(coord_dtype)
+        self.value_dtype = np.dtype(value_dtype)
+
+    @staticmethod
+    def pack(voxels, values, alloc=np.empty):
+        """
+        voxels and values: lists of (N_b, 3) and (N_b, C) arrays, one per event
+        """
+        num_events = len(voxels)
+        num_voxels = sum([len(v) for v in voxels])
+        num_values = values[0].shape[1]
+        max_coord = max([int(np.abs(v).max()) if len(v) else 0 for v in voxels])
+        coord_dtype = np.dtype(np.int16 if max_coord < 2**15 else np.int32)
+        value_dtype = _minimal_dtype(np.concatenate(values, axis=0))
+        sizes = [num_events * 8, num_voxels * 3 * coord_dtype.itemsize, num_voxels * num_values * value_dtype.itemsize]
+        buffer = alloc((sum([_aligned(size) for size in sizes]),), np.uint8)
+        packed = CompactSparseTensor(buffer, num_events, num_voxels, num_values, coord_dtype, value_dtype)
+        counts, coords, out_values = packed._split(buffer, lambda b, dtype: b.view(dtype))
+        start = 0
+        for b, (v, d) in enumerate(zip(voxels, values)):
+            counts[b] = len(v)
+            coords[start:start + len(v)] = v[:, :3]
+            out_values[start:start + len(v)] = d
+            start += len(v)
+        return packed
+
+    @property
+    def nbytes(self):
+        return self.buffer.nbytes
+
+    def __len__(self):
+        return self.num_voxels
+
+    def _split(self, buffer, view):
+        """
+        (counts, coordinates, values) views of buffer
+        """
+        sizes = [self.num_events * 8, self.num_voxels * 3 * self.coord_dtype.itemsize,
+                 self.num_voxels * self.num_values * self.value_dtype.itemsize]
+        dtypes = [np.dtype(np.int64), self.coord_dtype, self.value_dtype]
+        views, start = [], 0
+        for size, dtype in zip(sizes, dtypes):
+            views.append(view(buffer[start:start + size], dtype))
+            start += _aligned(size)
+        return views[0], views[1].reshape((self.num_voxels, 3)), views[2].reshape((self.num_voxels, self.num_values))
+
+    def numpy(self):
+        counts, coords, values = self._split(self.buffer, lambda b, dtype: b.view(dtype))
+        out = np.empty((self.num_voxels, 4 + self.num_values), dtype=np.float32)
+        out[:, :3] = coords
+        out[:, 3] = np.repeat(np.arange(self.num_events), counts)
+        out[:, 4:] = values
+        return out
+
+    def to(self, device):
+        buffer = torch.from_numpy(self.buffer).to(device)
+        with profiler.scope('expand'):
+            counts, coords, values = self._split(buffer, lambda b, dtype: b.view(_TORCH_DTYPES[dtype]))
+            out = torch.empty((self.num_voxels, 4 + self.num_values), dtype=torch.float32, device=buffer.device)
+            out[:, :3] = coords
+            out[:, 3] = torch.repeat_interleave(torch.arange(self.num_events, device=buffer.device), counts)
+            out[:, 4:] = values
+        return out
+
+
+def CompactSparse(batch, alloc=np.empty):
+    """
+    Same as CollateSparse, but sparse tensors are returned as
+    CompactSparseTensor (about 4x fewer bytes to copy to the device).
+    """
+    with profiler.scope('collate'):
+        result = []
+        for i in range(len(batch[0])):
+            if isinstance(batch[0][i], tuple) and isinstance(batch[0][i][0], np.ndarray) and len(batch[0][i][0].shape)==2 \
+                    and np.issubdtype(batch[0][i][0].dtype, np.integer):
+                result.append(CompactSparseTensor.pack([sample[i][0] for sample in batch],
+                                                       [sample[i][1] for sample in batch], alloc=alloc))
+            else:
+                result.append(CollateSparse([(sample[i],) for sample in batch], alloc=alloc)[0])
+    return result
+
+
+def expand(data):
+    """
+    Host (numpy) version of a collated data chunk
+    """
+    return data.numpy() if isinstance(data, CompactSparseTensor) else data
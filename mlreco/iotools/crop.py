@@ -0,0 +1,80 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+import numpy as np
+from torch.utils.data import Dataset
+from mlreco.iotools.shared import shared_sources, attach, detach, coordinates
+
+
+def crop_offset(voxels, spatial_size, mode='center', alignment=1):
+    """
+    Integer offset of the box of spatial_size around voxels: at the lower
+    corner of their bounding box ('min') or centered on it ('center'),
+    rounded down to a multiple of alignment (the coarsest stride of the
+    model, so that coarse outputs map back to whole sites).
+    """
+    if not len(voxels):
+        return np.zeros(3, dtype=np.int64)
+    lo = np.floor(voxels.min(axis=0)).astype(np.int64)
+    hi = np.floor(voxels.max(axis=0)).astype(np.int64)
+    if mode == 'min':
+        offset = lo
+    elif mode == 'center':
+        offset = (lo + hi + 1) // 2 - spatial_size // 2
+    else:
+        raise ValueError('Unknown crop mode %s' % mode)
+    return np.maximum(offset, 0) // alignment * alignment
+
+
+def crop_chunk(chunk, offset, spatial_size):
+    """
+    Shifts the coordinates of a data chunk by -offset and drops the rows
+    outside of [0, spatial_size).
+    """
+    coords = coordinates(chunk)
+    if coords is None:
+        return chunk
+    shifted = coords - offset
+    keep = np.all((shifted >= 0) & (shifted < spatial_size), axis=1)
+    if isinstance(chunk, tuple):
+        voxels = chunk[0][keep]
+        voxels[:, :3] = shifted[keep]
+        return (voxels,) + tuple(c[keep] for c in chunk[1:])
+    out = chunk[keep]
+    out[:, :3] = shifted[keep]
+    return out
+
+
+class CroppedDataset(Dataset):
+    """
+    Crops each event of dataset to a box of spatial_size voxels placed
+    around the voxels of the first data chunk (see crop_offset), so that
+    models can use a smaller spatial_size. Coordinates of all the data
+    chunks are shifted to the box; the shift is returned as an extra 'offset'
+    data chunk of shape (1, 3), before the index, which output formatters
+    add back (see output_formatters.output). Keys of shared (see
+    iotools.shared) are cropped with the voxels of their source. The offset
+    is a multiple of alignment (see crop_offset).
+    """
+    def __init__(self, dataset, spatial_size, mode='center', shared=None, alignment=1):
+        self._dataset = dataset
+        self._sources = shared_sources(dataset.data_keys(), shared)
+        self._spatial_size = int(spatial_size)
+        self._mode = mode
+        self._alignment = int(alignment)
+        keys = dataset.data_keys()
+        self._data_keys = keys[:-1] + ['offset', keys[-1]]
+
+    def data_keys(self):
+        return self._data_keys
+
+    def __len__(self):
+        return len(self._dataset)
+
+    def __getitem__(self, idx):
+        event = attach(self._dataset[idx], self._sources)
+        offset = crop_offset(coordinates(event[0]), self._spatial_size, self._mode, self._alignment)
+        result = list(detach([crop_chunk(chunk, offset, self._spatial_size) for chunk in event[:-1]], self._sources))
+        result.append(offset[None, :].astype(np.float32))
+        result.append(event[-1])
+        return tuple(result)
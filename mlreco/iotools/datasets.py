@@ -2,8 +2,10 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 import os
+import time
 from torch.utils.data import Dataset
-import mlreco.iotools.parsers
+from mlreco.iotools.synthetic import SyntheticEventGenerator
+from mlreco.iotools.shared import shared_sources, value_parser
 
 def _list_files(data_dirs, data_key=None, limit_num_files=0):
     """
@@ -28,7 +30,7 @@ class LArCVDataset(Dataset):
            can be configured with arbitrary number of parser functions where each function can take arbitrary number of
            LArCV event data objects. The assumption is that each data chunk respects the LArCV event boundary.
     """
-    def __init__(self, data_schema, data_dirs, data_key=None, limit_num_files=0):
+    def __init__(self, data_schema, data_dirs, data_key=None, limit_num_files=0, shared_coordinates=None):
         """
         Args: data_dirs ..... a list of data directories to find files (up to 10 files read from each dir)
               data_schema ... a dictionary of string <=> list of strings. The key is a unique name of a data chunk in a batch.
@@ -36,6 +38,8 @@ class LArCVDataset(Dataset):
                               identifies data keys in the input files.
               data_key ..... a string that is required to be present in the filename
               limit_num_files ... an integer limiting number of files to be taken per data directory
+              shared_coordinates ... a dictionary of data key <=> data key with the same voxels. The voxels of the
+                                     former are not decoded, only its values (see iotools.shared)
         """
 
         # Create file list
@@ -45,6 +49,7 @@ class LArCVDataset(Dataset):
             for f in self._files: print('Loading file:',f)
 
         # Instantiate parsers
+        from mlreco.iotools.factories import parsers
         self._data_keys = []
         self._data_parsers = []
         self._trees = {}
@@ -52,14 +57,16 @@ class LArCVDataset(Dataset):
             if len(value) < 2:
                 print('iotools.datasets.schema contains a key %s with list length < 2!' % key)
                 raise ValueError
-            if not hasattr(mlreco.iotools.parsers,value[0]):
+            if not value[0] in parsers:
                 print('The specified parser name %s does not exist!' % value[0])
+            parser = value[0] if key not in (shared_coordinates or {}) else value_parser(key, value[0])
             self._data_keys.append(key)
-            self._data_parsers.append((getattr(mlreco.iotools.parsers,value[0]),value[1:]))
+            self._data_parsers.append((parsers[parser],value[1:]))
             for data_key in value[1:]:
                 if data_key in self._trees: continue
                 self._trees[data_key] = None
         self._data_keys.append('index')
+        shared_sources(self._data_keys, shared_coordinates)
 
         # Prepare TTrees and load files
         from ROOT import TChain
@@ -82,7 +89,9 @@ class LArCVDataset(Dataset):
         data_schema = cfg['schema']
         data_key = None if not 'data_key' in cfg         else str(cfg['data_key'])
         lns     = 0    if not 'limit_num_files' in cfg else int(cfg['limit_num_files'])
-        return LArCVDataset(data_dirs=data_dirs, data_schema=data_schema, data_key=data_key, limit_num_files=lns)
+        shared  = cfg.get('shared_coordinates', None)
+        return LArCVDataset(data_dirs=data_dirs, data_schema=data_schema, data_key=data_key, limit_num_files=lns,
+                            shared_coordinates=shared)
 
     def data_keys(self):
         return self._data_keys
@@ -110,3 +119,94 @@ class LArCVDataset(Dataset):
 
         result.append([idx])
         return tuple(result)
+
+class SyntheticDataset(Dataset):
+    """
+    class: generates LArTPC-like events on the fly instead of reading LArCV files (see iotools.synthetic), to
+           load-test the whole train/inference loop without production data. It takes the same schema as
+           LArCVDataset and returns data chunks in the same format, so that collate functions, models and
+           output formatters are unchanged. Event idx is always the same for a given seed.
+    """
+    def __init__(self, data_schema, num_events=1000, num_voxels=10000, size_distribution='fixed',
+                 size_spread=0.5, seed=0, spatial_size=512, label_tensors=None, latency=0.,
+                 shared_coordinates=None):
+        """
+        Args: data_schema ... same as LArCVDataset. Only the parser function names are used to choose the format,
+                              and the first data key tells whether a sparse tensor holds energy deposits or semantic
+                              labels (if it is in label_tensors, default ['sparse3d_fivetypes']).
+              num_events ..... number of events in the dataset
+              num_voxels ..... (mean) number of voxels per event
+              size_distribution ... 'fixed', 'uniform' (between num_voxels*(1-size_spread) and
+                                    num_voxels*(1+size_spread)) or 'lognormal' (sigma = size_spread)
+              seed ........... events depend only on seed and their index
+              latency ........ seconds to sleep in __getitem__, to emulate slow storage
+              shared_coordinates ... same as LArCVDataset
+        """
+        supported = ['parse_sparse3d_scn', 'parse_sparse3d', 'parse_particles', 'parse_cluster3d']
+        if label_tensors is None:
+            label_tensors = ['sparse3d_fivetypes']
+        if size_distribution not in ['fixed', 'uniform', 'lognormal']:
+            raise ValueError('Unknown size_distribution %s' % size_distribution)
+
+        self._data_keys = []
+        self._data_parsers = []
+        for key, value in data_schema.items():
+            if len(value) < 2:
+                print('iotools.datasets.schema contains a key %s with list length < 2!' % key)
+                raise ValueError
+            if value[0] not in supported:
+                raise ValueError('SyntheticDataset does not support parser %s (key %s)' % (value[0], key))
+            parser = value[0] if key not in (shared_coordinates or {}) else value_parser(key, value[0])
+            self._data_keys.append(key)
+            self._data_parsers.append((parser, value[1] in label_tensors))
+        self._data_keys.append('index')
+        shared_sources(self._data_keys, shared_coordinates)
+
+        self._num_events = num_events
+        self._num_voxels = num_voxels
+        self._size_distribution = size_distribution
+        self._size_spread = size_spread
+        self._seed = seed
+        self._spatial_size = spatial_size
+        self._latency = latency
+
+    @staticmethod
+    def create(cfg):
+        data_schema = cfg['schema']
+        kwargs = {}
+        for key in ['num_events', 'num_voxels', 'seed', 'spatial_size']:
+            if key in cfg: kwargs[key] = int(cfg[key])
+        for key in ['size_spread', 'latency']:
+            if key in cfg: kwargs[key] = float(cfg[key])
+        if 'size_distribution' in cfg: kwargs['size_distribution'] = str(cfg['size_distribution'])
+        if 'label_tensors' in cfg: kwargs['label_tensors'] = list(cfg['label_tensors'])
+        if 'shared_coordinates' in cfg: kwargs['shared_coordinates'] = dict(cfg['shared_coordinates'])
+        return SyntheticDataset(data_schema=data_schema, **kwargs)
+
+    def data_keys(self):
+        return self._data_keys
+
+    def __len__(self):
+        return self._num_events
+
+    def _event_size(self, rng):
+        if self._size_distribution == 'uniform':
+            low = self._num_voxels * (1. - self._size_spread)
+            high = self._num_voxels * (1. + self._size_spread)
+            size = rng.uniform(low, high)
+        elif self._size_distribution == 'lognormal':
+            size = self._num_voxels * rng.lognormal(0., self._size_spread)
+        else:
+            size = self._num_voxels
+        return max(int(size), 1)
+
+    def __getitem__(self, idx):
+        generator = SyntheticEventGenerator(spatial_size=self._spatial_size, seed=[self._seed, idx])
+        event = generator.generate(self._event_size(generator.rng))
+        result = []
+        for parser, is_label in self._data_parsers:
+            result.append(generator.parse(event, parser, is_label))
+        result.append([idx])
+        if self._latency > 0:
+            time.sleep(self._latency)
+        return tuple(result)
@@ -2,6 +2,16 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 from torch.utils.data import DataLoader
+from mlreco.utils.registry import Registry
+
+# Parsers, collate functions, samplers and datasets are looked up by name in
+# their module (imported on first use); register() adds more entries.
+parsers = Registry('parser', module='mlreco.iotools.parsers')
+collates = Registry('collate function', {
+    'CompactSparse': 'mlreco.iotools.compact:CompactSparse'
+}, module='mlreco.iotools.collates')
+samplers = Registry('sampler', module='mlreco.iotools.samplers')
+datasets = Registry('dataset', module='mlreco.iotools.datasets')
 
 
 def loader_handmade(name, batch_size,
@@ -10,12 +20,9 @@ def loader_handmade(name, batch_size,
                     collate_fn=None,
                     sampler=None,
                     **args):
-    import mlreco.iotools.collates
-    import mlreco.iotools.samplers
-    import mlreco.iotools.datasets
-    ds = getattr(mlreco.iotools.datasets,name)(**args)
+    ds = datasets[name](**args)
     if collate_fn is not None:
-        collate_fn = getattr(mlreco.iotools.collates,collate_fn)
+        collate_fn = collates[collate_fn]
         loader = DataLoader(ds,
                             batch_size  = batch_size,
                             shuffle     = shuffle,
@@ -31,35 +38,98 @@ def loader_handmade(name, batch_size,
     return loader,ds.data_keys()
 
 def dataset_factory(cfg):
-    import mlreco.iotools.datasets
+    """
+    Optional stages, in this order:
+      dataset.voxels ........ duplicate voxels are merged, optionally on a
+                              coarser grid (see iotools.reduce)
+      dataset.crop .......... events are cropped to crop.spatial_size voxels
+                              (see iotools.crop)
+      dataset.ppn_targets ... positive sites of the PPN losses are added as
+                              a ppn_targets key (see iotools.ppn_targets)
+      training.cost_log ..... active sites of the events at the strides of
+                              the model are added as an active_sites key
+                              (see iotools.sites)
+      dataset.cache_mb ...... events (after the stages above) are kept in a
+                              shared memory cache of that size (see iotools.cache)
+      dataset.query ......... only the entries of the event index dataset.index
+                              matching the query are exposed (see iotools.index),
+                              the index must have been built from this dataset
+    Keys of dataset.shared_coordinates only hold their values (see
+    iotools.shared).
+    """
     params = cfg['iotool']['dataset']
-    return getattr(mlreco.iotools.datasets, params['name']).create(params)
+    shared = params.get('shared_coordinates', None)
+    modules = cfg.get('model', {}).get('modules', {}).values()
+    num_strides = next((m['num_strides'] for m in modules if 'num_strides' in m), 1)
+    ds = datasets[params['name']].create(params)
+    if 'voxels' in params:
+        from mlreco.iotools.reduce import ReducedDataset
+        ds = ReducedDataset(ds, pitch=params['voxels'].get('pitch', 1), reduce=params['voxels'].get('reduce', None),
+                            shared=shared)
+    if 'crop' in params:
+        from mlreco.iotools.crop import CroppedDataset
+        ds = CroppedDataset(ds, params['crop']['spatial_size'], mode=params['crop'].get('mode', 'center'),
+                            shared=shared, alignment=params['crop'].get('alignment', 2**(num_strides-1)))
+    if 'ppn_targets' in params:
+        from mlreco.iotools.ppn_targets import PPNTargetsDataset
+        targets = params['ppn_targets']
+        ds = PPNTargetsDataset(ds, targets['num_strides'], voxels=targets.get('voxels', None),
+                               particles=targets.get('particles', 'particles_label'),
+                               distance=targets.get('distance', 5.))
+    if cfg.get('training', {}).get('cost_log', False) and num_strides > 1:
+        from mlreco.iotools.sites import ActiveSitesDataset
+        ds = ActiveSitesDataset(ds, num_strides)
+    if params.get('cache_mb', 0):
+        from mlreco.iotools.cache import CachedDataset
+        ds = CachedDataset(ds, int(float(params['cache_mb']) * 1024**2))
+    if 'query' in params:
+        from mlreco.iotools.index import EventIndex, EventSubset
+        index = EventIndex(params['index'])
+        index.check(ds)
+        entries = index.select(params['query'])
+        print('Event query selected %d/%d entries' % (len(entries), len(ds)))
+        ds = EventSubset(ds, entries)
+    return ds
 
 def loader_factory(cfg):
+    """
+    With iotool.shared_memory, workers collate batches into shared memory
+    slabs of shared_memory.slab_mb (see iotools.transport), which requires
+    a collate_fn. The slab of a batch is reused after shared_memory.hold
+    more batches (set by main_funcs.prepare to the batches per iteration).
+    """
     params = cfg['iotool']
     batch_size   = int(params['batch_size'])
     shuffle      = True if not 'shuffle' in params     else bool(params['shuffle'    ])
     num_workers  = 1    if not 'num_workers' in params else int (params['num_workers'])
     collate_fn   = None if not 'collate_fn' in params  else str (params['collate_fn' ])
-    import mlreco.iotools.collates
-    import mlreco.iotools.samplers
     ds = dataset_factory(cfg)
     sampler = None
     if 'sampler' in cfg['iotool']:
         sam_cfg = cfg['iotool']['sampler']
-        sampler = getattr(mlreco.iotools.samplers,sam_cfg['name']).create(ds,sam_cfg)
+        sampler = samplers[sam_cfg['name']].create(ds,sam_cfg)
+    kwargs = {}
     if collate_fn is not None:
-        collate_fn = getattr(mlreco.iotools.collates,collate_fn)
-        loader = DataLoader(ds,
-                            batch_size  = batch_size,
-                            shuffle     = shuffle,
-                            sampler     = sampler,
-                            num_workers = num_workers,
-                            collate_fn  = collate_fn)
+        kwargs['collate_fn'] = collates[collate_fn]
+    if 'shared_memory' in params:
+        if collate_fn is None:
+            raise ValueError('iotool.shared_memory needs a collate_fn')
+        from mlreco.iotools.transport import SlabDataLoader
+        shm_cfg = params['shared_memory']
+        loader = SlabDataLoader(ds,
+                                slab_bytes  = int(float(shm_cfg.get('slab_mb', 256)) * 1024**2),
+                                hold        = int(shm_cfg.get('hold', 1)),
+                                pin         = bool(shm_cfg.get('pin', False)),
+                                batch_size  = batch_size,
+                                shuffle     = shuffle,
+                                sampler     = sampler,
+                                num_workers = num_workers,
+                                **kwargs)
     else:
         loader = DataLoader(ds,
                             batch_size  = batch_size,
                             shuffle     = shuffle,
                             sampler     = sampler,
-                            num_workers = num_workers)
+                            num_workers = num_workers,
+                            **kwargs)
     return loader,ds.data_keys()
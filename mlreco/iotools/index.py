@@ -0,0 +1,202 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+import os
+import numpy as np
+from torch.utils.data import Dataset, DataLoader
+
+
+def _event_roles(data_schema, roles=None):
+    """
+    Which data key holds the input voxels, the semantic labels, the particles
+    and the clusters. Defaults: the first key of the schema for the voxels,
+    'segment_label' for the labels, and the first parse_particles and
+    parse_cluster3d keys.
+    """
+    keys = list(data_schema.keys())
+    defaults = {'data': keys[0] if keys else None,
+                'segmentation': 'segment_label' if 'segment_label' in data_schema else None,
+                'particles': None,
+                'clusters': None}
+    for key, value in data_schema.items():
+        if value[0] == 'parse_particles' and defaults['particles'] is None:
+            defaults['particles'] = key
+        if value[0] == 'parse_cluster3d' and defaults['clusters'] is None:
+            defaults['clusters'] = key
+    if roles:
+        defaults.update(roles)
+    return defaults
+
+
+def _voxels(chunk):
+    """
+    Coordinates of a parser output: (voxels, values) tuple or (N, 3+) array
+    """
+    return chunk[0] if isinstance(chunk, tuple) else chunk[:, :3]
+
+
+def _values(chunk):
+    """
+    Last value column of a parser output, also for (values,) tuples of
+    keys sharing voxels (see iotools.shared)
+    """
+    return chunk[-1][:, -1] if isinstance(chunk, tuple) else chunk[:, -1]
+
+
+def event_stats(event, positions, num_classes):
+    """
+    Statistics of one decoded event (tuple of data chunks, the last one is
+    the index). positions maps a role of _event_roles to a chunk position.
+    """
+    stats = {'entry': event[-1][0], 'num_voxels': 0,
+             'class_counts': np.zeros(num_classes, dtype=np.int64),
+             'num_particles': -1, 'num_clusters': -1,
+             'bbox_min': np.full(3, -1, dtype=np.float32),
+             'bbox_max': np.full(3, -1, dtype=np.float32)}
+    if positions['data'] is not None:
+        voxels = _voxels(event[positions['data']])
+        stats['num_voxels'] = len(voxels)
+        if len(voxels):
+            stats['bbox_min'] = voxels.min(axis=0).astype(np.float32)
+            stats['bbox_max'] = voxels.max(axis=0).astype(np.float32)
+    if positions['segmentation'] is not None:
+        labels = _values(event[positions['segmentation']]).astype(np.int64)
+        stats['class_counts'] = np.bincount(labels, minlength=num_classes)[:num_classes]
+    if positions['particles'] is not None:
+        stats['num_particles'] = len(_voxels(event[positions['particles']]))
+    if positions['clusters'] is not None:
+        stats['num_clusters'] = len(np.unique(_values(event[positions['clusters']])))
+    return stats
+
+
+def _first(batch):
+    return batch[0]
+
+
+class _StatsDataset(Dataset):
+    """
+    Decodes events in DataLoader workers and only returns their statistics
+    """
+    def __init__(self, dataset, positions, num_classes):
+        self._dataset = dataset
+        self._positions = positions
+        self._num_classes = num_classes
+
+    def __len__(self):
+        return len(self._dataset)
+
+    def __getitem__(self, idx):
+        return event_stats(self._dataset[idx], self._positions, self._num_classes)
+
+
+def _source_files(dataset):
+    """
+    Names of the files read by dataset or by the dataset it wraps (none for
+    generated events)
+    """
+    while not hasattr(dataset, '_files') and hasattr(dataset, '_dataset'):
+        dataset = dataset._dataset
+    return [os.path.basename(f) for f in getattr(dataset, '_files', [])]
+
+
+def build_index(dataset, data_schema, path, num_workers=1, num_classes=5, roles=None):
+    """
+    Decodes every event of dataset once (num_workers processes) and writes
+    its statistics to the side-car file path (numpy .npz), one row per entry:
+    num_voxels, class_counts (num_classes columns, from the semantic labels),
+    num_particles, num_clusters (-1 if not in the schema), bbox_min, bbox_max.
+    The dataset length (num_entries) and its file names (files) are stored
+    too, to check that the index matches the dataset it is used with.
+    """
+    roles = _event_roles(data_schema, roles)
+    keys = dataset.data_keys()
+    positions = dict([(role, keys.index(key) if key in keys else None) for role, key in roles.items()])
+    loader = DataLoader(_StatsDataset(dataset, positions, num_classes), batch_size=1, shuffle=False,
+                        num_workers=num_workers, collate_fn=_first)
+    rows = list(loader)
+    table = {}
+    for name in ['entry', 'num_voxels', 'class_counts', 'num_particles', 'num_clusters', 'bbox_min', 'bbox_max']:
+        table[name] = np.array([row[name] for row in rows])
+    if not len(rows):
+        table['class_counts'] = np.zeros((0, num_classes), dtype=np.int64)
+        table['bbox_min'] = table['bbox_max'] = np.zeros((0, 3), dtype=np.float32)
+    table['num_entries'] = np.int64(len(dataset))
+    table['files'] = np.array(_source_files(dataset), dtype=str)
+    np.savez(path, **table)
+    return EventIndex(path)
+
+
+class EventIndex(object):
+    """
+    Per-event statistics written by build_index, to select events without
+    decoding them.
+    """
+    def __init__(self, path):
+        with np.load(path) as f:
+            self.table = dict([(key, f[key]) for key in f.files])
+
+    def __len__(self):
+        return len(self.table['entry'])
+
+    def check(self, dataset):
+        """
+        Raises a ValueError if the index was not built from dataset (other
+        length or other files), e.g. after files were added to the dataset.
+        """
+        if 'num_entries' not in self.table or 'files' not in self.table:
+            raise ValueError('Event index without dataset length and files, rebuild it with bin/build_index.py')
+        if int(self.table['num_entries']) != len(dataset):
+            raise ValueError('Event index of %d entries for a dataset of %d entries, rebuild it with bin/build_index.py'
+                             % (int(self.table['num_entries']), len(dataset)))
+        if list(self.table['files']) != _source_files(dataset):
+            raise ValueError('Event index built from other files than the dataset, rebuild it with bin/build_index.py')
+
+    def select(self, query):
+        """
+        Returns the sorted entries matching all conditions of query:
+          min_voxels, max_voxels ........ number of voxels
+          classes ....................... class ids that must each have voxels
+          exclude_classes ............... class ids that must not have voxels
+          min_particles, max_particles .. number of particles
+          min_clusters, max_clusters .... number of clusters
+        """
+        t = self.table
+        mask = np.ones(len(self), dtype=bool)
+        for name in ['voxels', 'particles', 'clusters']:
+            column = t['num_' + name]
+            if 'min_' + name in query:
+                mask &= column >= query['min_' + name]
+            if 'max_' + name in query:
+                mask &= column <= query['max_' + name]
+        num_classes = t['class_counts'].shape[1]
+        for c in list(query.get('classes', [])) + list(query.get('exclude_classes', [])):
+            if not 0 <= c < num_classes:
+                raise ValueError('Class %s of the event query is not in the index (classes 0 to %d)' % (c, num_classes-1))
+        for c in query.get('classes', []):
+            mask &= t['class_counts'][:, c] > 0
+        for c in query.get('exclude_classes', []):
+            mask &= t['class_counts'][:, c] == 0
+        unknown = set(query.keys()) - set(['min_voxels', 'max_voxels', 'classes', 'exclude_classes',
+                                           'min_particles', 'max_particles', 'min_clusters', 'max_clusters'])
+        if unknown:
+            raise ValueError('Unknown event query keys %s' % sorted(unknown))
+        return np.sort(t['entry'][mask])
+
+
+class EventSubset(Dataset):
+    """
+    Exposes only the given entries of a dataset. The index data chunk still
+    holds the entry in the full dataset.
+    """
+    def __init__(self, dataset, entries):
+        self._dataset = dataset
+        self.entries = np.asarray(entries, dtype=np.int64)
+
+    def data_keys(self):
+        return self._dataset.data_keys()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __getitem__(self, idx):
+        return self._dataset[int(self.entries[idx])]
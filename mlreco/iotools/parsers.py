@@ -2,7 +2,6 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 import numpy as np
-from larcv import larcv
 from mlreco.utils.ppn import get_ppn_info
 
 
@@ -16,6 +15,7 @@ def parse_sparse3d_scn(data):
         voxels - numpy array(int32) with shape (N,3) - coordinates
         data   - numpy array(float32) with shape (N,1) - pixel value
     """
+    from larcv import larcv
     event_tensor3d = data[0]
     num_point = event_tensor3d.as_vector().size()
     np_voxels = np.empty(shape=(num_point,3),dtype=np.int32)
@@ -25,6 +25,23 @@ def parse_sparse3d_scn(data):
     return np_voxels, np_data
 
 
+def parse_sparse3d_scn_values(data):
+    """
+    Same as parse_sparse3d_scn without the voxel coordinates, for a tensor
+    with the same voxels as another data key (see iotools.shared)
+    Args:
+        length 1 array of larcv::EventSparseTensor3D
+    Return:
+        tuple of data - numpy array(float32) with shape (N,1) - pixel value
+    """
+    from larcv import larcv
+    event_tensor3d = data[0]
+    num_point = event_tensor3d.as_vector().size()
+    np_data   = np.empty(shape=(num_point,1),dtype=np.float32)
+    larcv.fill_3d_pcloud(event_tensor3d, np_data)
+    return (np_data,)
+
+
 def parse_sparse3d(data):
     """
     A function to retrieve sparse tensor from larcv::EventSparseTensor3D object
@@ -33,6 +50,7 @@ def parse_sparse3d(data):
     Return:
         a numpy array with the shape (N,4) where 4=3+1 represents (x,y,z) coordinate and stored pixel value.
     """
+    from larcv import larcv
     event_tensor3d = data[0]
     num_point = event_tensor3d.as_vector().size()
     np_data   = np.empty(shape=(num_point,4),dtype=np.float32)
@@ -0,0 +1,81 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+import itertools
+import numpy as np
+from torch.utils.data import Dataset
+
+# Levels of the target sites (last column of the ppn_targets data chunk)
+VOXELS, PPN1, PPN2 = 0, 1, 2
+
+
+def _near_sites(points, stride):
+    """
+    Non-negative integer sites closer than 1 to points / stride
+    """
+    scaled = points / stride
+    offsets = np.array(list(itertools.product([0, 1], repeat=3)))
+    sites = (np.floor(scaled)[:, None, :] + offsets[None]).reshape(-1, 3)
+    close = np.sqrt(((sites - np.repeat(scaled, len(offsets), axis=0))**2).sum(axis=1)) < 1
+    sites = sites[close & np.all(sites >= 0, axis=1)]
+    return np.unique(sites, axis=0)
+
+
+def ppn_targets(voxels, points, num_strides, distance=5.):
+    """
+    Positive sites of the PPN losses of one event, as computed from the
+    particle points in PPNLoss / uresnet_ppn SegmentationLoss:
+      VOXELS ... voxels closer than distance to a point (PPN scores)
+      PPN1 ..... sites at stride 2**(num_strides-1) closer than 1 to a
+                 scaled point (ppn1 scores)
+      PPN2 ..... same at stride 2**int(num_strides/2) (ppn2 scores)
+    Args: voxels ... (N, 3) coordinates
+          points ... (N_gt, 3+) particle points
+    Return: (M, 3) int32 site coordinates, (M, 1) float32 levels
+    """
+    points = points[:, :3].astype(np.float64)
+    sites, levels = [np.empty((0, 3))], [np.empty(0)]
+    if len(points):
+        coords = voxels[:, :3].astype(np.float64)
+        near = np.zeros(len(coords), dtype=bool)
+        for point in points:
+            near |= np.sqrt(((coords - point)**2).sum(axis=1)) < distance
+        strides = [(VOXELS, None), (PPN1, 2**(num_strides-1)), (PPN2, 2**int(num_strides/2))]
+        for level, stride in strides:
+            level_sites = coords[near] if stride is None else _near_sites(points, stride)
+            sites.append(level_sites)
+            levels.append(np.full(len(level_sites), level))
+    return np.concatenate(sites).astype(np.int32), np.concatenate(levels).astype(np.float32)[:, None]
+
+
+class PPNTargetsDataset(Dataset):
+    """
+    Adds the positive sites of the PPN losses (see ppn_targets) of each
+    event as an extra 'ppn_targets' data chunk, before the index, so that
+    they are computed once in the DataLoader workers (and cached with the
+    event, see iotools.cache) instead of at every training step. Losses
+    take it as their targets argument (model.loss_kwargs).
+    voxels and particles are the data keys of the voxels (default: the
+    first key) and of the particle points.
+    """
+    def __init__(self, dataset, num_strides, voxels=None, particles='particles_label', distance=5.):
+        self._dataset = dataset
+        self._num_strides = int(num_strides)
+        self._distance = float(distance)
+        keys = dataset.data_keys()
+        self._voxels = keys.index(voxels) if voxels is not None else 0
+        self._particles = keys.index(particles)
+        self._data_keys = keys[:-1] + ['ppn_targets', keys[-1]]
+
+    def data_keys(self):
+        return self._data_keys
+
+    def __len__(self):
+        return len(self._dataset)
+
+    def __getitem__(self, idx):
+        event = self._dataset[idx]
+        voxels = event[self._voxels]
+        voxels = voxels[0] if isinstance(voxels, tuple) else voxels[:, :3]
+        targets = ppn_targets(voxels, event[self._particles][0], self._num_strides, self._distance)
+        return tuple(event[:-1]) + (targets, event[-1])
@@ -0,0 +1,80 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+import numpy as np
+from torch.utils.data import Dataset
+from mlreco.iotools.shared import shared_sources, attach, detach
+
+
+def reduce_voxels(voxels, values, pitch=1, reduce='sum'):
+    """
+    Merges voxels with the same coordinates after division by pitch. Values
+    of merged voxels are reduced column-wise by 'sum', 'mean', 'max' or 'min'.
+    Output voxels are sorted by linearized coordinates, so that tensors with
+    the same voxels come out in the same order.
+    Args: voxels ... (N, 3) non-negative coordinates
+          values ... (N, C) values
+    Return: (M, 3) voxels, (M, C) values
+    """
+    coords = np.floor_divide(voxels, pitch).astype(np.int64)
+    if not len(coords):
+        return voxels[:0, :3].astype(voxels.dtype), values[:0]
+    dims = tuple(coords.max(axis=0) + 1)
+    keys = np.ravel_multi_index(coords.T, dims)
+    unique, inverse, counts = np.unique(keys, return_inverse=True, return_counts=True)
+    inverse = inverse.reshape(-1)
+    out_voxels = np.stack(np.unravel_index(unique, dims), axis=1).astype(voxels.dtype)
+    out_values = np.empty((len(unique), values.shape[1]), dtype=values.dtype)
+    if reduce in ['sum', 'mean']:
+        for c in range(values.shape[1]):
+            out_values[:, c] = np.bincount(inverse, weights=values[:, c], minlength=len(unique)) / \
+                (counts if reduce == 'mean' else 1)
+    elif reduce in ['max', 'min']:
+        # Sorted by voxel then value: groups end with their max and start with their min
+        ends = np.cumsum(counts) - 1
+        position = ends if reduce == 'max' else ends - counts + 1
+        for c in range(values.shape[1]):
+            order = np.lexsort((values[:, c], inverse))
+            out_values[:, c] = values[order[position], c]
+    else:
+        raise ValueError('Unknown voxel reduction %s' % reduce)
+    return out_voxels, out_values
+
+
+class ReducedDataset(Dataset):
+    """
+    Merges duplicate voxels of the sparse tensors of each event, optionally
+    on a coarser grid of pitch voxels. reduce maps data keys to a reduction
+    (see reduce_voxels); by default keys ending with _label use 'max' and
+    the others 'sum'. Point coordinates (e.g. PPN labels) are divided by
+    pitch, other data chunks are unchanged. Keys of shared (see
+    iotools.shared) are reduced on the voxels of their source.
+    """
+    def __init__(self, dataset, pitch=1, reduce=None, shared=None):
+        self._dataset = dataset
+        self._pitch = pitch
+        self._sources = shared_sources(dataset.data_keys(), shared)
+        reduce = reduce or {}
+        if isinstance(reduce, str):
+            reduce = dict([(key, reduce) for key in dataset.data_keys()])
+        self._reduce = [reduce.get(key, 'max' if key.endswith('_label') else 'sum') for key in dataset.data_keys()]
+
+    def data_keys(self):
+        return self._dataset.data_keys()
+
+    def __len__(self):
+        return len(self._dataset)
+
+    def _reduce_chunk(self, chunk, reduce):
+        if isinstance(chunk, tuple) and isinstance(chunk[0], np.ndarray) and len(chunk[0].shape) == 2:
+            if np.issubdtype(chunk[0].dtype, np.integer):  # Voxels
+                return reduce_voxels(chunk[0], chunk[1], self._pitch, reduce)
+            return (chunk[0] / self._pitch,) + tuple(chunk[1:])  # Points
+        if isinstance(chunk, np.ndarray) and len(chunk.shape) == 2 and chunk.shape[1] > 3:
+            voxels, values = reduce_voxels(chunk[:, :3], chunk[:, 3:], self._pitch, reduce)
+            return np.concatenate([voxels, values], axis=1)
+        return chunk
+
+    def __getitem__(self, idx):
+        event = attach(self._dataset[idx], self._sources)
+        return detach([self._reduce_chunk(chunk, reduce) for chunk, reduce in zip(event, self._reduce)], self._sources)
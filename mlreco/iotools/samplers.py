@@ -29,3 +29,35 @@ class RandomSequenceSampler(Sampler):
     @staticmethod
     def create(ds,cfg):
         return RandomSequenceSampler(len(ds),cfg['batch_size'])
+
+
+class ShardSampler(Sampler):
+    """
+    Iterates in order over the entries shard, shard+num_shards, shard+2*num_shards...
+    so that num_shards processes cover the dataset exactly once together.
+    Entries in exclude (e.g. already processed) are skipped.
+    """
+    def __init__(self,data_size,num_shards,shard,exclude=None):
+        self._data_size  = int(data_size)
+        self._num_shards = int(num_shards)
+        self._shard      = int(shard)
+        if self._num_shards < 1 or self._shard < 0 or self._shard >= self._num_shards:
+            print(self.__class__.__name__,'received invalid shard',shard,'of',num_shards)
+            raise ValueError
+        exclude = set(exclude) if exclude else set()
+        self._entries = [i for i in range(self._shard,self._data_size,self._num_shards) if i not in exclude]
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __iter__(self):
+        return iter(self._entries)
+
+    @staticmethod
+    def create(ds,cfg):
+        exclude = cfg.get('exclude',None)
+        if exclude and hasattr(ds,'entries'):
+            # Subset of a dataset (EventSubset): exclude holds full dataset entries
+            exclude = set(exclude)
+            exclude = [i for i,entry in enumerate(ds.entries) if entry in exclude]
+        return ShardSampler(len(ds),cfg['num_shards'],cfg['shard'],exclude)
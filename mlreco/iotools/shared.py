@@ -0,0 +1,98 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+import numpy as np
+import torch
+
+# Parser of the values only, for the parsers of keys that can share voxels
+VALUE_PARSERS = {'parse_sparse3d_scn': 'parse_sparse3d_scn_values'}
+
+
+def shared_sources(data_keys, shared=None):
+    """
+    Position in data_keys of the coordinate source of each data key, None
+    for keys with their own voxels.
+    shared maps data keys to the key they share their voxels with, e.g.
+    {'segment_label': 'input_data'}. Such keys are parsed as a 1-tuple
+    (values,) instead of (voxels, values).
+    """
+    shared = shared or {}
+    for key, source in shared.items():
+        if key not in data_keys or source not in data_keys:
+            raise ValueError('shared_coordinates %s: %s are not both data keys' % (key, source))
+        if source in shared:
+            raise ValueError('shared_coordinates %s: source %s has no voxels of its own' % (key, source))
+    return [data_keys.index(shared[key]) if key in shared else None for key in data_keys]
+
+
+def value_parser(key, parser_name):
+    """
+    Name of the parser to use for a data key that shares its voxels
+    """
+    if parser_name not in VALUE_PARSERS:
+        raise ValueError('shared_coordinates %s: parser %s cannot share voxels' % (key, parser_name))
+    return VALUE_PARSERS[parser_name]
+
+
+def coordinates(chunk):
+    """
+    Coordinates of a parser output: (voxels, values) tuple or (N, 3+) array,
+    None for other outputs (e.g. the index list)
+    """
+    if isinstance(chunk, tuple) and isinstance(chunk[0], np.ndarray) and len(chunk[0].shape) == 2:
+        return chunk[0][:, :3]
+    if isinstance(chunk, np.ndarray) and len(chunk.shape) == 2 and chunk.shape[1] >= 3:
+        return chunk[:, :3]
+    return None
+
+
+def attach(event, sources):
+    """
+    Event with the (values,) chunks turned back to (voxels, values) tuples
+    using the voxels of their source, for dataset wrappers that move voxels
+    (see iotools.reduce and iotools.crop)
+    """
+    return tuple([chunk if source is None else (event[source][0], chunk[0])
+                  for chunk, source in zip(event, sources)])
+
+
+def detach(event, sources):
+    """
+    Inverse of attach
+    """
+    return tuple([chunk if source is None else (chunk[1],) for chunk, source in zip(event, sources)])
+
+
+def join_coordinates(source, values, data_dim=3):
+    """
+    Collated sparse tensor (N, data_dim+1+C) from the coordinates and batch
+    ids of its collated source and its collated values (N, C), as numpy
+    arrays or tensors on the same device.
+    """
+    columns = data_dim + 1
+    if isinstance(source, torch.Tensor):
+        return torch.cat([source[:, :columns], values.to(source.dtype)], dim=1)
+    return np.concatenate([source[:, :columns], np.asarray(values, dtype=source.dtype)], axis=1)
+
+
+def join_shared(data_blob, shared, data_dim=3):
+    """
+    Replaces in place the collated values of the shared keys of data_blob
+    (key -> list of minibatches) by full sparse tensors (see join_coordinates)
+    """
+    for key, source in (shared or {}).items():
+        if key in data_blob and source in data_blob:
+            data_blob[key] = [join_coordinates(s, v, data_dim) for s, v in zip(data_blob[source], data_blob[key])]
+    return data_blob
+
+
+def label_columns(label, coordinates=None, data_dim=3):
+    """
+    Coordinates (N, data_dim), batch ids (N,) and values (N, 1) of a collated
+    label tensor (N, data_dim+1+1), or of the collated values (N, 1) of a
+    shared key and the collated tensor of its source (coordinates), so that
+    losses do not need the joined tensor.
+    """
+    if coordinates is None:
+        return label[:, :-2], label[:, -2], label[:, -1:]
+    return coordinates[:, :data_dim], coordinates[:, data_dim], label[:, -1:]
@@ -0,0 +1,34 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+import numpy as np
+from torch.utils.data import Dataset
+from mlreco.iotools.shared import coordinates
+from mlreco.utils.cost_model import active_sites
+
+
+class ActiveSitesDataset(Dataset):
+    """
+    Adds the number of active sites of each event at strides 2, 4, ...
+    2**(num_strides-1) (see utils.cost_model.active_sites), computed on the
+    voxels of the first data chunk, as an extra 'active_sites' data chunk of
+    shape (1, num_strides-1) before the index. Computed in the loader
+    workers for the cost log (training.cost_log), rather than in the
+    training step it measures.
+    """
+    def __init__(self, dataset, num_strides):
+        self._dataset = dataset
+        self._num_strides = int(num_strides)
+        keys = dataset.data_keys()
+        self._data_keys = keys[:-1] + ['active_sites', keys[-1]]
+
+    def data_keys(self):
+        return self._data_keys
+
+    def __len__(self):
+        return len(self._dataset)
+
+    def __getitem__(self, idx):
+        event = self._dataset[idx]
+        sites = active_sites(coordinates(event[0]), self._num_strides)
+        return tuple(event[:-1]) + (np.array([sites], dtype=np.float32).reshape(1, -1), event[-1])
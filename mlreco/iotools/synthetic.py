@@ -0,0 +1,139 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+import numpy as np
+
+# Semantic classes, same convention as sparse3d_fivetypes
+HIP, MIP, SHOWER, DELTA, MICHEL = 0, 1, 2, 3, 4
+
+
+class SyntheticEventGenerator(object):
+    """
+    Generates LArTPC-like sparse 3D events without any input file:
+    track-like lines (HIP/MIP), shower-like blobs, delta rays and Michel
+    stubs at the end of MIP tracks. Each generated particle comes with its
+    ground truth points (same types as mlreco.utils.ppn.get_ppn_info) and a
+    cluster id for each of its voxels.
+
+    Use generate(num_voxels) to get an event dictionary, then parse(event,
+    parser_name, is_label) to get it in the output format of the parsers of
+    mlreco.iotools.parsers.
+    """
+    def __init__(self, spatial_size=512, seed=None):
+        self.spatial_size = spatial_size
+        self.rng = np.random.RandomState(seed)
+
+    def _direction(self):
+        d = self.rng.normal(size=3)
+        return d / np.linalg.norm(d)
+
+    def _start(self, margin=0.1):
+        low, high = margin * self.spatial_size, (1. - margin) * self.spatial_size
+        return self.rng.uniform(low, high, size=3)
+
+    def _line(self, start, direction, length):
+        t = np.arange(0., length, 0.5)
+        return start[None, :] + t[:, None] * direction[None, :]
+
+    def _track(self, num_voxels, semantic):
+        start, direction = self._start(), self._direction()
+        points = self._line(start, direction, num_voxels)
+        end = points[-1]
+        energy = self.rng.normal(2. if semantic == HIP else 1., 0.1, size=len(points))
+        truth = [(start, semantic), (end, semantic)]
+        objects = [(points, energy, semantic, truth)]
+        if semantic == MIP:
+            # Michel electron at the end of some muons
+            if self.rng.uniform() < 0.5:
+                michel = self._line(end, self._direction(), self.rng.randint(10, 25))
+                objects.append((michel, self.rng.exponential(1., size=len(michel)), MICHEL, [(end, MICHEL)]))
+            # Delta ray from a random point along the track
+            if self.rng.uniform() < 0.5:
+                origin = points[self.rng.randint(len(points))]
+                delta = self._line(origin, self._direction(), self.rng.randint(5, 15))
+                objects.append((delta, self.rng.exponential(0.5, size=len(delta)), DELTA, [(origin, DELTA)]))
+        return objects
+
+    def _shower(self, num_voxels):
+        start, direction = self._start(), self._direction()
+        depth = self.rng.exponential(num_voxels ** (1. / 3.) * 2., size=num_voxels)
+        spread = 0.3 * depth + 0.5
+        points = start[None, :] + depth[:, None] * direction[None, :] \
+            + self.rng.normal(size=(num_voxels, 3)) * spread[:, None]
+        energy = self.rng.exponential(0.5, size=num_voxels)
+        return [(points, energy, SHOWER, [(start, SHOWER)])]
+
+    def generate(self, num_voxels):
+        """
+        Returns a dictionary with
+            voxels (N, 3) int32, unique coordinates
+            energy (N,) float32
+            segment (N,) int32 semantic class
+            cluster (N,) int32 particle id
+            particles (N_gt, 3) float32 ground truth points
+            particle_types (N_gt,) int32
+        where N = num_voxels.
+        """
+        chunks, truth = [], []
+        total, particle_id = 0, 0
+        target = num_voxels
+        while True:
+            while total < target:
+                budget = max(target - total, 10)
+                r = self.rng.uniform()
+                if r < 0.4:
+                    objects = self._track(min(budget, self.rng.randint(50, 400)), MIP)
+                elif r < 0.6:
+                    objects = self._track(min(budget, self.rng.randint(20, 100)), HIP)
+                else:
+                    objects = self._shower(min(budget, self.rng.randint(100, 2000)))
+                for points, energy, semantic, points_truth in objects:
+                    chunks.append((points, energy, semantic, particle_id))
+                    truth.extend(points_truth)
+                    total += len(points)
+                    particle_id += 1
+
+            voxels = np.concatenate([c[0] for c in chunks], axis=0)
+            voxels = np.clip(np.floor(voxels), 0, self.spatial_size - 1).astype(np.int32)
+            # Keep the first occurence of each voxel, in generation order
+            _, index = np.unique(voxels, axis=0, return_index=True)
+            if len(index) >= num_voxels:
+                break
+            # Overlapping points: generate more
+            target = total + 2 * (num_voxels - len(index))
+
+        index = np.sort(index)[:num_voxels]
+        energy = np.concatenate([c[1] for c in chunks]).astype(np.float32)
+        segment = np.concatenate([np.full(len(c[0]), c[2], dtype=np.int32) for c in chunks])
+        cluster = np.concatenate([np.full(len(c[0]), c[3], dtype=np.int32) for c in chunks])
+        particles = np.array([p for p, _ in truth], dtype=np.float32).reshape((-1, 3))
+        particle_types = np.array([t for _, t in truth], dtype=np.int32)
+        return {
+            'voxels': voxels[index],
+            'energy': np.abs(energy[index]),
+            'segment': segment[index],
+            'cluster': cluster[index],
+            'particles': particles,
+            'particle_types': particle_types
+        }
+
+    def parse(self, event, parser_name, is_label=False):
+        """
+        Returns the event in the output format of the given parser function
+        of mlreco.iotools.parsers. is_label selects the semantic labels
+        instead of the energy deposits for sparse tensors.
+        """
+        values = event['segment'] if is_label else event['energy']
+        values = values.astype(np.float32)[:, None]
+        if parser_name == 'parse_sparse3d_scn':
+            return event['voxels'], values
+        elif parser_name == 'parse_sparse3d_scn_values':
+            return (values,)
+        elif parser_name == 'parse_sparse3d':
+            return np.concatenate([event['voxels'].astype(np.float32), values], axis=1)
+        elif parser_name == 'parse_particles':
+            return event['particles'], event['particle_types'].astype(np.float32)[:, None]
+        elif parser_name == 'parse_cluster3d':
+            return event['voxels'], event['cluster'][:, None]
+        else:
+            raise ValueError('Synthetic events do not support parser %s' % parser_name)
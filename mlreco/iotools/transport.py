@@ -0,0 +1,215 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+import os
+import time
+import atexit
+import collections
+import multiprocessing
+import numpy as np
+from torch.utils.data import DataLoader
+from mlreco.iotools.cache import untracked_shared_memory, unlink_shared_memory
+from mlreco.iotools.compact import CompactSparseTensor
+
+_ALIGNMENT = 64
+
+
+class SlabRing(object):
+    """
+    num_slabs preallocated shared memory blocks of slab_bytes each. A
+    DataLoader worker acquires a free slab, collates a batch into it and
+    only sends back where the arrays are (SlabBatch); the main process maps
+    them without copying and releases the slab once the batch is consumed.
+    With pin, slabs are page-locked for faster host to GPU copies.
+    """
+    def __init__(self, num_slabs, slab_bytes, pin=False):
+        self.num_slabs = int(num_slabs)
+        self.slab_bytes = int(slab_bytes)
+        self._prefix = 'mlreco_slab_%d_%s' % (os.getpid(), os.urandom(4).hex())
+        self._lock = multiprocessing.Lock()
+        self._state_shm = untracked_shared_memory(self._prefix, create=True, size=self.num_slabs)
+        self._slabs = [untracked_shared_memory('%s_%d' % (self._prefix, i), create=True, size=self.slab_bytes)
+                       for i in range(self.num_slabs)]
+        self._attach()
+        self._state[:] = 0
+        self._owner = os.getpid()
+        self._pinned = []
+        if pin:
+            self._pin()
+        atexit.register(self.close)
+
+    def _attach(self):
+        self._state = np.ndarray((self.num_slabs,), dtype=np.uint8, buffer=self._state_shm.buf)
+        self._buffers = [np.ndarray((self.slab_bytes,), dtype=np.uint8, buffer=slab.buf) for slab in self._slabs]
+
+    def _pin(self):
+        import torch
+        if not torch.cuda.is_available():
+            return
+        cudart = torch.cuda.cudart()
+        for buf in self._buffers:
+            if cudart.cudaHostRegister(buf.ctypes.data, self.slab_bytes, 0) == 0:
+                self._pinned.append(buf.ctypes.data)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for key in ['_state_shm', '_slabs', '_state', '_buffers']:
+            del state[key]
+        state['_pinned'] = []
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._state_shm = untracked_shared_memory(self._prefix)
+        self._slabs = [untracked_shared_memory('%s_%d' % (self._prefix, i)) for i in range(self.num_slabs)]
+        self._attach()
+
+    def acquire(self, timeout=60.):
+        tstart = time.time()
+        while True:
+            with self._lock:
+                free = np.nonzero(self._state == 0)[0]
+                if len(free):
+                    self._state[free[0]] = 1
+                    return int(free[0])
+            if time.time() - tstart > timeout:
+                raise RuntimeError('No free shared memory slab after %g s (%d slabs)' % (timeout, self.num_slabs))
+            time.sleep(0.0005)
+
+    def release(self, slab):
+        with self._lock:
+            # Closed (e.g. at exit before a generator's cleanup): nothing to release
+            if self._state is not None:
+                self._state[slab] = 0
+
+    def array(self, slab, offset, shape, dtype):
+        return np.ndarray(shape, dtype=dtype, buffer=self._buffers[slab], offset=offset)
+
+    def close(self):
+        if os.getpid() != self._owner or self._slabs is None:
+            return
+        if self._pinned:
+            import torch
+            for ptr in self._pinned:
+                torch.cuda.cudart().cudaHostUnregister(ptr)
+        self._state = self._buffers = None
+        for shm in self._slabs + [self._state_shm]:
+            shm.close()
+            unlink_shared_memory(shm)
+        self._slabs = None
+
+
+class _SlabFull(Exception):
+    pass
+
+
+class _SlabAllocator(object):
+    """
+    alloc(shape, dtype) for collate functions: bump allocation in one slab
+    """
+    def __init__(self, ring, slab):
+        self._ring = ring
+        self._slab = slab
+        self._offset = 0
+        self.arrays = {}
+
+    def __call__(self, shape, dtype):
+        dtype = np.dtype(dtype)
+        nbytes = int(np.prod(shape)) * dtype.itemsize
+        if self._offset + nbytes > self._ring.slab_bytes:
+            raise _SlabFull()
+        out = self._ring.array(self._slab, self._offset, shape, dtype)
+        self.arrays[id(out)] = (self._offset, tuple(shape), dtype.str)
+        self._offset += (nbytes + _ALIGNMENT - 1) // _ALIGNMENT * _ALIGNMENT
+        return out
+
+
+# Kinds of data chunks in a SlabBatch layout
+_ARRAY, _COMPACT, _OBJECT = 0, 1, 2
+
+
+class SlabBatch(object):
+    """
+    Collated batch in a slab: layout holds, for each data chunk, its kind
+    and either (offset, shape, dtype) of an array in the slab, the same for
+    the buffer of a CompactSparseTensor with its other fields, or the chunk
+    itself (e.g. index lists).
+    """
+    __slots__ = ('slab', 'layout')
+
+    def __init__(self, slab, layout):
+        self.slab = slab
+        self.layout = layout
+
+    def materialize(self, ring):
+        result = []
+        for kind, item in self.layout:
+            if kind == _ARRAY:
+                result.append(ring.array(self.slab, *item))
+            elif kind == _COMPACT:
+                result.append(CompactSparseTensor(ring.array(self.slab, *item[0]), *item[1]))
+            else:
+                result.append(item)
+        return result
+
+
+def _layout(item, arrays):
+    if id(item) in arrays:
+        return (_ARRAY, arrays[id(item)])
+    if isinstance(item, CompactSparseTensor) and id(item.buffer) in arrays:
+        return (_COMPACT, (arrays[id(item.buffer)], (item.num_events, item.num_voxels, item.num_values,
+                                                     item.coord_dtype.str, item.value_dtype.str)))
+    return (_OBJECT, item)
+
+
+class SlabCollate(object):
+    """
+    Runs collate_fn (which must accept alloc, like CollateSparse and
+    CompactSparse) in a DataLoader worker with its outputs in a slab of ring. Batches that do
+    not fit in a slab are returned as usual.
+    """
+    def __init__(self, ring, collate_fn):
+        self._ring = ring
+        self._collate_fn = collate_fn
+        self._warned = False
+
+    def __call__(self, batch):
+        slab = self._ring.acquire()
+        alloc = _SlabAllocator(self._ring, slab)
+        try:
+            result = self._collate_fn(batch, alloc=alloc)
+        except _SlabFull:
+            self._ring.release(slab)
+            if not self._warned:
+                print('Batch larger than a shared memory slab (%d bytes), increase slab_mb' % self._ring.slab_bytes)
+                self._warned = True
+            return self._collate_fn(batch)
+        layout = [_layout(item, alloc.arrays) for item in result]
+        return SlabBatch(slab, layout)
+
+
+class SlabDataLoader(DataLoader):
+    """
+    DataLoader whose workers collate into a SlabRing. The batches it yields
+    are the usual lists of numpy arrays, backed by shared memory: the slab of
+    a batch is reused once hold more batches have been yielded, so a batch
+    must not be kept longer than that. Held batches carry over from one epoch
+    to the next (e.g. main_funcs.cycle), so an iteration can span two epochs.
+    """
+    def __init__(self, dataset, collate_fn, slab_bytes, hold=1, pin=False, **kwargs):
+        num_workers = kwargs.get('num_workers', 0)
+        prefetch = (kwargs.get('prefetch_factor', None) or 2) if num_workers > 0 else 0
+        # In flight: prefetched batches, held batches, and the one being collated
+        self.ring = SlabRing(max(num_workers, 1) * max(prefetch, 1) + hold + 1, slab_bytes, pin=pin)
+        self.hold = hold
+        self._held = collections.deque()
+        super(SlabDataLoader, self).__init__(dataset, collate_fn=SlabCollate(self.ring, collate_fn), **kwargs)
+
+    def __iter__(self):
+        for batch in super(SlabDataLoader, self).__iter__():
+            if isinstance(batch, SlabBatch):
+                self._held.append(batch.slab)
+                batch = batch.materialize(self.ring)
+            while len(self._held) > self.hold:
+                self.ring.release(self._held.popleft())
+            yield batch
@@ -5,22 +5,32 @@ import os
 import time
 import datetime
 import glob
-import sys
 import numpy as np
 import torch
 import pprint
 import itertools
+import functools
 from mlreco.trainval import trainval
 from mlreco.iotools.factories import loader_factory
+from mlreco.iotools.cache import find_cache
+from mlreco.iotools.compact import expand
+from mlreco.iotools.shared import join_coordinates
 from mlreco.utils import utils
-from mlreco import analysis
+from mlreco.utils.data_parallel import balance, batch_columns
+from mlreco.utils.cost_model import CostLog, CostModel
+from mlreco.utils.profiling import profiler
+from mlreco.utils.logger import logger
+from mlreco.utils.metrics import MetricsSink
+from mlreco.utils.device import parse_gpus, num_devices, get_device, configure_threads, \
+    max_memory, split_cores, pin_cores
+from mlreco.analysis import scripts
 from mlreco.output_formatters import output
 
 
 class Handlers:
     sess         = None
     data_io      = None
-    csv_logger   = None
+    metrics_sink = None
     weight_io    = None
     train_logger = None
     iteration    = 0
@@ -38,14 +48,94 @@ def train(cfg):
 
 
 def inference(cfg):
-    handlers = prepare(cfg)
-    inference_loop(cfg, handlers)
+    if cfg['training'].get('replicas', 1) > 1:
+        inference_replicas(cfg)
+        return
+    run_inference(cfg)
+
+
+def run_inference(cfg):
+    if cfg['training'].get('streaming', False):
+        journal = prepare_stream(cfg)
+        handlers = prepare(cfg)
+        stream_loop(cfg, handlers, journal)
+    else:
+        handlers = prepare(cfg)
+        inference_loop(cfg, handlers)
+
+
+def inference_replica(cfg, replica, cores):
+    """
+    Runs inference on shard `replica` of the dataset, pinned to `cores`.
+    Each replica logs to its own log_dir/replica-%d folder.
+    """
+    pin_cores(cores)
+    if not cfg['training'].get('num_threads', 0):
+        cfg['training']['num_threads'] = len(cores)
+    cfg['training']['log_dir'] = os.path.join(cfg['training']['log_dir'], 'replica-%d' % replica)
+    cfg['training']['num_shards'] = cfg['training']['replicas']
+    cfg['training']['shard'] = replica
+    cfg['iotool']['shuffle'] = False
+    cfg['iotool']['sampler'] = {'name': 'ShardSampler',
+                                'num_shards': cfg['training']['replicas'],
+                                'shard': replica}
+    np.random.seed(cfg['training']['seed'] + replica)
+    torch.manual_seed(cfg['training']['seed'] + replica)
+    run_inference(cfg)
+
+
+def prepare_stream(cfg):
+    """
+    Streaming inference reads every entry of shard training.shard (out of
+    training.num_shards) once and in order, skipping the entries listed in
+    the journal of a previous run. Returns the journal path.
+    """
+    num_shards = int(cfg['training'].get('num_shards', 1))
+    shard = int(cfg['training'].get('shard', 0))
+    log_dir = cfg['training']['log_dir']
+    if not os.path.isdir(log_dir):
+        os.makedirs(log_dir)
+    journal = os.path.join(log_dir, 'journal-%d-of-%d.txt' % (shard, num_shards))
+    done = []
+    if os.path.isfile(journal):
+        with open(journal, 'r') as f:
+            done = [int(line) for line in f if line.strip()]
+        logger.info('Journal %s: skipping %d completed entries', journal, len(done))
+    cfg['iotool']['shuffle'] = False
+    cfg['iotool']['sampler'] = {'name': 'ShardSampler', 'num_shards': num_shards,
+                                'shard': shard, 'exclude': done}
+    return journal
+
+
+def inference_replicas(cfg):
+    """
+    CPU inference with training.replicas independent processes, each with
+    its own copy of the model, a disjoint shard of the dataset and a
+    disjoint set of cores.
+    """
+    import multiprocessing
+    if cfg['training']['device'] != 'cpu':
+        raise ValueError('training.replicas is only supported for CPU inference (gpus: cpu)')
+    ctx = multiprocessing.get_context('spawn')
+    processes = []
+    for replica, cores in enumerate(split_cores(cfg['training']['replicas'])):
+        logger.info('Starting replica %d on cores %s', replica, cores)
+        p = ctx.Process(target=inference_replica, args=(cfg, replica, cores))
+        p.start()
+        processes.append(p)
+    for p in processes:
+        p.join()
+    failed = [i for i, p in enumerate(processes) if p.exitcode != 0]
+    if failed:
+        raise RuntimeError('Inference replicas %s failed' % failed)
 
 
 def process_config(cfg):
-    # Set GPUS to be used
-    os.environ['CUDA_VISIBLE_DEVICES'] = cfg['training']['gpus']
-    cfg['training']['gpus'] = list(range(len(cfg['training']['gpus'].split(','))))
+    # Set GPUS to be used (empty, 'cpu' or '-1' to run on CPU)
+    cfg['training']['device'], gpus = parse_gpus(cfg['training']['gpus'])
+    if cfg['training']['device'] == 'cuda':
+        os.environ['CUDA_VISIBLE_DEVICES'] = str(cfg['training']['gpus'])
+    cfg['training']['gpus'] = gpus
 
     # Update seed
     if cfg['training']['seed'] < 0:
@@ -59,13 +149,17 @@ def process_config(cfg):
         raise ValueError('Cannot have both BATCH_SIZE (-bs) and MINIBATCH_SIZE (-mbs) negative values!')
     # Assign non-default values
     if cfg['iotool']['batch_size'] < 0:
-        cfg['iotool']['batch_size'] = int(cfg['training']['minibatch_size'] * len(cfg['training']['gpus']))
+        cfg['iotool']['batch_size'] = int(cfg['training']['minibatch_size'] * num_devices(cfg))
     if cfg['training']['minibatch_size'] < 0:
-        cfg['training']['minibatch_size'] = int(cfg['iotool']['batch_size'] / len(cfg['training']['gpus']))
+        cfg['training']['minibatch_size'] = int(cfg['iotool']['batch_size'] / num_devices(cfg))
     # Check consistency
-    if not (cfg['iotool']['batch_size'] % (cfg['training']['minibatch_size'] * len(cfg['training']['gpus']))) == 0:
+    if not (cfg['iotool']['batch_size'] % (cfg['training']['minibatch_size'] * num_devices(cfg))) == 0:
         raise ValueError('BATCH_SIZE (-bs) must be multiples of MINIBATCH_SIZE (-mbs) and GPU count (--gpus)!')
 
+    # Events are moved between devices as collated numpy arrays
+    if cfg['training'].get('balance', False) and cfg['iotool'].get('collate_fn', None) != 'CollateSparse':
+        raise ValueError('training.balance requires iotool.collate_fn CollateSparse')
+
     # Set random seed for reproducibility
     np.random.seed(cfg['training']['seed'])
     torch.manual_seed(cfg['training']['seed'])
@@ -85,11 +179,18 @@ def make_directories(cfg, loaded_iteration, handlers=None):
     if cfg['training']['log_dir']:
         if not os.path.exists(cfg['training']['log_dir']):
             os.mkdir(cfg['training']['log_dir'])
-        logname = '%s/train_log-%07d.csv' % (cfg['training']['log_dir'], loaded_iteration)
+        logname = '%s/train_log-%07d.npz' % (cfg['training']['log_dir'], loaded_iteration)
         if not cfg['training']['train']:
-            logname = '%s/inference_log-%07d.csv' % (cfg['training']['log_dir'], loaded_iteration)
+            logname = '%s/inference_log-%07d.npz' % (cfg['training']['log_dir'], loaded_iteration)
         if handlers is not None:
-            handlers.csv_logger = utils.CSVData(logname)
+            handlers.metrics_sink = MetricsSink(logname, flush_every=cfg['training'].get('log_flush_step', 100))
+            if cfg['training'].get('cost_log', False):
+                modules = cfg['model'].get('modules', {}).values()
+                num_strides = next((m['num_strides'] for m in modules if 'num_strides' in m), 1)
+                data_dim = next((m['data_dim'] for m in modules if 'data_dim' in m), 3)
+                prefix = 'cost' if cfg['training']['train'] else 'inference_cost'
+                handlers.trainer.cost_log = CostLog('%s/%s' % (cfg['training']['log_dir'], prefix),
+                                                    loaded_iteration, num_strides=num_strides, data_dim=data_dim)
         # TODO log metrics
         # if not flags.TRAIN:
         #     handlers.metrics_logger = utils.CSVData('%s/metrics_log-%07d.csv' % (flags.LOG_DIR, loaded_iteration))
@@ -99,20 +200,33 @@ def make_directories(cfg, loaded_iteration, handlers=None):
 
 
 def prepare(cfg):
-    torch.cuda.set_device(cfg['training']['gpus'][0])
+    if cfg['training']['device'] == 'cuda':
+        torch.cuda.set_device(cfg['training']['gpus'][0])
+    else:
+        configure_threads(cfg['training'].get('num_threads', 0),
+                          cfg['training'].get('num_interop_threads', 0))
     handlers = Handlers()
 
+    # Console messages (see mlreco.utils.logger)
+    logger.configure(level=cfg['training'].get('log_level', 'info'),
+                     interval=cfg['training'].get('console_interval', 0.))
+
+    # Timing scopes (see mlreco.utils.profiling)
+    profiler.configure(enabled=cfg['training'].get('profile', True),
+                       sync=cfg['training'].get('profile_sync', False))
+    profiler.reset()
+
     # IO configuration
     # Batch size for I/O becomes minibatch size
     batch_size = cfg['iotool']['batch_size']
     cfg['iotool']['batch_size'] = cfg['training']['minibatch_size']
+    if 'shared_memory' in cfg['iotool']:
+        # Minibatches of an iteration must stay in their slabs until the next one
+        cfg['iotool']['shared_memory'].setdefault('hold', max(int(batch_size / cfg['training']['minibatch_size']), 1))
     handlers.data_io, cfg['data_keys'] = loader_factory(cfg)
-    # TODO check that it does what we want (cycle through dataloader)
-    # check on a small sample, check 1/ it cycles through and 2/ randomness
-    if cfg['training']['train']:
-        handlers.data_io_iter = iter(cycle(handlers.data_io))
-    else:
-        handlers.data_io_iter = itertools.cycle(handlers.data_io)
+    # Batches are read again at each epoch (itertools.cycle would keep a copy
+    # of the whole first epoch, and shared memory batches are reused)
+    handlers.data_io_iter = iter(cycle(handlers.data_io))
     cfg['iotool']['batch_size'] = batch_size
 
     # Trainer configuration
@@ -127,49 +241,63 @@ def prepare(cfg):
     return handlers
 
 
-def log(handlers, tstamp_iteration, tspent_io, tspent_iteration,
-        tsum, tsum_io, res, cfg, epoch):
+def log(handlers, tstamp_iteration, res, cfg, epoch, extra=None):
     """
-    Log relevant information to CSV files and stdout.
+    Log relevant information to the metrics log (see MetricsSink) and stdout.
+    The metrics log gets a row of timings and memory at every iteration (no
+    formatting or I/O). Losses and accuracies are accumulated on device by
+    the trainer and only copied to the host at report steps (every iteration
+    if report_step is 0), where they are added to the row as their average
+    since the last report.
+    extra: more columns for this row.
     """
     report_step  = cfg['training']['report_step'] and \
                 ((handlers.iteration+1) % cfg['training']['report_step'] == 0)
+    materialize = report_step or not cfg['training']['report_step']
 
-    # FIXME do we need to average here?
-    loss_seg = np.mean(res['loss_seg'])
-    acc_seg  = np.mean(res['accuracy'])
     res_dict = {}
-    for key in res:
-        res_dict[key] = np.mean(res[key])
-
-    mem = utils.round_decimals(torch.cuda.max_memory_allocated()/1.e9, 3)
+    if materialize:
+        res_dict = handlers.trainer.metrics.materialize()
+        handlers.trainer.metrics.reset()
+    loss_seg = res_dict.get('loss_seg', float('nan'))
+    acc_seg  = res_dict.get('accuracy', float('nan'))
+
+    mem = utils.round_decimals(max_memory(get_device(cfg)), 3)
+    cache = find_cache(handlers.data_io.dataset)
+    cache_stats = cache.stats() if cache is not None else None
+
+    # Timings of the last iteration and their running sums
+    train = cfg['training']['train']
+    scopes = {'iter': 'iteration',
+              'io': 'iteration/io',
+              'train': 'iteration/train',
+              'forward': 'iteration/train/forward' if train else 'iteration/forward',
+              'save': 'iteration/save'}
+    tmap = dict([(key, profiler.last(path)) for key, path in scopes.items()])
+    tsum_map = dict([(key, profiler.total(path)) for key, path in scopes.items()])
 
     # Report (logger)
-    if handlers.csv_logger:
-        handlers.csv_logger.record(('iter', 'epoch', 'titer', 'tsumiter'),
-                                   (handlers.iteration, epoch, tspent_iteration, tsum))
-        handlers.csv_logger.record(('tio', 'tsumio'),
-                                   (tspent_io, tsum_io))
-        handlers.csv_logger.record(('mem', ), (mem, ))
-        tmap, tsum_map = handlers.trainer.tspent, handlers.trainer.tspent_sum
-        if cfg['training']['train']:
-            handlers.csv_logger.record(('ttrain', 'tsave', 'tsumtrain', 'tsumsave'),
-                                       (tmap['train'], tmap['save'], tsum_map['train'], tsum_map['save']))
-        handlers.csv_logger.record(('tforward', 'tsave', 'tsumforward', 'tsumsave'),
-                                   (tmap['forward'], tmap['save'], tsum_map['forward'], tsum_map['save']))
-
-
-        for key in res_dict:
-            handlers.csv_logger.record((key,), (res_dict[key],))
-        handlers.csv_logger.record(('loss_seg', 'acc_seg'), (loss_seg, acc_seg))
-        handlers.csv_logger.write()
+    if handlers.metrics_sink:
+        row = {'iter': handlers.iteration, 'epoch': epoch, 'titer': tmap['iter'], 'tsumiter': tsum_map['iter'],
+               'tio': tmap['io'], 'tsumio': tsum_map['io'], 'mem': mem}
+        if cache_stats is not None:
+            row.update({'cache_hits': cache_stats['hits'], 'cache_misses': cache_stats['misses'],
+                        'cache_evictions': cache_stats['evictions'], 'cache_mb': cache_stats['bytes'] / 1024.**2})
+        if train:
+            row.update({'ttrain': tmap['train'], 'tsumtrain': tsum_map['train']})
+        row.update({'tforward': tmap['forward'], 'tsumforward': tsum_map['forward'],
+                    'tsave': tmap['save'], 'tsumsave': tsum_map['save']})
+        if materialize:
+            row.update(res_dict)
+            row.update({'loss_seg': loss_seg, 'acc_seg': acc_seg})
+        row.update(extra or {})
+        handlers.metrics_sink.record(row)
 
     # Report (stdout)
     if report_step:
-        loss_seg = utils.round_decimals(loss_seg,   4)
-        tmap  = handlers.trainer.tspent
-        tfrac = utils.round_decimals(tmap['train']/tspent_iteration*100., 2)
-        tabs  = utils.round_decimals(tmap['train'], 3)
+        tstep = tmap['train'] if train else tmap['forward']
+        tfrac = utils.round_decimals(tstep/tmap['iter']*100., 2) if tmap['iter'] > 0 else 0.
+        tabs  = utils.round_decimals(tstep, 3)
         epoch = utils.round_decimals(epoch, 2)
 
         if cfg['training']['train']:
@@ -178,13 +306,58 @@ def log(handlers, tstamp_iteration, tspent_io, tspent_iteration,
         else:
             msg = 'Iter. %d (epoch %g) @ %s ... forward time %g%% (%g [s]) mem. %g GB \n'
             msg = msg % (handlers.iteration, epoch, tstamp_iteration, tfrac, tabs, mem)
-        msg += '   Segmentation: loss %g accuracy %g\n' % (loss_seg, acc_seg)
-        print(msg)
-        sys.stdout.flush()
-        if handlers.csv_logger: handlers.csv_logger.flush()
+        if not np.isnan(loss_seg):  # No loss without labels
+            msg += '   Segmentation: loss %g accuracy %g\n' % (utils.round_decimals(loss_seg, 4), acc_seg)
+        if cache_stats is not None:
+            lookups = max(cache_stats['hits'] + cache_stats['misses'], 1)
+            msg += '   Cache: hit rate %g%% (%d hits, %d misses) %g MB\n' % (
+                utils.round_decimals(100. * cache_stats['hits'] / lookups, 2), cache_stats['hits'],
+                cache_stats['misses'], utils.round_decimals(cache_stats['bytes'] / 1024.**2, 1))
+        logger.report(msg)
+        if handlers.trainer.cost_log: handlers.trainer.cost_log.flush()
         if handlers.train_logger: handlers.train_logger.flush()
 
 
+def host_data(data_blob, cfg):
+    """
+    data_blob with compact sparse tensors (CompactSparse) expanded to numpy
+    arrays and the keys of iotool.dataset.shared_coordinates joined to the
+    coordinates of their source, for output formatters and analysis scripts
+    """
+    data = dict([(key, [[expand(d) for d in minibatch] for minibatch in data_blob[key]]) for key in data_blob])
+    modules = cfg['model'].get('modules', {}).values()
+    data_dim = next((m['data_dim'] for m in modules if 'data_dim' in m), 3)
+    for key, source in cfg['iotool']['dataset'].get('shared_coordinates', {}).items():
+        if key in data and source in data:
+            data[key] = [[join_coordinates(s, v, data_dim) for s, v in zip(sources, values)]
+                         for sources, values in zip(data[source], data[key])]
+    return data
+
+
+@functools.lru_cache(maxsize=None)
+def _cost_model(filename):
+    return CostModel.load(filename)
+
+
+def balance_data(data_blob, cfg):
+    """
+    With training.balance, the events of each minibatch of data_blob are
+    moved between devices so that their numbers of voxels (first
+    network_input key), or their costs predicted by training.cost_model,
+    are even (see utils.data_parallel.balance)
+    """
+    if not cfg['training'].get('balance', False) or num_devices(cfg) < 2:
+        return data_blob
+    columns = batch_columns(cfg)
+    cost_key = cfg['model']['network_input'][0]
+    cost = None
+    if cfg['training'].get('cost_model', None):
+        cost = _cost_model(cfg['training']['cost_model']).event_cost
+    minibatches = [balance(dict([(key, data_blob[key][i]) for key in columns]), columns, cost_key, cost=cost)
+                   for i in range(len(data_blob[cost_key]))]
+    return dict([(key, [minibatch[key] for minibatch in minibatches]) for key in data_blob])
+
+
 def get_data_minibatched(dataset, cfg):
     """
     Handles minibatching the data
@@ -194,18 +367,32 @@ def get_data_minibatched(dataset, cfg):
     """
     data_blob = {}  # FIXME dictionary or list? Keys may not be ordered
 
-    for _ in range(int(cfg['iotool']['batch_size'] / (cfg['training']['minibatch_size'] * len(cfg['training']['gpus'])))):
+    for _ in range(int(cfg['iotool']['batch_size'] / (cfg['training']['minibatch_size'] * num_devices(cfg)))):
         for key in cfg['data_keys']:
             if key not in data_blob:
                 data_blob[key] = []
             data_blob[key].append([])
-        for j in range(len(cfg['training']['gpus'])):
+        for j in range(num_devices(cfg)):
             blob = next(dataset)
-            print(blob[0].shape, blob[1].shape)
             for i, key in enumerate(cfg['data_keys']):
                 data_blob[key][-1].append(blob[i])
 
-    return data_blob
+    return balance_data(data_blob, cfg)
+
+
+def log_final(handlers, cfg, epoch):
+    """
+    Writes the metrics accumulated since the last report step (iterations
+    not a multiple of report_step) as a last row of the metrics log.
+    """
+    if not handlers.metrics_sink or not len(handlers.trainer.metrics):
+        return
+    res_dict = handlers.trainer.metrics.materialize()
+    handlers.trainer.metrics.reset()
+    row = {'iter': handlers.iteration - 1, 'epoch': epoch}
+    row.update(res_dict)
+    row.update({'loss_seg': res_dict.get('loss_seg', float('nan')), 'acc_seg': res_dict.get('accuracy', float('nan'))})
+    handlers.metrics_sink.record(row)
 
 
 def train_loop(cfg, handlers):
@@ -213,47 +400,44 @@ def train_loop(cfg, handlers):
     Training loop. With optional minibatching as determined by the parameters
     cfg['iotool']['batch_size'] vs cfg['training']['minibatch_size'].
     """
-    tsum, tsum_io = 0., 0.
     while handlers.iteration < cfg['training']['iterations']:
         epoch = handlers.iteration / float(len(handlers.data_io))
         tstamp_iteration = datetime.datetime.fromtimestamp(time.time()).strftime('%Y-%m-%d %H:%M:%S')
-        tstart_iteration = time.time()
 
         checkpt_step = cfg['training']['checkpoint_step'] and \
                         cfg['training']['weight_prefix'] and \
                         ((handlers.iteration+1) % cfg['training']['checkpoint_step'] == 0)
 
-        tio_start = time.time()
-        data_blob = get_data_minibatched(handlers.data_io_iter, cfg)
-        tspent_io = time.time() - tio_start
-        tsum_io += tspent_io
+        with profiler.scope('iteration', always=True):
+            with profiler.scope('io', always=True):
+                data_blob = get_data_minibatched(handlers.data_io_iter, cfg)
 
-        # Train step
-        res = handlers.trainer.train_step(data_blob)
-        # Save snapshot
-        if checkpt_step:
-            handlers.trainer.save_state(handlers.iteration)
-
-        tspent_iteration = time.time() - tstart_iteration
-        tsum += tspent_iteration
+            # Train step
+            res = handlers.trainer.train_step(data_blob)
+            # Save snapshot
+            if checkpt_step:
+                handlers.trainer.save_state(handlers.iteration)
 
         # Store output if requested
         if 'outputs' in cfg['model']:
             # for output in cfg['model']['outputs']:
             #     f = getattr(output_formatters, output)
             #     f(data_blob, res, cfg)
-            output(cfg['model']['outputs'], data_blob, res, cfg, handlers.iteration)
+            with profiler.scope('output'):
+                output(cfg['model']['outputs'], host_data(data_blob, cfg), res, cfg, handlers.iteration)
 
-        log(handlers, tstamp_iteration, tspent_io,
-            tspent_iteration, tsum, tsum_io,
-            res, cfg, epoch)
+        log(handlers, tstamp_iteration, res, cfg, epoch)
 
         # Increment iteration counter
         handlers.iteration += 1
 
     # Finalize
-    if handlers.csv_logger:
-        handlers.csv_logger.close()
+    log_final(handlers, cfg, handlers.iteration / float(len(handlers.data_io)))
+    if handlers.metrics_sink:
+        handlers.metrics_sink.close()
+    if handlers.trainer.cost_log:
+        handlers.trainer.cost_log.close()
+    export_profile(cfg, handlers)
 
 
 def inference_loop(cfg, handlers):
@@ -264,54 +448,132 @@ def inference_loop(cfg, handlers):
     Note: Accuracy/loss will be per batch in the CSV log file, not per event.
     Write an analysis function to do per-event analysis (TODO).
     """
-    tsum, tsum_io = 0., 0.
     # Metrics for each event
     # global_metrics = {}
     weights = glob.glob(cfg['training']['model_path'])
     # if len(weights) > 0:
-    print("Loading weights: ", weights)
+    logger.info('Loading weights: %s', weights)
     for weight in weights:
         cfg['training']['model_path'] = weight
         _ = handlers.trainer.initialize()
         handlers.iteration = 0
         while handlers.iteration < cfg['training']['iterations']:
             tstamp_iteration = datetime.datetime.fromtimestamp(time.time()).strftime('%Y-%m-%d %H:%M:%S')
-            tstart_iteration = time.time()
 
             # blob = next(handlers.data_io_iter)
 
-            tio_start = time.time()
-            data_blob = get_data_minibatched(handlers.data_io_iter, cfg)
-            tspent_io = time.time() - tio_start
-            tsum_io += tspent_io
+            with profiler.scope('iteration', always=True):
+                with profiler.scope('io', always=True):
+                    data_blob = get_data_minibatched(handlers.data_io_iter, cfg)
 
-            # Run inference
-            res = handlers.trainer.forward(data_blob)
+                # Run inference
+                res = handlers.trainer.forward(data_blob)
 
             epoch = handlers.iteration / float(len(handlers.data_io))
-            tspent_iteration = time.time() - tstart_iteration
-            tsum += tspent_iteration
+            if 'outputs' in cfg['model'] or 'analysis' in cfg['model']:
+                data_blob = host_data(data_blob, cfg)
 
             # Store output if requested
             if 'outputs' in cfg['model']:
                 # for output in cfg['model']['outputs']:
                 #     f = getattr(output_formatters, output)
                 #     f(data_blob, res, cfg)
-                output(cfg['model']['outputs'], data_blob, res, cfg, handlers.iteration)
+                with profiler.scope('output'):
+                    output(cfg['model']['outputs'], data_blob, res, cfg, handlers.iteration)
 
-            log(handlers, tstamp_iteration, tspent_io,
-                tspent_iteration, tsum, tsum_io,
-                res, cfg, epoch)
+            log(handlers, tstamp_iteration, res, cfg, epoch)
             # Log metrics/do analysis
             # TODO
             if 'analysis' in cfg['model']:
                 for ana_script in cfg['model']['analysis']:
-                    f = getattr(analysis, ana_script)
-                    f(data_blob, res, cfg, handlers.iteration)
+                    f = scripts[ana_script]
+                    with profiler.scope('analysis'):
+                        f(data_blob, res, cfg, handlers.iteration)
             handlers.iteration += 1
+        log_final(handlers, cfg, handlers.iteration / float(len(handlers.data_io)))
 
     # Metrics
     # TODO
     # Finalize
-    if handlers.csv_logger:
-        handlers.csv_logger.close()
+    if handlers.metrics_sink:
+        handlers.metrics_sink.close()
+    if handlers.trainer.cost_log:
+        handlers.trainer.cost_log.close()
+    export_profile(cfg, handlers)
+
+
+def stream_loop(cfg, handlers, journal):
+    """
+    Streaming inference: one pass over the sampler entries (see
+    prepare_stream), outputs are written per dataset entry and completed
+    entries are appended to the journal after each batch, so that a
+    restarted job resumes where this one stopped. training.iterations is
+    ignored. Reports the throughput in events per second.
+    """
+    index_key = cfg['data_keys'].index('index')
+    ndevices = num_devices(cfg)
+    remaining = len(handlers.data_io.sampler)
+    logger.info('Streaming %d entries', remaining)
+    data_io = iter(handlers.data_io)
+    num_events, tstart = 0, time.time()
+    with open(journal, 'a') as journal_file:
+        while True:
+            tstamp_iteration = datetime.datetime.fromtimestamp(time.time()).strftime('%Y-%m-%d %H:%M:%S')
+            with profiler.scope('iteration', always=True):
+                with profiler.scope('io', always=True):
+                    minibatches = list(itertools.islice(data_io, ndevices))
+                if not minibatches:
+                    break
+                # Last batch: fewer minibatches than devices, the network
+                # only runs on as many devices (see DataParallel.scatter)
+                entries = [idx[0] for blob in minibatches for idx in blob[index_key]]
+                data_blob = dict([(key, [[blob[i] for blob in minibatches]]) for i, key in enumerate(cfg['data_keys'])])
+                data_blob = balance_data(data_blob, cfg)
+
+                res = handlers.trainer.forward(data_blob)
+
+            if 'outputs' in cfg['model'] or 'analysis' in cfg['model']:
+                data_blob = host_data(data_blob, cfg)
+            if 'outputs' in cfg['model']:
+                with profiler.scope('output'):
+                    output(cfg['model']['outputs'], data_blob, res, cfg, handlers.iteration, use_index=True)
+            if 'analysis' in cfg['model']:
+                for ana_script in cfg['model']['analysis']:
+                    f = scripts[ana_script]
+                    with profiler.scope('analysis'):
+                        f(data_blob, res, cfg, handlers.iteration)
+
+            # Outputs are written: these entries are done
+            journal_file.write(''.join(['%d\n' % entry for entry in entries]))
+            journal_file.flush()
+            os.fsync(journal_file.fileno())
+
+            num_events += len(entries)
+            rate = num_events / (time.time() - tstart)
+            log(handlers, tstamp_iteration, res, cfg, num_events / float(max(remaining, 1)),
+                extra={'events': num_events, 'events_per_second': rate})
+            report_step = cfg['training']['report_step']
+            if report_step and (handlers.iteration+1) % report_step == 0:
+                logger.report('%d/%d events, %.2f events/s', num_events, remaining, rate)
+            handlers.iteration += 1
+
+    duration = time.time() - tstart
+    logger.info('Done: %d events in %.1f s, %.2f events/s', num_events, duration, num_events / duration if duration > 0 else 0.)
+    log_final(handlers, cfg, 1.)
+    if handlers.metrics_sink:
+        handlers.metrics_sink.close()
+    if handlers.trainer.cost_log:
+        handlers.trainer.cost_log.close()
+    export_profile(cfg, handlers)
+
+
+def export_profile(cfg, handlers):
+    """
+    Writes per-scope timing statistics (CSV) and a Chrome trace (JSON)
+    next to the CSV log.
+    """
+    if not profiler.enabled or not cfg['training']['log_dir']:
+        return
+    prefix = '%s/profile-%07d' % (cfg['training']['log_dir'], handlers.iteration)
+    profiler.to_csv(prefix + '.csv')
+    profiler.to_chrome_trace(prefix + '.json')
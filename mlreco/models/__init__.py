@@ -1,22 +1,24 @@
-from mlreco.models import uresnet_ppn
-from mlreco.models import uresnet_ppn_type
-from mlreco.models import uresnet_lonely
-from mlreco.models import uresnet
-from mlreco.models import chain
-from mlreco.models import uresnet_ppn_chain
+from mlreco.utils.registry import Registry
+
+
+def _entry(module, model, loss):
+    return ('mlreco.models.%s:%s' % (module, model), 'mlreco.models.%s:%s' % (module, loss))
 
 
 # Make some models available (not all of them, e.g. PPN is not standalone)
-models = {
+# Modules are only imported when the model is requested.
+models = Registry('model', {
     # Regular UResNet + PPN
-    "uresnet_ppn": (uresnet_ppn.PPNUResNet, uresnet_ppn.SegmentationLoss),
+    "uresnet_ppn": _entry('uresnet_ppn', 'PPNUResNet', 'SegmentationLoss'),
     # Adding point classification layer
-    "uresnet_ppn_type": (uresnet_ppn_type.PPNUResNet, uresnet_ppn_type.SegmentationLoss),
+    "uresnet_ppn_type": _entry('uresnet_ppn_type', 'PPNUResNet', 'SegmentationLoss'),
     # Using SCN built-in UResNet
-    "uresnet": (uresnet.UResNet, uresnet.SegmentationLoss),
+    "uresnet": _entry('uresnet', 'UResNet', 'SegmentationLoss'),
     # Using our custom UResNet
-    "uresnet_lonely": (uresnet_lonely.UResNet, uresnet_lonely.SegmentationLoss),
+    "uresnet_lonely": _entry('uresnet_lonely', 'UResNet', 'SegmentationLoss'),
     # Chain test for track clustering (w/ DBSCAN)
-    "chain": (chain.Chain, chain.ChainLoss),
-    "uresnet_ppn_chain": (uresnet_ppn_chain.Chain, uresnet_ppn_chain.ChainLoss)
-}
+    "chain": _entry('chain', 'Chain', 'ChainLoss'),
+    "uresnet_ppn_chain": _entry('uresnet_ppn_chain', 'Chain', 'ChainLoss'),
+    # One UResNet pass, several PPN heads
+    "multi_head": _entry('multi_head', 'MultiHead', 'MultiHeadLoss')
+})
@@ -2,6 +2,8 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 import torch
+from mlreco.utils.profiling import profiler
+from mlreco.utils.logger import logger
 from mlreco.models.layers.dbscan import DBScan
 from mlreco.models.uresnet_ppn import PPNUResNet, SegmentationLoss
 
@@ -14,15 +16,19 @@ class Chain(torch.nn.Module):
         super(Chain, self).__init__()
         self.dbscan = DBScan(model_config['modules']['dbscan'])
         self.uresnet_ppn = PPNUResNet(model_config['modules']['uresnet_ppn'])
+        # Indices of the outputs to compute (None for all), see PPNUResNet
+        self.requested_outputs = None
         # self.keys = {'clusters': 5, 'segmentation': 3, 'points': 0}
 
     def forward(self, input):
+        self.uresnet_ppn.requested_outputs = self.requested_outputs
         x = self.uresnet_ppn(input)
         #print(input[0].shape)
         #print(x[3][0].shape)
         new_input = torch.cat([input[0].double(), x[3][0].double()], dim=1)
         #print(new_input[:10])
-        clusters = self.dbscan(new_input)
+        with profiler.scope('dbscan'):
+            clusters = self.dbscan(new_input)
         #c = torch.cat(clusters, dim=0)
         final = []
         i = 0
@@ -31,7 +37,7 @@ class Chain(torch.nn.Module):
                 cluster = torch.nn.functional.pad(cluster, (0, 1, 0, 0), mode='constant', value=i)
                 final.append(cluster)
                 i += 1
-        print(len(clusters), len(final))
+        logger.debug('%d clusters, %d kept', len(clusters), len(final))
         if len(final) > 0:
             final = torch.cat(final, dim=0)
         return x + [[final]]
@@ -42,7 +48,7 @@ class ChainLoss(torch.nn.modules.loss._Loss):
         super(ChainLoss, self).__init__()
         self.loss = SegmentationLoss(cfg)
 
-    def forward(self, segmentation, label, particles, clusters):
+    def forward(self, segmentation, label, particles, clusters, coordinates=None):
         # print(len(segmentation), len(segmentation[0]))
         # print(clusters[0].shape, label[0].shape)
         # assert len(segmentation[0]) == len(label)
@@ -53,4 +59,4 @@ class ChainLoss(torch.nn.modules.loss._Loss):
         #     for b in batch_ids[i].unique():
         #         batch_index = batch_ids[i] == b
         #         event_data = label[i][batch_index][:, :-2]  # (N, 3)
-        return self.loss(segmentation, label, particles)
+        return self.loss(segmentation, label, particles, coordinates=coordinates)
@@ -0,0 +1,55 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+import torch
+import torch.utils.checkpoint
+
+# Buffers of batch norms updated by a forward pass in training mode
+_STATISTICS = ('running_mean', 'running_var', 'num_batches_tracked')
+
+
+def _statistics(module):
+    return [buf for m in module.modules() for buf in [getattr(m, name, None) for name in _STATISTICS]
+            if isinstance(buf, torch.Tensor)]
+
+
+def checkpoint_module(module, run, *inputs):
+    """
+    run(*inputs) (which calls module) without keeping its intermediate
+    activations: they are recomputed during backward. The batch norm running
+    statistics of module are restored after the recomputation, so that they
+    are updated once per step as without checkpointing.
+    """
+    calls = []
+
+    def recompute(*args):
+        if not calls:
+            calls.append(True)
+            return run(*args)
+        saved = [buf.clone() for buf in _statistics(module)]
+        try:
+            return run(*args)
+        finally:
+            with torch.no_grad():
+                for buf, value in zip(_statistics(module), saved):
+                    buf.copy_(value)
+
+    return torch.utils.checkpoint.checkpoint(recompute, *inputs, use_reentrant=False)
+
+
+def checkpoint_block(block, x):
+    """
+    Runs a submanifold block (same sites in output as in input, e.g. the
+    residual blocks of UResNet) on the sparse tensor x without keeping its
+    intermediate activations (see checkpoint_module). Only the input
+    features are kept. Without gradients this is block(x).
+    """
+    import sparseconvnet as scn
+    if not torch.is_grad_enabled():
+        return block(x)
+
+    def run(features):
+        return block(scn.SparseConvNetTensor(features, x.metadata, x.spatial_size)).features
+
+    features = checkpoint_module(block, run, x.features)
+    return scn.SparseConvNetTensor(features, x.metadata, x.spatial_size)
@@ -4,6 +4,7 @@ from __future__ import print_function
 import torch
 import numpy as np
 from sklearn.cluster import DBSCAN
+from mlreco.utils.logger import logger
 
 class DBScanClusts(torch.nn.Module):
     """
@@ -121,7 +122,7 @@ class DBScanFunction(torch.autograd.Function):
                 labels = dbscan(data[batch_index][mask][:, :dim], epsilon, minPoints)
                 labels = labels.reshape((-1,))
                 keep += (labels, )
-                print(b, class_id)
+                logger.debug('DBSCAN event %s class %d', b, class_id)
                 # Now loop over clusters identified by DBScan, append class_id
                 clusters = []
                 unique_labels, _ = torch.sort(torch.unique(labels))
@@ -1,8 +1,8 @@
 from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
+import itertools
 import torch
-import sparseconvnet as scn
 
 
 class SelectionFeatures(torch.nn.Module):
@@ -24,12 +24,13 @@ class AddLabels(torch.nn.Module):
         super(AddLabels, self).__init__()
 
     def forward(self, attention, label):
+        import sparseconvnet as scn
         output = scn.SparseConvNetTensor()
         output.metadata = attention.metadata
         output.spatial_size = attention.spatial_size
         output.features = attention.features.new().resize_(1).expand_as(attention.features).fill_(1.0)
         output.features = output.features * attention.features
-        positions = attention.get_spatial_locations().cuda()
+        positions = attention.get_spatial_locations().to(attention.features.device)
         # print(positions.max(), label.max())
         for l in label:
             index = (positions == l).all(dim=1)
@@ -45,6 +46,7 @@ class Multiply(torch.nn.Module):
         super(Multiply, self).__init__()
 
     def forward(self, x, y):
+        import sparseconvnet as scn
         output = scn.SparseConvNetTensor()
         output.metadata = x.metadata
         output.spatial_size = x.spatial_size
@@ -63,6 +65,7 @@ class Selection(torch.nn.Module):
         self.softmax = torch.nn.Softmax(dim=1)
 
     def forward(self, scores):
+        import sparseconvnet as scn
         output = scn.SparseConvNetTensor()
         output.metadata = scores.metadata
         output.spatial_size = scores.spatial_size
@@ -74,6 +77,95 @@ class Selection(torch.nn.Module):
         return out_size
 
 
+def _site_keys(coords, batch, spatial_size, radius):
+    """
+    Linear index of sites (coords shifted by radius, so that neighbours
+    outside of the volume still have distinct keys)
+    """
+    keys = batch.long()
+    for d in range(coords.shape[1]):
+        keys = keys * (int(spatial_size[d]) + 2 * radius) + coords[:, d].long() + radius
+    return keys
+
+
+def prune_rows(locations, selected, spatial_size, radius=2):
+    """
+    Rows of locations (N, dim+1, batch id last) within radius voxels
+    (Chebyshev distance) of the rows selected by the boolean mask, sorted.
+    Also returns the sorted site keys and their order, to look up other
+    sites (see Prune).
+    """
+    dimension = locations.shape[1] - 1
+    keys = _site_keys(locations[:, :-1], locations[:, -1], spatial_size, radius)
+    sorted_keys, order = torch.sort(keys)
+    centers = locations[selected]
+    offsets = torch.tensor(list(itertools.product(range(-radius, radius + 1), repeat=dimension)),
+                           dtype=centers.dtype, device=centers.device)
+    neighbours = (centers[:, None, :-1] + offsets[None]).reshape(-1, dimension)
+    neighbour_keys = _site_keys(neighbours, centers[:, -1].repeat_interleave(len(offsets)), spatial_size, radius)
+    position = torch.searchsorted(sorted_keys, neighbour_keys).clamp(max=max(len(keys) - 1, 0))
+    found = sorted_keys[position] == neighbour_keys
+    return torch.unique(order[position[found]]), sorted_keys, order
+
+
+class Prune(torch.nn.Module):
+    """
+    Sparse tensor of only the sites of x selected by attention (as returned
+    by Selection and UnPooling) and their neighbours within radius voxels.
+    Convolutions on it are proportional to the number of candidates, and
+    with radius 2 (no bias) two 3x3x3 submanifold convolutions give the same
+    outputs as on all the sites of x multiplied by attention, which are 0
+    outside of the pruned sites. Returns the pruned tensor and the rows of x
+    of its sites (None if no site is selected: x is returned as is).
+    The attention mask is copied to the host, where the locations of x are,
+    which synchronizes the device on each call.
+    """
+    def __init__(self, dimension, radius=2):
+        super(Prune, self).__init__()
+        self.dimension = dimension
+        self.radius = radius
+
+    def forward(self, x, attention):
+        import sparseconvnet as scn
+        locations = x.get_spatial_locations()
+        selected = (attention.features[:, 1] > 0).cpu()
+        if not selected.any():
+            return x, None
+        rows, sorted_keys, order = prune_rows(locations, selected, x.spatial_size, self.radius)
+        input_layer = scn.InputLayer(self.dimension, x.spatial_size, mode=0)
+        pruned = input_layer((locations[rows], x.features[rows.to(x.features.device)]))
+        # Rows of x in the order of the pruned tensor
+        pruned_locations = pruned.get_spatial_locations()
+        keys = _site_keys(pruned_locations[:, :-1], pruned_locations[:, -1], x.spatial_size, self.radius)
+        return pruned, order[torch.searchsorted(sorted_keys, keys)]
+
+    def input_spatial_size(self, out_size):
+        return out_size
+
+
+class Unprune(torch.nn.Module):
+    """
+    Scatters the features of a pruned tensor (see Prune) back to the sites
+    of x, with zeros elsewhere.
+    """
+    def __init__(self):
+        super(Unprune, self).__init__()
+
+    def forward(self, x, pruned, rows):
+        import sparseconvnet as scn
+        if rows is None:
+            return pruned
+        output = scn.SparseConvNetTensor()
+        output.metadata = x.metadata
+        output.spatial_size = x.spatial_size
+        output.features = pruned.features.new_zeros((x.features.shape[0], pruned.features.shape[1]))
+        output.features = output.features.index_copy(0, rows.to(pruned.features.device), pruned.features)
+        return output
+
+    def input_spatial_size(self, out_size):
+        return out_size
+
+
 class ExtractFeatureMap(torch.nn.Module):
     def __init__(self, i, dimension, spatial_size):
         """
@@ -98,8 +190,8 @@ class ExtractFeatureMap(torch.nn.Module):
         # with torch.no_grad():
         # TODO deal with batch id
         # print('expand', i, x.features.shape, x.spatial_size, x.get_spatial_locations().size())
-        feature_map = x.get_spatial_locations().cuda().float()
-        coords = y.get_spatial_locations().cuda().float()
+        feature_map = x.get_spatial_locations().to(x.features.device).float()
+        coords = y.get_spatial_locations().to(x.features.device).float()
         N1 = feature_map.size(0)
         N2 = coords.size(0)
 
@@ -0,0 +1,80 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+import torch
+from mlreco.utils.profiling import profiler
+from mlreco.models.uresnet_lonely import UResNet, SegmentationLoss
+from mlreco.models.ppn import PPN, PPNLoss
+
+# Number of outputs of each head (see PPN.forward)
+NUM_HEAD_OUTPUTS = 5
+
+
+class MultiHead(torch.nn.Module):
+    """
+    One pass of the UResNet backbone (module uresnet_lonely), then each head
+    of model.heads (names of PPN modules of the configuration, default
+    ['ppn']) on the same feature maps, e.g. PPN and PPN with point types
+    (point_types: True) without running the backbone twice.
+
+    Outputs: segmentation, then the 5 outputs of each head in order (see
+    PPN), i.e. output k of head h is at 1 + 5*h + k. Each module (backbone
+    or head) can load its own weights with modules.<name>.model_path, e.g.
+    the PPN layers of a uresnet_ppn or uresnet_ppn_type checkpoint.
+    """
+    def __init__(self, model_config):
+        super(MultiHead, self).__init__()
+        self.uresnet_lonely = UResNet(model_config)
+        self._heads = list(model_config.get('heads', ['ppn']))
+        for name in self._heads:
+            self.add_module(name, PPN(model_config, name=name))
+        # Indices of the outputs to compute (None for all), see PPN
+        self.requested_outputs = None
+
+    def forward(self, input):
+        point_cloud = input[0]
+        label = input[1] if len(input) > 1 else None
+        x = self.uresnet_lonely((point_cloud,))
+        outputs = [x[0]]
+        for h, name in enumerate(self._heads):
+            head = getattr(self, name)
+            if self.requested_outputs is not None:
+                start = 1 + NUM_HEAD_OUTPUTS * h
+                head.requested_outputs = set([i - start for i in self.requested_outputs
+                                              if start <= i < start + NUM_HEAD_OUTPUTS])
+                if not head.requested_outputs:
+                    outputs.extend([[] for _ in range(NUM_HEAD_OUTPUTS)])
+                    continue
+            with profiler.scope(name):
+                outputs.extend(head((label, x[0][0], x[1][0], x[2][0])))
+        return outputs
+
+
+class MultiHeadLoss(torch.nn.modules.loss._Loss):
+    """
+    Segmentation loss plus the PPN loss of each head. Results of the first
+    head keep their names, the others are prefixed with the head name.
+    """
+    def __init__(self, cfg):
+        super(MultiHeadLoss, self).__init__()
+        self._heads = list(cfg.get('heads', ['ppn']))
+        self.uresnet_loss = SegmentationLoss(cfg)
+        self.ppn_losses = torch.nn.ModuleList([PPNLoss(cfg, name=name) for name in self._heads])
+
+    def forward(self, segmentation, label, particles, targets=None, coordinates=None):
+        uresnet_res = self.uresnet_loss([segmentation[0]], label, coordinates=coordinates)
+        res = dict(uresnet_res)
+        res['uresnet_acc'] = uresnet_res['accuracy']
+        res['uresnet_loss'] = uresnet_res['loss_seg']
+        total = uresnet_res['loss_seg'].float()
+        for h, (name, ppn_loss) in enumerate(zip(self._heads, self.ppn_losses)):
+            start = 1 + NUM_HEAD_OUTPUTS * h
+            ppn_res = ppn_loss(segmentation[start:start + NUM_HEAD_OUTPUTS], label, particles, targets=targets,
+                                coordinates=coordinates)
+            total = total + ppn_res['loss_ppn1'].float() + ppn_res['loss_ppn2'].float() + \
+                ppn_res['loss_class'].float() + ppn_res['loss_distance'].float()
+            for key in ppn_res:
+                res[key if h == 0 else '%s_%s' % (name, key)] = ppn_res[key]
+        # Don't forget to sum all losses
+        res['loss_seg'] = total
+        return res
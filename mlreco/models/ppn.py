@@ -2,14 +2,23 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 import torch
-from mlreco.models.layers.extract_feature_map import Selection, Multiply, AddLabels
+from mlreco.utils.profiling import profiler
+from mlreco.utils.ppn import target_mask
+from mlreco.models.layers.extract_feature_map import Selection, Multiply, AddLabels, Prune, Unprune
+from mlreco.iotools.shared import label_columns
 
 
 class PPN(torch.nn.Module):
-    def __init__(self, cfg):
+    """
+    PPN layers on the feature maps of a UResNet. name is the module of the
+    configuration to read (several PPN heads can share a backbone, see
+    models.multi_head). With point_types, the point type scores are added
+    to the columns of the first output.
+    """
+    def __init__(self, cfg, name='ppn'):
         super(PPN, self).__init__()
         import sparseconvnet as scn
-        model_config = cfg['modules']['ppn']
+        model_config = cfg['modules'][name]
         self._model_config = model_config
         dimension = model_config['data_dim']
         kernel_size = 2  # Use input_spatial_size method for other values?
@@ -38,6 +47,12 @@ class PPN(torch.nn.Module):
         self.ppn2_scores = scn.SubmanifoldConvolution(dimension, middle_filters, 2, 3, False)
         self.multiply1 = Multiply()
         self.multiply2 = Multiply()
+        # ppn2 and ppn3 convolutions only on the selected sites (see Prune),
+        # off by default until checked against the dense path on scn tensors
+        self._prune = model_config.get('prune', False)
+        self.prune1 = Prune(dimension)
+        self.prune2 = Prune(dimension)
+        self.unprune = Unprune()
 
         self.ppn3_conv = scn.SubmanifoldConvolution(dimension, nPlanes[0], nPlanes[0], 3, False)
         self.ppn3_pixel_pred = scn.SubmanifoldConvolution(dimension, nPlanes[0], dimension, 3, False)
@@ -46,68 +61,90 @@ class PPN(torch.nn.Module):
 
         self.add_labels1 = AddLabels()
         self.add_labels2 = AddLabels()
+        self._point_types = model_config.get('point_types', False)
+
+        # Indices of the outputs to compute (None for all), set in inference
+        # mode. Outputs that are not requested are returned as [].
+        self.requested_outputs = None
+
+    def _wanted(self, i):
+        return self.requested_outputs is None or i in self.requested_outputs
 
     def forward(self, input):
         use_encoding = False
         label, x, feature_ppn, feature_ppn2 = input
-        label = label[:, :-1]
-
-        if use_encoding:
-            y = self.ppn1_conv(feature_ppn[-1])
-        else:
-            y = self.ppn1_conv(feature_ppn2[0])
-
-        ppn1_scores = self.ppn1_scores(y)
-        mask = self.selection1(ppn1_scores)
-        attention = self.unpool1(mask)
-        if self.training:
-            with torch.no_grad():
-                attention = self.add_labels1(attention, torch.cat([label[:, :-1]/2**self.half_stride, label[:, -1][:, None]], dim=1).long())
-                # for b in range(self._flags.BATCH_SIZE):
-                #     batch_index = attention.get_spatial_locations()[:, -1] == b
-                #     print(attention.features.shape, batch_index.shape)
-                #     if attention.features[batch_index].sum() == 0:
-                #         print(label[label[:, -1] == b])
-                #         print((label/2**self.half_stride).long()[label[:, -1] == b])
-                #         print(attention.features[batch_index])
-                #         print(attention.get_spatial_locations()[batch_index])
-                # print(attention.features[attention.get_spatial_locations()[:, -1] == 11].size())
-                # print(attention.features[attention.get_spatial_locations()[:, -1] == 11][attention.features[attention.get_spatial_locations()[:, -1] == 11]>0])
-        if use_encoding:
-            y = feature_ppn[self.half_stride]
-        else:
-            y = feature_ppn2[self.half_stride]
-        y = self.multiply1(y, attention)
-        y = self.ppn2_conv(y)
-        ppn2_scores = self.ppn2_scores(y)
-        mask2 = self.selection2(ppn2_scores)
-        attention2 = self.unpool2(mask2)
-        if self.training:
-            with torch.no_grad():
-                attention2 = self.add_labels2(attention2, label.long())
-        if use_encoding:
-            z = feature_ppn[0]
-        else:
-            z = feature_ppn2[-1]
-
-        z = self.multiply2(z, attention2)
-        z = self.ppn3_conv(z)
-        ppn3_pixel_pred = self.ppn3_pixel_pred(z)
-        ppn3_scores = self.ppn3_scores(z)
+        # Labels are only needed for training
+        label = label[:, :-1] if label is not None else None
+
+        # Only the stages needed by the requested outputs
+        need_ppn3 = self._wanted(0)
+        need_ppn2 = need_ppn3 or self._wanted(2) or self._wanted(4)
+        need_ppn1 = need_ppn2 or self._wanted(1) or self._wanted(3)
+        if need_ppn1:
+            with profiler.scope('ppn1'):
+                if use_encoding:
+                    y = self.ppn1_conv(feature_ppn[-1])
+                else:
+                    y = self.ppn1_conv(feature_ppn2[0])
+
+                ppn1_scores = self.ppn1_scores(y)
+                mask = self.selection1(ppn1_scores)
+                attention = self.unpool1(mask)
+                if self.training:
+                    with torch.no_grad():
+                        attention = self.add_labels1(attention, torch.cat([label[:, :-1]/2**self.half_stride, label[:, -1][:, None]], dim=1).long())
+                        # for b in range(self._flags.BATCH_SIZE):
+                        #     batch_index = attention.get_spatial_locations()[:, -1] == b
+                        #     print(attention.features.shape, batch_index.shape)
+                        #     if attention.features[batch_index].sum() == 0:
+                        #         print(label[label[:, -1] == b])
+                        #         print((label/2**self.half_stride).long()[label[:, -1] == b])
+                        #         print(attention.features[batch_index])
+                        #         print(attention.get_spatial_locations()[batch_index])
+                        # print(attention.features[attention.get_spatial_locations()[:, -1] == 11].size())
+                        # print(attention.features[attention.get_spatial_locations()[:, -1] == 11][attention.features[attention.get_spatial_locations()[:, -1] == 11]>0])
+        if need_ppn2:
+            with profiler.scope('ppn2'):
+                if use_encoding:
+                    y = feature_ppn[self.half_stride]
+                else:
+                    y = feature_ppn2[self.half_stride]
+                y = self.multiply1(y, attention)
+                pruned, rows = self.prune1(y, attention) if self._prune else (y, None)
+                pruned = self.ppn2_conv(pruned)
+                ppn2_scores = self.unprune(y, self.ppn2_scores(pruned), rows)
+                mask2 = self.selection2(ppn2_scores)
+                attention2 = self.unpool2(mask2)
+                if self.training:
+                    with torch.no_grad():
+                        attention2 = self.add_labels2(attention2, label.long())
+        if need_ppn3:
+            with profiler.scope('ppn3'):
+                if use_encoding:
+                    z = feature_ppn[0]
+                else:
+                    z = feature_ppn2[-1]
+
+                z = self.multiply2(z, attention2)
+                pruned, rows = self.prune2(z, attention2) if self._prune else (z, None)
+                pruned = self.ppn3_conv(pruned)
+                ppn3_pixel_pred = self.unprune(z, self.ppn3_pixel_pred(pruned), rows)
+                ppn3_scores = self.unprune(z, self.ppn3_scores(pruned), rows)
+                ppn3_features = [ppn3_pixel_pred.features, ppn3_scores.features]
+                if self._point_types:
+                    ppn3_features.append(self.unprune(z, self.ppn3_type(pruned), rows).features)
         # FIXME wrt batch index
-        pixel_pred = ppn3_pixel_pred.features
-        scores = ppn3_scores.features
-        return [[torch.cat([pixel_pred, scores], dim=1)],
-                [torch.cat([ppn1_scores.get_spatial_locations().cuda().float(), ppn1_scores.features], dim=1)],
-                [torch.cat([ppn2_scores.get_spatial_locations().cuda().float(), ppn2_scores.features], dim=1)],
-                [attention.features],
-                [attention2.features]]
+        return [[torch.cat(ppn3_features, dim=1)] if self._wanted(0) else [],
+                [torch.cat([ppn1_scores.get_spatial_locations().to(ppn1_scores.features.device).float(), ppn1_scores.features], dim=1)] if self._wanted(1) else [],
+                [torch.cat([ppn2_scores.get_spatial_locations().to(ppn2_scores.features.device).float(), ppn2_scores.features], dim=1)] if self._wanted(2) else [],
+                [attention.features] if self._wanted(3) else [],
+                [attention2.features] if self._wanted(4) else []]
 
 
 class PPNLoss(torch.nn.modules.loss._Loss):
-    def __init__(self, cfg, reduction='sum'):
+    def __init__(self, cfg, reduction='sum', name='ppn'):
         super(PPNLoss, self).__init__(reduction=reduction)
-        self._cfg = cfg['modules']['ppn']
+        self._cfg = cfg['modules'][name]
         self.cross_entropy = torch.nn.CrossEntropyLoss(reduction='none')
 
     def distances(self, v1, v2):
@@ -115,16 +152,20 @@ class PPNLoss(torch.nn.modules.loss._Loss):
         v2_2 = v2.unsqueeze(0).expand(v1.size(0), v2.size(0), v1.size(1)).double()
         return torch.sqrt(torch.pow(v2_2 - v1_2, 2).sum(2))
 
-    def forward(self, segmentation, label, particles):
+    def forward(self, segmentation, label, particles, targets=None, coordinates=None):
         """
         segmentation[0], label and weight are lists of size #gpus = batch_size.
         segmentation has only 1 element because UResNet returns only 1 element.
         label[0] has shape (N, 1) where N is #pts across minibatch_size events.
         weight can be None.
+        targets (optional) are the positive sites precomputed by iotools.ppn_targets.
+        coordinates (optional) is the collated source of label when label only holds
+        its values (see iotools.shared).
         """
         assert len(segmentation[0]) == len(particles)
         assert len(segmentation[0]) == len(label)
-        batch_ids = [d[:, -2] for d in label]
+        columns = [label_columns(l, c, self._cfg['data_dim']) for l, c in zip(label, coordinates or [None] * len(label))]
+        batch_ids = [c[1] for c in columns]
         total_loss = 0.
         total_acc = 0.
         ppn_count = 0.
@@ -136,7 +177,7 @@ class PPNLoss(torch.nn.modules.loss._Loss):
             event_particles = particles[i]
             for b in batch_ids[i].unique():
                 batch_index = batch_ids[i] == b
-                event_data = label[i][batch_index][:, :-2]  # (N, 3)
+                event_data = columns[i][0][batch_index]  # (N, 3)
                 ppn1_batch_index = segmentation[1][i][:, -3] == b.float()
                 ppn2_batch_index = segmentation[2][i][:, -3] == b.float()
                 event_ppn1_data = segmentation[1][i][ppn1_batch_index][:, :-3]  # (N1, 3)
@@ -157,8 +198,13 @@ class PPNLoss(torch.nn.modules.loss._Loss):
                     ppn_count += 1
                     # Segmentation loss (predict positives)
                     d = self.distances(event_label, event_pixel_pred)
-                    d_true = self.distances(event_label, event_data)
-                    positives = (d_true < 5).any(dim=0)  # FIXME can be empty
+                    if targets is not None:
+                        # Positive sites computed in the data pipeline (iotools.ppn_targets)
+                        event_targets = targets[i][targets[i][:, -2] == b]
+                        positives = target_mask(event_data, event_targets[event_targets[:, -1] == 0][:, :-2])
+                    else:
+                        d_true = self.distances(event_label, event_data)
+                        positives = (d_true < 5).any(dim=0)  # FIXME can be empty
                     if positives.shape[0] == 0:
                         continue
                     loss_seg = torch.mean(self.cross_entropy(event_scores.double(), positives.long()))
@@ -166,19 +212,23 @@ class PPNLoss(torch.nn.modules.loss._Loss):
 
                     # Accuracy for scores
                     predicted_labels = torch.argmax(event_scores, dim=-1)
-                    acc = (predicted_labels == positives.long()).sum().item() / float(predicted_labels.nelement())
+                    acc = (predicted_labels == positives.long()).sum().float() / float(predicted_labels.nelement())
 
                     # Loss ppn1 & ppn2 (predict positives)
-                    d_true_ppn1 = self.distances(event_label/(2**(self._cfg['num_strides']-1)), event_ppn1_data)
-                    d_true_ppn2 = self.distances(event_label/(2**(int(self._cfg['num_strides']/2))), event_ppn2_data)
-                    positives_ppn1 = (d_true_ppn1 < 1).any(dim=0)
-                    positives_ppn2 = (d_true_ppn2 < 1).any(dim=0)
+                    if targets is not None:
+                        positives_ppn1 = target_mask(event_ppn1_data, event_targets[event_targets[:, -1] == 1][:, :-2])
+                        positives_ppn2 = target_mask(event_ppn2_data, event_targets[event_targets[:, -1] == 2][:, :-2])
+                    else:
+                        d_true_ppn1 = self.distances(event_label/(2**(self._cfg['num_strides']-1)), event_ppn1_data)
+                        d_true_ppn2 = self.distances(event_label/(2**(int(self._cfg['num_strides']/2))), event_ppn2_data)
+                        positives_ppn1 = (d_true_ppn1 < 1).any(dim=0)
+                        positives_ppn2 = (d_true_ppn2 < 1).any(dim=0)
                     loss_seg_ppn1 = torch.mean(self.cross_entropy(event_ppn1_scores.double(), positives_ppn1.long()))
                     loss_seg_ppn2 = torch.mean(self.cross_entropy(event_ppn2_scores.double(), positives_ppn2.long()))
                     predicted_labels_ppn1 = torch.argmax(event_ppn1_scores, dim=-1)
                     predicted_labels_ppn2 = torch.argmax(event_ppn2_scores, dim=-1)
-                    acc_ppn1 = (predicted_labels_ppn1 == positives_ppn1.long()).sum().item() / float(predicted_labels_ppn1.nelement())
-                    acc_ppn2 = (predicted_labels_ppn2 == positives_ppn2.long()).sum().item() / float(predicted_labels_ppn2.nelement())
+                    acc_ppn1 = (predicted_labels_ppn1 == positives_ppn1.long()).sum().float() / float(predicted_labels_ppn1.nelement())
+                    acc_ppn2 = (predicted_labels_ppn2 == positives_ppn2.long()).sum().float() / float(predicted_labels_ppn2.nelement())
 
                     # Mask: only consider pixels that were selected
                     event_mask = segmentation[4][i][batch_index]
@@ -195,7 +245,7 @@ class PPNLoss(torch.nn.modules.loss._Loss):
                     # event_ppn2_scores = event_ppn2_scores[event_ppn2_mask]
 
                     # Distance loss
-                    positives = (d_true[:, event_mask] < 5).any(dim=0)
+                    positives = positives[event_mask]
                     distances_positives = d[:, event_mask][:, positives]
                     if distances_positives.shape[1] > 0:
                         d2, _ = torch.min(distances_positives, dim=0)
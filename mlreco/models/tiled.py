@@ -0,0 +1,148 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+import itertools
+import torch
+from mlreco.utils.profiling import profiler
+
+# Outputs holding PPN point predictions, by model name
+POINT_OUTPUTS = {'uresnet_ppn': [0], 'uresnet_ppn_type': [0]}
+
+
+class TiledInference(torch.nn.Module):
+    """
+    Sliding-window inference around a sparse model (e.g. uresnet_ppn,
+    uresnet_lonely) for events larger than its spatial_size.
+
+    Each event is split into cubic tiles of tile_size voxels overlapping by
+    overlap voxels. Tiles become the events of smaller minibatches (at most
+    tiles_per_forward tiles and max_voxels voxels per forward pass, if > 0),
+    so that memory does not grow with the detector size. Outputs with one
+    row per input voxel (segmentation scores, PPN point predictions) are
+    stitched back in the input order:
+      policy 'center' .. each voxel takes the output of the tile where it is
+                         furthest from the borders
+      policy 'mean' .... outputs of all tiles containing the voxel are averaged
+    Rows of point_outputs (PPN predictions) always follow 'center', so that
+    points near tile borders are predicted once. Other outputs are returned
+    as empty lists.
+    Tile origins are multiples of alignment (the coarsest stride of the
+    model, 2**(num_strides-1)), so that voxels are downsampled in the same
+    groups in every tile and as without tiling; the overlap is rounded up
+    accordingly. tile_size must be at most the model spatial_size.
+    """
+    def __init__(self, model, tile_size, overlap=0, tiles_per_forward=8, max_voxels=0,
+                 policy='center', point_outputs=(), alignment=1, spatial_size=None):
+        super(TiledInference, self).__init__()
+        if overlap < 0 or overlap >= tile_size:
+            raise ValueError('Tile overlap must be in [0, tile_size)')
+        if policy not in ['center', 'mean']:
+            raise ValueError('Unknown tile stitching policy %s' % policy)
+        if spatial_size is not None and tile_size > spatial_size:
+            raise ValueError('Tile size %d is larger than the model spatial_size %d' % (tile_size, spatial_size))
+        if alignment < 1 or tile_size % alignment:
+            raise ValueError('Tile size %d must be a multiple of the coarsest stride %d' % (tile_size, alignment))
+        self.model = model
+        self.tile_size = int(tile_size)
+        self.overlap = int(overlap)
+        self.alignment = int(alignment)
+        self.tiles_per_forward = int(tiles_per_forward)
+        self.max_voxels = int(max_voxels)
+        self.policy = policy
+        self.point_outputs = set(point_outputs)
+        self.num_forwards = 0
+
+    @property
+    def requested_outputs(self):
+        return getattr(self.model, 'requested_outputs', None)
+
+    @requested_outputs.setter
+    def requested_outputs(self, value):
+        if hasattr(self.model, 'requested_outputs'):
+            self.model.requested_outputs = value
+
+    def tiles(self, point_cloud):
+        """
+        Returns a list of (origin, voxel indices) of the non-empty tiles
+        """
+        coords = point_cloud[:, :3]
+        batch = point_cloud[:, 3]
+        a = self.alignment
+        stride = max((self.tile_size - self.overlap) // a * a, a)
+        tiles = []
+        for b in torch.unique(batch):
+            event = torch.nonzero(batch == b).flatten()
+            c = coords[event]
+            lo = torch.floor(c.min(dim=0)[0] / a) * a
+            extent = torch.floor(c.max(dim=0)[0]) - lo + 1
+            counts = [int(max(0, (e - self.tile_size + stride - 1) // stride)) + 1 for e in extent.tolist()]
+            for k in itertools.product(*[range(n) for n in counts]):
+                origin = lo + torch.tensor(k, dtype=lo.dtype, device=lo.device) * stride
+                inside = ((c >= origin) & (c < origin + self.tile_size)).all(dim=1)
+                if inside.any():
+                    tiles.append((origin, event[inside]))
+        return tiles
+
+    def _chunks(self, tiles):
+        chunk, num_voxels = [], 0
+        for tile in tiles:
+            if chunk and (len(chunk) == self.tiles_per_forward or
+                          (self.max_voxels > 0 and num_voxels + len(tile[1]) > self.max_voxels)):
+                yield chunk
+                chunk, num_voxels = [], 0
+            chunk.append(tile)
+            num_voxels += len(tile[1])
+        if chunk:
+            yield chunk
+
+    def forward(self, input):
+        point_cloud = input[0]
+        num_voxels = point_cloud.shape[0]
+        stitched, weights, best = {}, {}, {}
+        num_outputs = None
+        with profiler.scope('tiles'):
+            tiles = self.tiles(point_cloud)
+        for chunk in self._chunks(tiles):
+            # Tiles of the chunk are the events of a minibatch
+            tile_input = []
+            for t, (origin, index) in enumerate(chunk):
+                rows = point_cloud[index].clone()
+                rows[:, :3] -= origin
+                rows[:, 3] = t
+                tile_input.append(rows)
+            tile_input = torch.cat(tile_input, dim=0)
+            outputs = self.model([tile_input])
+            self.num_forwards += 1
+            num_outputs = len(outputs)
+
+            start = 0
+            for origin, index in chunk:
+                end = start + len(index)
+                local = point_cloud[index, :3] - origin
+                centrality = torch.min(local, self.tile_size - 1 - local).min(dim=1)[0]
+                for k, output in enumerate(outputs):
+                    if not len(output) or not isinstance(output[0], torch.Tensor) or output[0].shape[0] != tile_input.shape[0]:
+                        continue  # Not one row per voxel
+                    rows = output[0][start:end]
+                    if k not in stitched:
+                        stitched[k] = rows.new_zeros((num_voxels,) + tuple(rows.shape[1:]))
+                        weights[k] = rows.new_zeros((num_voxels,))
+                        best[k] = centrality.new_full((num_voxels,), -1)
+                    if self.policy == 'mean' and k not in self.point_outputs:
+                        stitched[k][index] += rows
+                        weights[k][index] += 1
+                    else:
+                        better = centrality > best[k][index]
+                        stitched[k][index[better]] = rows[better]
+                        best[k][index[better]] = centrality[better]
+                start = end
+
+        results = []
+        for k in range(num_outputs or 0):
+            if k not in stitched:
+                results.append([])
+            elif self.policy == 'mean' and k not in self.point_outputs:
+                results.append([stitched[k] / weights[k].clamp(min=1).view((-1,) + (1,) * (stitched[k].dim() - 1))])
+            else:
+                results.append([stitched[k]])
+        return results
@@ -2,6 +2,8 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 import torch
+from mlreco.utils.profiling import profiler
+from mlreco.iotools.shared import label_columns
 
 
 class UResNet(torch.nn.Module):
@@ -33,7 +35,8 @@ class UResNet(torch.nn.Module):
         point_cloud, = input
         coords = point_cloud[:, :-1].float()
         features = point_cloud[:, -1][:, None].float()
-        x = self.sparseModel((coords, features))
+        with profiler.scope('uresnet'):
+            x = self.sparseModel((coords, features))
         x = self.linear(x)
         return [[x]]
 
@@ -41,20 +44,24 @@ class UResNet(torch.nn.Module):
 class SegmentationLoss(torch.nn.modules.loss._Loss):
     def __init__(self, cfg, reduction='sum'):
         super(SegmentationLoss, self).__init__(reduction=reduction)
+        self._data_dim = cfg.get('modules', {}).get('uresnet', {}).get('data_dim', 3)
         self.cross_entropy = torch.nn.CrossEntropyLoss(reduction='none')
 
-    def forward(self, segmentation, label, weight=None):
+    def forward(self, segmentation, label, weight=None, coordinates=None):
         """
         segmentation[0], label and weight are lists of size #gpus = batch_size.
         segmentation has as many elements as UResNet returns.
         label[0] has shape (N, dim + batch_id + 1)
         where N is #pts across minibatch_size events.
+        coordinates (optional) is the collated source of label when label only holds
+        its values (see iotools.shared).
         """
         # TODO Add weighting
         assert len(segmentation[0]) == len(label)
         # if weight is not None:
         #     assert len(data) == len(weight)
-        batch_ids = [d[:, -2] for d in label]
+        columns = [label_columns(l, c, self._data_dim) for l, c in zip(label, coordinates or [None] * len(label))]
+        batch_ids = [c[1] for c in columns]
         total_loss = 0
         total_acc = 0
         # Loop over GPUS
@@ -62,7 +69,7 @@ class SegmentationLoss(torch.nn.modules.loss._Loss):
             for b in batch_ids[i].unique():
                 batch_index = batch_ids[i] == b
                 event_segmentation = segmentation[0][i][batch_index]
-                event_label = label[i][:, -1][batch_index]
+                event_label = columns[i][2][:, -1][batch_index]
                 event_label = torch.squeeze(event_label, dim=-1).long()
                 loss_seg = self.cross_entropy(event_segmentation, event_label)
                 if weight is not None:
@@ -74,7 +81,7 @@ class SegmentationLoss(torch.nn.modules.loss._Loss):
 
                 # Accuracy
                 predicted_labels = torch.argmax(event_segmentation, dim=-1)
-                acc = (predicted_labels == event_label).sum().item() / float(predicted_labels.nelement())
+                acc = (predicted_labels == event_label).sum().float() / float(predicted_labels.nelement())
                 total_acc += acc
 
         return {
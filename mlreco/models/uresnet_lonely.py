@@ -2,6 +2,9 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 import torch
+from mlreco.utils.profiling import profiler
+from mlreco.models.layers.checkpoint import checkpoint_block
+from mlreco.iotools.shared import label_columns
 
 
 class UResNet(torch.nn.Module):
@@ -10,6 +13,8 @@ class UResNet(torch.nn.Module):
         import sparseconvnet as scn
         model_config = cfg['modules']['uresnet_lonely']
         self._model_config = model_config
+        # Recompute the activations of the encoder/decoder blocks in backward
+        self._checkpoint = model_config.get('checkpoint', False)
         dimension = model_config['data_dim']
         reps = 2  # Conv block repetition factor
         kernel_size = 2  # Use input_spatial_size method for other values?
@@ -87,28 +92,31 @@ class UResNet(torch.nn.Module):
         coords = point_cloud[:, 0:-1].float()
         features = point_cloud[:, -1][:, None].float()
 
-        x = self.input((coords, features))
+        with profiler.scope('input'):
+            x = self.input((coords, features))
         feature_maps = [x]
         feature_ppn = [x]
-        for i, layer in enumerate(self.encoding_block):
-            # print(i, 'encoding')
-            x = self.encoding_block[i](x)
-            feature_maps.append(x)
-            x = self.encoding_conv[i](x)
-            feature_ppn.append(x)
+        with profiler.scope('encoder'):
+            for i, layer in enumerate(self.encoding_block):
+                # print(i, 'encoding')
+                x = checkpoint_block(self.encoding_block[i], x) if self._checkpoint else self.encoding_block[i](x)
+                feature_maps.append(x)
+                x = self.encoding_conv[i](x)
+                feature_ppn.append(x)
 
         # U-ResNet decoding
         feature_ppn2 = [x]
-        for i, layer in enumerate(self.decoding_conv):
-            # print(i, 'decoding')
-            encoding_block = feature_maps[-i-2]
-            x = layer(x)
-            x = self.concat([encoding_block, x])
-            x = self.decoding_blocks[i](x)
-            feature_ppn2.append(x)
-
-        x = self.output(x)
-        x = self.linear(x)  # Output of UResNet
+        with profiler.scope('decoder'):
+            for i, layer in enumerate(self.decoding_conv):
+                # print(i, 'decoding')
+                encoding_block = feature_maps[-i-2]
+                x = layer(x)
+                x = self.concat([encoding_block, x])
+                x = checkpoint_block(self.decoding_blocks[i], x) if self._checkpoint else self.decoding_blocks[i](x)
+                feature_ppn2.append(x)
+
+            x = self.output(x)
+            x = self.linear(x)  # Output of UResNet
 
         return [[x],
                 [feature_ppn],
@@ -126,17 +134,20 @@ class SegmentationLoss(torch.nn.modules.loss._Loss):
         v2_2 = v2.unsqueeze(0).expand(v1.size(0), v2.size(0), v1.size(1)).double()
         return torch.sqrt(torch.pow(v2_2 - v1_2, 2).sum(2))
 
-    def forward(self, segmentation, label, weight=None):
+    def forward(self, segmentation, label, weight=None, coordinates=None):
         """
         segmentation[0], label and weight are lists of size #gpus = batch_size.
         segmentation has only 1 element because UResNet returns only 1 element.
         label[0] has shape (N, 1) where N is #pts across minibatch_size events.
         weight can be None.
+        coordinates (optional) is the collated source of label when label only holds
+        its values (see iotools.shared).
         """
         assert len(segmentation[0]) == len(label)
         if weight is not None:
             assert len(label) == len(weight)
-        batch_ids = [d[:, -2] for d in label]
+        columns = [label_columns(l, c, self._cfg.get('data_dim', 3)) for l, c in zip(label, coordinates or [None] * len(label))]
+        batch_ids = [c[1] for c in columns]
         total_count = 0.
         uresnet_loss, uresnet_acc = 0., 0.
         for i in range(len(label)):
@@ -144,7 +155,7 @@ class SegmentationLoss(torch.nn.modules.loss._Loss):
                 batch_index = batch_ids[i] == b
 
                 event_segmentation = segmentation[0][i][batch_index]  # (N, num_classes)
-                event_label = label[i][batch_index][:, -1][:, None]  # (N, 1)
+                event_label = columns[i][2][batch_index]  # (N, 1)
 
                 # Loss for semantic segmentation
                 event_label = torch.squeeze(event_label, dim=-1).long()
@@ -159,7 +170,7 @@ class SegmentationLoss(torch.nn.modules.loss._Loss):
 
                 # Accuracy for semantic segmentation
                 predicted_labels = torch.argmax(event_segmentation, dim=-1)
-                acc = (predicted_labels == event_label).sum().item() / float(predicted_labels.nelement())
+                acc = (predicted_labels == event_label).sum().float() / float(predicted_labels.nelement())
                 uresnet_acc += acc
 
         return {
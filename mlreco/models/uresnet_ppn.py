@@ -2,7 +2,11 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 import torch
-from mlreco.models.layers.extract_feature_map import Selection, Multiply, AddLabels
+from mlreco.utils.profiling import profiler
+from mlreco.utils.ppn import target_mask
+from mlreco.models.layers.checkpoint import checkpoint_block
+from mlreco.models.layers.extract_feature_map import Selection, Multiply, AddLabels, Prune, Unprune
+from mlreco.iotools.shared import label_columns
 
 
 class PPNUResNet(torch.nn.Module):
@@ -11,6 +15,8 @@ class PPNUResNet(torch.nn.Module):
         import sparseconvnet as scn
         model_config = cfg['modules']['uresnet_ppn']
         self._model_config = model_config
+        # Recompute the activations of the encoder/decoder blocks in backward
+        self._checkpoint = model_config.get('checkpoint', False)
         dimension = model_config['data_dim']
         reps = 2  # Conv block repetition factor
         kernel_size = 2  # Use input_spatial_size method for other values?
@@ -97,6 +103,12 @@ class PPNUResNet(torch.nn.Module):
         self.ppn2_scores = scn.SubmanifoldConvolution(dimension, middle_filters, 2, 3, False)
         self.multiply1 = Multiply()
         self.multiply2 = Multiply()
+        # ppn2 and ppn3 convolutions only on the selected sites (see Prune),
+        # off by default until checked against the dense path on scn tensors
+        self._prune = model_config.get('prune', False)
+        self.prune1 = Prune(dimension)
+        self.prune2 = Prune(dimension)
+        self.unprune = Unprune()
 
         self.ppn3_conv = scn.SubmanifoldConvolution(dimension, nPlanes[0], nPlanes[0], 3, False)
         self.ppn3_pixel_pred = scn.SubmanifoldConvolution(dimension, nPlanes[0], dimension, 3, False)
@@ -105,6 +117,12 @@ class PPNUResNet(torch.nn.Module):
         self.add_labels1 = AddLabels()
         self.add_labels2 = AddLabels()
 
+        # Indices of the outputs to compute (None for all), set in inference
+        # mode. Outputs that are not requested are returned as [].
+        self.requested_outputs = None
+
+    def _wanted(self, i):
+        return self.requested_outputs is None or i in self.requested_outputs
 
     def forward(self, input):
         """
@@ -115,88 +133,100 @@ class PPNUResNet(torch.nn.Module):
         """
         use_encoding = False
 
-        point_cloud, label = input
+        point_cloud = input[0]
         # Now shape (num_label, 5) for 3 coords + batch id + point type
-        # Remove point type
-        label = label[:, :-1]
+        # Remove point type. Labels are only needed for training.
+        label = input[1][:, :-1] if len(input) > 1 else None
         coords = point_cloud[:, 0:-1].float()
         features = point_cloud[:, -1][:, None].float()
 
-        x = self.input((coords, features))
+        with profiler.scope('input'):
+            x = self.input((coords, features))
         feature_maps = [x]
         feature_ppn = [x]
-        for i, layer in enumerate(self.encoding_block):
-            # print(i, 'encoding')
-            x = self.encoding_block[i](x)
-            feature_maps.append(x)
-            x = self.encoding_conv[i](x)
-            feature_ppn.append(x)
+        with profiler.scope('encoder'):
+            for i, layer in enumerate(self.encoding_block):
+                # print(i, 'encoding')
+                x = checkpoint_block(self.encoding_block[i], x) if self._checkpoint else self.encoding_block[i](x)
+                feature_maps.append(x)
+                x = self.encoding_conv[i](x)
+                feature_ppn.append(x)
 
         # U-ResNet decoding
         feature_ppn2 = [x]
-        for i, layer in enumerate(self.decoding_conv):
-            # print(i, 'decoding')
-            encoding_block = feature_maps[-i-2]
-            x = layer(x)
-            x = self.concat([encoding_block, x])
-            x = self.decoding_blocks[i](x)
-            feature_ppn2.append(x)
-
-        x = self.output(x)
-        x = self.linear(x)  # Output of UResNet
-
-        # PPN layers
-        if use_encoding:
-            y = self.ppn1_conv(feature_ppn[-1])
-        else:
-            y = self.ppn1_conv(feature_ppn2[0])
-
-        ppn1_scores = self.ppn1_scores(y)
-        mask = self.selection1(ppn1_scores)
-        attention = self.unpool1(mask)
-        if self.training:
-            with torch.no_grad():
-                attention = self.add_labels1(attention, torch.cat([label[:, :-1]/2**self.half_stride, label[:, -1][:, None]], dim=1).long())
-                # for b in range(self._flags.BATCH_SIZE):
-                #     batch_index = attention.get_spatial_locations()[:, -1] == b
-                #     print(attention.features.shape, batch_index.shape)
-                #     if attention.features[batch_index].sum() == 0:
-                #         print(label[label[:, -1] == b])
-                #         print((label/2**self.half_stride).long()[label[:, -1] == b])
-                #         print(attention.features[batch_index])
-                #         print(attention.get_spatial_locations()[batch_index])
-                # print(attention.features[attention.get_spatial_locations()[:, -1] == 11].size())
-                # print(attention.features[attention.get_spatial_locations()[:, -1] == 11][attention.features[attention.get_spatial_locations()[:, -1] == 11]>0])
-        if use_encoding:
-            y = feature_ppn[self.half_stride]
-        else:
-            y = feature_ppn2[self.half_stride]
-        y = self.multiply1(y, attention)
-        y = self.ppn2_conv(y)
-        ppn2_scores = self.ppn2_scores(y)
-        mask2 = self.selection2(ppn2_scores)
-        attention2 = self.unpool2(mask2)
-        if self.training:
-            with torch.no_grad():
-                attention2 = self.add_labels2(attention2, label.long())
-        if use_encoding:
-            z = feature_ppn[0]
-        else:
-            z = feature_ppn2[-1]
-
-        z = self.multiply2(z, attention2)
-        z = self.ppn3_conv(z)
-        ppn3_pixel_pred = self.ppn3_pixel_pred(z)
-        ppn3_scores = self.ppn3_scores(z)
+        with profiler.scope('decoder'):
+            for i, layer in enumerate(self.decoding_conv):
+                # print(i, 'decoding')
+                encoding_block = feature_maps[-i-2]
+                x = layer(x)
+                x = self.concat([encoding_block, x])
+                x = checkpoint_block(self.decoding_blocks[i], x) if self._checkpoint else self.decoding_blocks[i](x)
+                feature_ppn2.append(x)
+
+            x = self.output(x)
+            x = self.linear(x)  # Output of UResNet
+
+        # PPN layers, only the stages needed by the requested outputs
+        need_ppn3 = self._wanted(0)
+        need_ppn2 = need_ppn3 or self._wanted(2) or self._wanted(5)
+        need_ppn1 = need_ppn2 or self._wanted(1) or self._wanted(4)
+        if need_ppn1:
+            with profiler.scope('ppn1'):
+                if use_encoding:
+                    y = self.ppn1_conv(feature_ppn[-1])
+                else:
+                    y = self.ppn1_conv(feature_ppn2[0])
+
+                ppn1_scores = self.ppn1_scores(y)
+                mask = self.selection1(ppn1_scores)
+                attention = self.unpool1(mask)
+                if self.training:
+                    with torch.no_grad():
+                        attention = self.add_labels1(attention, torch.cat([label[:, :-1]/2**self.half_stride, label[:, -1][:, None]], dim=1).long())
+                        # for b in range(self._flags.BATCH_SIZE):
+                        #     batch_index = attention.get_spatial_locations()[:, -1] == b
+                        #     print(attention.features.shape, batch_index.shape)
+                        #     if attention.features[batch_index].sum() == 0:
+                        #         print(label[label[:, -1] == b])
+                        #         print((label/2**self.half_stride).long()[label[:, -1] == b])
+                        #         print(attention.features[batch_index])
+                        #         print(attention.get_spatial_locations()[batch_index])
+                        # print(attention.features[attention.get_spatial_locations()[:, -1] == 11].size())
+                        # print(attention.features[attention.get_spatial_locations()[:, -1] == 11][attention.features[attention.get_spatial_locations()[:, -1] == 11]>0])
+        if need_ppn2:
+            with profiler.scope('ppn2'):
+                if use_encoding:
+                    y = feature_ppn[self.half_stride]
+                else:
+                    y = feature_ppn2[self.half_stride]
+                y = self.multiply1(y, attention)
+                pruned, rows = self.prune1(y, attention) if self._prune else (y, None)
+                pruned = self.ppn2_conv(pruned)
+                ppn2_scores = self.unprune(y, self.ppn2_scores(pruned), rows)
+                mask2 = self.selection2(ppn2_scores)
+                attention2 = self.unpool2(mask2)
+                if self.training:
+                    with torch.no_grad():
+                        attention2 = self.add_labels2(attention2, label.long())
+        if need_ppn3:
+            with profiler.scope('ppn3'):
+                if use_encoding:
+                    z = feature_ppn[0]
+                else:
+                    z = feature_ppn2[-1]
+
+                z = self.multiply2(z, attention2)
+                pruned, rows = self.prune2(z, attention2) if self._prune else (z, None)
+                pruned = self.ppn3_conv(pruned)
+                ppn3_pixel_pred = self.unprune(z, self.ppn3_pixel_pred(pruned), rows)
+                ppn3_scores = self.unprune(z, self.ppn3_scores(pruned), rows)
         # FIXME wrt batch index
-        pixel_pred = ppn3_pixel_pred.features
-        scores = ppn3_scores.features
-        return [[torch.cat([pixel_pred, scores], dim=1)],
-                [torch.cat([ppn1_scores.get_spatial_locations().cuda().float(), ppn1_scores.features], dim=1)],
-                [torch.cat([ppn2_scores.get_spatial_locations().cuda().float(), ppn2_scores.features], dim=1)],
+        return [[torch.cat([ppn3_pixel_pred.features, ppn3_scores.features], dim=1)] if self._wanted(0) else [],
+                [torch.cat([ppn1_scores.get_spatial_locations().to(ppn1_scores.features.device).float(), ppn1_scores.features], dim=1)] if self._wanted(1) else [],
+                [torch.cat([ppn2_scores.get_spatial_locations().to(ppn2_scores.features.device).float(), ppn2_scores.features], dim=1)] if self._wanted(2) else [],
                 [x],
-                [attention.features],
-                [attention2.features]]
+                [attention.features] if self._wanted(4) else [],
+                [attention2.features] if self._wanted(5) else []]
 
 
 class SegmentationLoss(torch.nn.modules.loss._Loss):
@@ -210,18 +240,22 @@ class SegmentationLoss(torch.nn.modules.loss._Loss):
         v2_2 = v2.unsqueeze(0).expand(v1.size(0), v2.size(0), v1.size(1)).double()
         return torch.sqrt(torch.pow(v2_2 - v1_2, 2).sum(2))
 
-    def forward(self, segmentation, label, particles, weight=None):
+    def forward(self, segmentation, label, particles, weight=None, targets=None, coordinates=None):
         """
         segmentation[0], label and weight are lists of size #gpus = batch_size.
         segmentation has only 1 element because UResNet returns only 1 element.
         label[0] has shape (N, 1) where N is #pts across minibatch_size events.
         weight can be None.
+        targets (optional) are the positive sites precomputed by iotools.ppn_targets.
+        coordinates (optional) is the collated source of label when label only holds
+        its values (see iotools.shared).
         """
         assert len(segmentation[0]) == len(label)
         assert len(particles) == len(label)
         if weight is not None:
             assert len(label) == len(weight)
-        batch_ids = [d[:, -2] for d in label]
+        columns = [label_columns(l, c, self._cfg['data_dim']) for l, c in zip(label, coordinates or [None] * len(label))]
+        batch_ids = [c[1] for c in columns]
         total_loss = 0.
         total_acc = 0.
         ppn_count = 0.
@@ -234,7 +268,7 @@ class SegmentationLoss(torch.nn.modules.loss._Loss):
             event_particles = particles[i]
             for b in batch_ids[i].unique():
                 batch_index = batch_ids[i] == b
-                event_data = label[i][batch_index][:, :-2]  # (N, 3)
+                event_data = columns[i][0][batch_index]  # (N, 3)
                 ppn1_batch_index = segmentation[1][i][:, -3] == b.float()
                 ppn2_batch_index = segmentation[2][i][:, -3] == b.float()
                 event_ppn1_data = segmentation[1][i][ppn1_batch_index][:, :-3]  # (N1, 3)
@@ -248,7 +282,7 @@ class SegmentationLoss(torch.nn.modules.loss._Loss):
                 event_ppn2_scores = segmentation[2][i][ppn2_batch_index][:, -2:]  # (N2, 2)
 
                 event_segmentation = segmentation[3][i][batch_index]  # (N, num_classes)
-                event_label = label[i][batch_index][:, -1][:, None]  # (N, 1)
+                event_label = columns[i][2][batch_index]  # (N, 1)
 
                 # Loss for semantic segmentation
                 event_label = torch.squeeze(event_label, dim=-1).long()
@@ -262,7 +296,7 @@ class SegmentationLoss(torch.nn.modules.loss._Loss):
 
                 # Accuracy for semantic segmentation
                 predicted_labels = torch.argmax(event_segmentation, dim=-1)
-                acc = (predicted_labels == event_label).sum().item() / float(predicted_labels.nelement())
+                acc = (predicted_labels == event_label).sum().float() / float(predicted_labels.nelement())
                 uresnet_acc += acc
 
                 # PPN stuff
@@ -273,8 +307,13 @@ class SegmentationLoss(torch.nn.modules.loss._Loss):
                     ppn_count += 1
                     # Segmentation loss (predict positives)
                     d = self.distances(event_label, event_pixel_pred)
-                    d_true = self.distances(event_label, event_data)
-                    positives = (d_true < 5).any(dim=0)  # FIXME can be empty
+                    if targets is not None:
+                        # Positive sites computed in the data pipeline (iotools.ppn_targets)
+                        event_targets = targets[i][targets[i][:, -2] == b]
+                        positives = target_mask(event_data, event_targets[event_targets[:, -1] == 0][:, :-2])
+                    else:
+                        d_true = self.distances(event_label, event_data)
+                        positives = (d_true < 5).any(dim=0)  # FIXME can be empty
                     if positives.shape[0] == 0:
                         continue
                     loss_seg = torch.mean(self.cross_entropy(event_scores.double(), positives.long()))
@@ -282,19 +321,23 @@ class SegmentationLoss(torch.nn.modules.loss._Loss):
 
                     # Accuracy for scores
                     predicted_labels = torch.argmax(event_scores, dim=-1)
-                    acc = (predicted_labels == positives.long()).sum().item() / float(predicted_labels.nelement())
+                    acc = (predicted_labels == positives.long()).sum().float() / float(predicted_labels.nelement())
 
                     # Loss ppn1 & ppn2 (predict positives)
-                    d_true_ppn1 = self.distances(event_label/(2**(self._cfg['num_strides']-1)), event_ppn1_data)
-                    d_true_ppn2 = self.distances(event_label/(2**(int(self._cfg['num_strides']/2))), event_ppn2_data)
-                    positives_ppn1 = (d_true_ppn1 < 1).any(dim=0)
-                    positives_ppn2 = (d_true_ppn2 < 1).any(dim=0)
+                    if targets is not None:
+                        positives_ppn1 = target_mask(event_ppn1_data, event_targets[event_targets[:, -1] == 1][:, :-2])
+                        positives_ppn2 = target_mask(event_ppn2_data, event_targets[event_targets[:, -1] == 2][:, :-2])
+                    else:
+                        d_true_ppn1 = self.distances(event_label/(2**(self._cfg['num_strides']-1)), event_ppn1_data)
+                        d_true_ppn2 = self.distances(event_label/(2**(int(self._cfg['num_strides']/2))), event_ppn2_data)
+                        positives_ppn1 = (d_true_ppn1 < 1).any(dim=0)
+                        positives_ppn2 = (d_true_ppn2 < 1).any(dim=0)
                     loss_seg_ppn1 = torch.mean(self.cross_entropy(event_ppn1_scores.double(), positives_ppn1.long()))
                     loss_seg_ppn2 = torch.mean(self.cross_entropy(event_ppn2_scores.double(), positives_ppn2.long()))
                     predicted_labels_ppn1 = torch.argmax(event_ppn1_scores, dim=-1)
                     predicted_labels_ppn2 = torch.argmax(event_ppn2_scores, dim=-1)
-                    acc_ppn1 = (predicted_labels_ppn1 == positives_ppn1.long()).sum().item() / float(predicted_labels_ppn1.nelement())
-                    acc_ppn2 = (predicted_labels_ppn2 == positives_ppn2.long()).sum().item() / float(predicted_labels_ppn2.nelement())
+                    acc_ppn1 = (predicted_labels_ppn1 == positives_ppn1.long()).sum().float() / float(predicted_labels_ppn1.nelement())
+                    acc_ppn2 = (predicted_labels_ppn2 == positives_ppn2.long()).sum().float() / float(predicted_labels_ppn2.nelement())
 
                     # Mask: only consider pixels that were selected
                     event_mask = segmentation[5][i][batch_index]
@@ -311,7 +354,7 @@ class SegmentationLoss(torch.nn.modules.loss._Loss):
                     # event_ppn2_scores = event_ppn2_scores[event_ppn2_mask]
 
                     # Distance loss
-                    positives = (d_true[:, event_mask] < 5).any(dim=0)
+                    positives = positives[event_mask]
                     distances_positives = d[:, event_mask][:, positives]
                     if distances_positives.shape[1] > 0:
                         d2, _ = torch.min(distances_positives, dim=0)
@@ -14,9 +14,14 @@ class Chain(torch.nn.Module):
         super(Chain, self).__init__()
         self.ppn = PPN(model_config)
         self.uresnet_lonely = UResNet(model_config)
+        # Indices of the outputs to compute (None for all), see PPN
+        self.requested_outputs = None
 
     def forward(self, input):
-        point_cloud, label = input
+        point_cloud = input[0]
+        label = input[1] if len(input) > 1 else None
+        if self.requested_outputs is not None:
+            self.ppn.requested_outputs = set([i - 1 for i in self.requested_outputs if i > 0])
         x = self.uresnet_lonely((point_cloud,))
         y = self.ppn((label, x[0][0], x[1][0], x[2][0]))
         return [x[0]] + y
@@ -31,9 +36,9 @@ class ChainLoss(torch.nn.modules.loss._Loss):
         self.uresnet_loss = SegmentationLoss(cfg)
         self.ppn_loss = PPNLoss(cfg)
 
-    def forward(self, segmentation, label, particles):
-        uresnet_res = self.uresnet_loss([segmentation[0]], label)
-        ppn_res = self.ppn_loss(segmentation[1:], label, particles)
+    def forward(self, segmentation, label, particles, targets=None, coordinates=None):
+        uresnet_res = self.uresnet_loss([segmentation[0]], label, coordinates=coordinates)
+        ppn_res = self.ppn_loss(segmentation[1:], label, particles, targets=targets, coordinates=coordinates)
         res = { **ppn_res, **uresnet_res }
         res['uresnet_acc'] = uresnet_res['accuracy']
         res['uresnet_loss'] = uresnet_res['loss_seg']
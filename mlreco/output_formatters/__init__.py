@@ -1,13 +1,70 @@
 import numpy as np
-from mlreco.output_formatters.input import input
-from mlreco.output_formatters.uresnet_ppn import uresnet_ppn
-from mlreco import output_formatters
 from mlreco.utils import utils
+from mlreco.utils.registry import Registry
 
+# Output formatters, imported when referenced by model.outputs in the config
+formatters = Registry('output formatter', {
+    'input': 'mlreco.output_formatters.input:input',
+    'uresnet_ppn': 'mlreco.output_formatters.uresnet_ppn:uresnet_ppn'
+})
 
-def output(output_formatters_list, data_blob, res, cfg, idx):
+
+def coordinate_strides(cfg):
+    """
+    Data keys and analysis_keys outputs whose columns 0-2 are coordinates,
+    with their stride in voxels: model.coordinate_keys (key -> stride), by
+    default the keys of the dataset schema, the clusters output (stride 1)
+    and the ppn1, ppn2 outputs (strides of the PPN1 and PPN2 scores).
+    """
+    if 'coordinate_keys' in cfg['model']:
+        return dict(cfg['model']['coordinate_keys'])
+    modules = cfg['model'].get('modules', {}).values()
+    num_strides = next((m['num_strides'] for m in modules if 'num_strides' in m), 1)
+    strides = dict([(key, 1) for key in cfg['iotool']['dataset'].get('schema', {})])
+    strides.update({'clusters': 1, 'ppn1': 2**(num_strides-1), 'ppn2': 2**int(num_strides/2)})
+    return strides
+
+
+def _shift(array, offset):
+    """
+    Copy of array with offset added to its columns 0-2
+    """
+    array = array.astype(np.float64) if array.dtype.kind in 'iu' else array.copy()
+    array[:, :3] += offset
+    return array
+
+
+def uncrop(data_blob, res, offset, cfg):
+    """
+    Shifts the coordinates of the data and outputs of one cropped event
+    back to the full volume (offset: crop offset in voxels, see iotools.crop):
+    by offset / stride for the keys of coordinate_strides, and for each
+    level of the ppn_targets key (see iotools.ppn_targets). Other keys are
+    left as they are.
+    """
+    strides = coordinate_strides(cfg)
+    for blob in [data_blob, res]:
+        for key in blob:
+            if key in strides and isinstance(blob[key], np.ndarray) and len(blob[key].shape) == 2:
+                blob[key] = _shift(blob[key], offset / float(strides[key]))
+    if 'ppn_targets' in data_blob and 'ppn_targets' in cfg['iotool']['dataset']:
+        from mlreco.iotools.ppn_targets import PPN1, PPN2
+        num_strides = cfg['iotool']['dataset']['ppn_targets']['num_strides']
+        targets = data_blob['ppn_targets'].astype(np.float64)
+        for level, stride in [(0, 1), (PPN1, 2**(num_strides-1)), (PPN2, 2**int(num_strides/2))]:
+            rows = targets[:, -1] == level
+            targets[rows, :3] += offset / float(stride)
+        data_blob['ppn_targets'] = targets
+
+
+def output(output_formatters_list, data_blob, res, cfg, idx, use_index=False):
+    """
+    Runs the output formatters on each event. Files are numbered by event
+    in this batch, or by dataset entry if use_index (needs the index key).
+    Coordinates of cropped events (offset key, see iotools.crop) are shifted
+    back to the full volume (see uncrop).
+    """
     event_id = 0
-    print(res)
     for i in range(len(data_blob['input_data'])):
         for j in range(len(data_blob['input_data'][i])):
             batch_idx = np.unique(data_blob['input_data'][i][j][:, -2])
@@ -28,9 +85,13 @@ def output(output_formatters_list, data_blob, res, cfg, idx):
                         else:  # assumes batch is in column 3
                             new_res[key] = res[key][j][res[key][j][:, 3] == b]
 
-                csv_logger = utils.CSVData("%s/output-%.07d.csv" % (cfg['training']['log_dir'], event_id))
+                if 'offset' in new_data_blob:
+                    uncrop(new_data_blob, new_res, new_data_blob['offset'][0, :3], cfg)
+
+                file_id = new_data_blob['index'][0] if use_index else event_id
+                csv_logger = utils.CSVData("%s/output-%.07d.csv" % (cfg['training']['log_dir'], file_id))
                 for output in output_formatters_list:
-                    f = getattr(output_formatters, output)
+                    f = formatters[output]
                     f(csv_logger, new_data_blob, new_res)
                 csv_logger.close()
                 event_id += 1
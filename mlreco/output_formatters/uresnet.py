@@ -1,5 +1,6 @@
 import numpy as np
 import scipy
+from mlreco.utils.logger import logger
 
 
 def uresnet_ppn(csv_logger, data_blob, res):
@@ -32,7 +33,7 @@ def uresnet_ppn(csv_logger, data_blob, res):
         mask = (~(res['mask'] == 0)).any(axis=1)
         events = data_blob['input_data'][mask]
         scores = scores[mask]
-        print(events.shape)
+        logger.debug('Masked event: %s', events.shape)
         for i, row in enumerate(res['points'][mask]):
             event = events[i]
             csv_logger.record(('x', 'y', 'z', 'type', 'value'),
@@ -0,0 +1,318 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+import os
+import time
+import queue
+import socket
+import threading
+import traceback
+import numpy as np
+from multiprocessing.connection import Listener, Client
+from mlreco.trainval import trainval
+from mlreco.iotools.factories import collates
+from mlreco.iotools.compact import expand
+from mlreco.utils.device import parse_gpus
+from mlreco.utils.profiling import profiler
+
+
+def parse_address(address):
+    """
+    'host:port' -> (host, port), anything else is a unix socket path
+    """
+    if isinstance(address, (tuple, list)):
+        return tuple(address)
+    if ':' in address:
+        host, port = address.rsplit(':', 1)
+        return (host, int(port))
+    return address
+
+
+def _no_delay(conn):
+    """
+    Disables Nagle's algorithm on TCP connections: messages are sent as a
+    header and a payload, which would otherwise wait for delayed ACKs.
+    """
+    try:
+        s = socket.socket(fileno=os.dup(conn.fileno()))
+        s.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        s.close()
+    except OSError:
+        pass  # Unix socket
+
+
+def default_authkey(address):
+    """
+    Authentication key from MLRECO_AUTHKEY. Without it, only a unix socket
+    (protected by its file permissions) may use the fixed key b'mlreco':
+    anyone who can reach a TCP port could otherwise send pickles.
+    """
+    key = os.environ.get('MLRECO_AUTHKEY')
+    if key:
+        return key.encode()
+    if isinstance(parse_address(address), str):
+        return b'mlreco'
+    raise ValueError('Set MLRECO_AUTHKEY or pass an authkey to use the inference server over TCP (%s)' % (address,))
+
+
+class _Request(object):
+    __slots__ = ('conn', 'lock', 'id', 'event', 'num_voxels', 'time')
+
+    def __init__(self, conn, lock, request_id, event, num_voxels):
+        self.conn = conn
+        self.lock = lock
+        self.id = request_id
+        self.event = event
+        self.num_voxels = num_voxels
+        self.time = time.time()
+
+    def reply(self, result, error=None):
+        with self.lock:
+            try:
+                self.conn.send((self.id, result, error))
+            except (OSError, EOFError):
+                pass  # Client went away
+
+
+class InferenceServer(object):
+    """
+    Long-lived inference service: the network and its weights are loaded
+    once by trainval, then events are received over a local socket
+    (multiprocessing.connection) and grouped into minibatches.
+
+    A minibatch is sent to the network when the oldest request has waited
+    max_latency seconds, when adding the next event would go over
+    max_voxels voxels in total (or max_time seconds of forward time
+    predicted by cost_model, see utils.cost_model), or when it has
+    max_batch_size events.
+
+    Requests are (request_id, event) where event is a dictionary
+    network_input key -> data in the parser output format (e.g. the
+    (voxels, values) tuple of parse_sparse3d_scn). Replies are
+    (request_id, result, error) where result is a dictionary
+    analysis_keys key -> rows of this event.
+    Use InferenceClient to talk to it. An event that fails in the network
+    fails only its own request: its minibatch is run again one event at a
+    time.
+    """
+    def __init__(self, cfg, address=('localhost', 0), authkey=None,
+                 max_latency=0.01, max_voxels=1000000, max_batch_size=64,
+                 cost_model=None, max_time=None):
+        authkey = authkey or default_authkey(address)
+        self._input_keys = list(cfg['model']['network_input'])
+        if 'analysis_keys' not in cfg['model']:
+            raise ValueError('The inference server needs model.analysis_keys to know what to return')
+        self._output_keys = cfg['model']['analysis_keys']
+        self.max_latency = max_latency
+        self.max_voxels = max_voxels
+        self.max_batch_size = max_batch_size
+        self.cost_model = cost_model
+        self.max_time = max_time
+
+        # One minibatch of one event group per call, on the first device
+        training = cfg['training']
+        if isinstance(training['gpus'], str):
+            training['device'], training['gpus'] = parse_gpus(training['gpus'])
+        training['gpus'] = training['gpus'][:1]
+        training['train'] = False
+        training.setdefault('inference_mode', True)
+        cfg['iotool']['batch_size'] = 1
+        training['minibatch_size'] = 1
+        cfg['data_keys'] = self._input_keys
+        # Profiling keeps every duration: off by default for a long-lived process
+        profiler.configure(enabled=training.get('profile', False), sync=training.get('profile_sync', False))
+        self.trainer = trainval(cfg)
+        self.trainer.initialize()
+        self._collate = collates[cfg['iotool'].get('collate_fn', 'CollateSparse')]
+
+        self._listener = Listener(parse_address(address), authkey=authkey)
+        self.address = self._listener.address
+        self._queue = queue.Queue()
+        self._running = False
+        self._threads = []
+        self.num_batches = 0
+        self.num_events = 0
+
+    def start(self):
+        """
+        Starts accepting connections and processing events in background threads.
+        """
+        self._running = True
+        for target in [self._accept_loop, self._batch_loop]:
+            t = threading.Thread(target=target)
+            t.daemon = True
+            t.start()
+            self._threads.append(t)
+        return self
+
+    def serve_forever(self):
+        self.start()
+        print('Inference server listening on', self.address)
+        try:
+            while self._running:
+                time.sleep(1.)
+        except KeyboardInterrupt:
+            pass
+        self.close()
+
+    def close(self):
+        self._running = False
+        try:
+            self._listener.close()
+        except OSError:
+            pass
+
+    def _accept_loop(self):
+        while self._running:
+            try:
+                conn = self._listener.accept()
+            except (OSError, EOFError):
+                if not self._running:
+                    break
+                continue  # Failed handshake
+            _no_delay(conn)
+            t = threading.Thread(target=self._receive_loop, args=(conn,))
+            t.daemon = True
+            t.start()
+
+    def _receive_loop(self, conn):
+        lock = threading.Lock()
+        while self._running:
+            try:
+                message = conn.recv()
+            except (OSError, EOFError):
+                break
+            request_id = message[0] if isinstance(message, tuple) and len(message) else None
+            try:
+                request_id, event = message
+                data = event[self._input_keys[0]]
+                num_voxels = len(data[0]) if isinstance(data, tuple) else len(data)
+            except Exception:
+                # Malformed request: reply now, the connection stays usable
+                _Request(conn, lock, request_id, None, 0).reply(None, traceback.format_exc())
+                continue
+            self._queue.put(_Request(conn, lock, request_id, event, num_voxels))
+        conn.close()
+
+    def _next_batch(self, pending):
+        """
+        Returns (batch, pending) where pending is the request that did not
+        fit in the voxel budget of this batch.
+        """
+        first = pending if pending is not None else self._queue.get(timeout=0.1)
+        batch, total = [first], first.num_voxels
+        deadline = first.time + self.max_latency
+        pending = None
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.time()
+            if timeout <= 0:
+                break
+            try:
+                request = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if total + request.num_voxels > self.max_voxels or \
+                    not self._within_time(len(batch) + 1, total + request.num_voxels):
+                pending = request
+                break
+            batch.append(request)
+            total += request.num_voxels
+        return batch, pending
+
+    def _within_time(self, events, voxels):
+        if self.cost_model is None or self.max_time is None:
+            return True
+        return self.cost_model.predict(voxels, events) <= self.max_time
+
+    def _batch_loop(self):
+        pending = None
+        while self._running:
+            try:
+                batch, pending = self._next_batch(pending)
+            except queue.Empty:
+                continue
+            self._run(batch)
+
+    def _run(self, batch):
+        """
+        Processes a minibatch and replies to its requests. If it fails, its
+        events are processed one at a time so that only the requests that
+        fail on their own get an error.
+        """
+        try:
+            results = self.process([request.event for request in batch])
+        except Exception:
+            if len(batch) > 1:
+                for request in batch:
+                    self._run([request])
+                return
+            batch[0].reply(None, traceback.format_exc())
+            return
+        for request, result in zip(batch, results):
+            request.reply(result)
+
+    def process(self, events):
+        """
+        Runs the network on a list of events, returns a list of dictionaries
+        analysis_keys key -> rows of the event.
+        """
+        blob = self._collate([tuple([event[key] for key in self._input_keys]) for event in events])
+        data_blob = dict([(key, [[blob[i]]]) for i, key in enumerate(self._input_keys)])
+        res = self.trainer.forward(data_blob)
+        self.num_batches += 1
+        self.num_events += len(events)
+
+        # Same splitting as output_formatters.output
+        data = expand(blob[0])
+        results = []
+        for b in range(len(events)):
+            data_index = data[:, 3] == b
+            result = {}
+            for key in self._output_keys:
+                value = res[key][0] if len(res[key]) else np.empty((0, 0))
+                if value.shape[0] == data_index.shape[0]:
+                    result[key] = value[data_index]
+                elif len(value.shape) == 2 and value.shape[1] > 3:  # assumes batch is in column 3
+                    result[key] = value[value[:, 3] == b]
+                else:
+                    result[key] = value
+            results.append(result)
+        return results
+
+
+class InferenceClient(object):
+    """
+    Client of InferenceServer. infer() sends one event and waits for its
+    result, infer_many() sends several events before waiting so that the
+    server can batch them.
+    """
+    def __init__(self, address, authkey=None):
+        self._conn = Client(parse_address(address), authkey=authkey or default_authkey(address))
+        _no_delay(self._conn)
+        self._next_id = 0
+
+    def submit(self, event):
+        request_id = self._next_id
+        self._next_id += 1
+        self._conn.send((request_id, event))
+        return request_id
+
+    def receive(self):
+        request_id, result, error = self._conn.recv()
+        if error is not None:
+            raise RuntimeError('Inference server error for request %d:\n%s' % (request_id, error))
+        return request_id, result
+
+    def infer(self, event):
+        return self.infer_many([event])[0]
+
+    def infer_many(self, events):
+        ids = [self.submit(event) for event in events]
+        results = {}
+        while len(results) < len(ids):
+            request_id, result = self.receive()
+            results[request_id] = result
+        return [results[i] for i in ids]
+
+    def close(self):
+        self._conn.close()
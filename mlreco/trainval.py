@@ -2,12 +2,15 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 import torch
-import time
 import os
+import time
 from mlreco.utils.data_parallel import DataParallel
 from mlreco.models import models
-import numpy as np
-import re
+from mlreco.utils.metrics import MetricsAccumulator
+from mlreco.utils.profiling import profiler
+from mlreco.iotools.compact import CompactSparseTensor, expand
+from mlreco.iotools.shared import join_shared
+from mlreco.utils.device import get_device, num_devices
 
 
 class trainval(object):
@@ -15,8 +18,7 @@ class trainval(object):
     Groups all relevant functions for forward/backward of a network.
     """
     def __init__(self, cfg):
-        self.tspent = {}
-        self.tspent_sum = {}
+        self.metrics = MetricsAccumulator()
         self._model_config = cfg['model']
         model_config = cfg['model']
         training_config = cfg['training']
@@ -24,12 +26,49 @@ class trainval(object):
         self._batch_size = cfg['iotool']['batch_size']
         self._minibatch_size = cfg['training']['minibatch_size']
         self._gpus = cfg['training']['gpus']
+        self._num_devices = num_devices(cfg)
+        self._device = get_device(cfg)
         self._input_keys = model_config['network_input']
         self._loss_keys = model_config['loss_input']
+        # Keys collated without coordinates (see iotools.shared): network
+        # inputs are joined to their source on device, the loss gets the label
+        # values and the source as coordinates, other keys stay values only
+        shared = cfg['iotool'].get('dataset', {}).get('shared_coordinates', None) or {}
+        self._shared = dict([(key, source) for key, source in shared.items() if key in self._input_keys])
+        self._label_source = shared.get(self._loss_keys[0], None) \
+            if self._loss_keys and self._loss_keys[0] not in self._shared else None
+        modules = model_config.get('modules', {}).values()
+        self._data_dim = next((m['data_dim'] for m in modules if 'data_dim' in m), 3)
+        # Optional keyword arguments of the loss: argument name -> data key
+        self._loss_kwargs = model_config.get('loss_kwargs', {})
         self._train = training_config['train']
         self._model_name = model_config['name']
         self._learning_rate = training_config['learning_rate']
         self._model_path = training_config['model_path']
+        # False: outputs stay on their device, the loss is computed per device
+        self._gather = training_config.get('gather', True)
+        # Run backward after each minibatch instead of once per batch
+        self._accumulate = training_config.get('gradient_accumulation', False)
+        # Lean inference: torch.inference_mode, only the analysis_keys outputs
+        self._inference = training_config.get('inference_mode', False) and not self._train
+        # No loss when the dataset does not provide the labels
+        data_keys = cfg.get('data_keys', None)
+        self._compute_loss = bool(self._loss_keys) and \
+            (data_keys is None or all([key in data_keys for key in self._loss_keys]))
+        if self._train and self._loss_keys and not self._compute_loss:
+            raise ValueError('Training requires the loss_input keys %s in the dataset schema' % self._loss_keys)
+        # Size and cost of each event and minibatch (utils.cost_model.CostLog,
+        # set by main_funcs with training.cost_log): index of the model output
+        # masking the candidate voxels (e.g. PPN attention) and clusters key
+        # to count per event
+        self.cost_log = None
+        self._cost_keys = training_config.get('cost_log_keys', {})
+        # Sliding-window inference (see models.tiled), outputs only
+        self._tiling = model_config.get('tiling', None)
+        if self._tiling is not None:
+            if self._train:
+                raise ValueError('model.tiling is only supported in inference')
+            self._compute_loss = False
 
     def backward(self):
         total_loss = 0.0
@@ -39,19 +78,28 @@ class trainval(object):
         self._loss = []  # Reset loss accumulator
 
         self._optimizer.zero_grad()  # Reset gradients accumulation
-        total_loss.backward()
+        with profiler.scope('backward'):
+            start = self._cost_start()
+            total_loss.backward()
+            if self.cost_log is not None:
+                backward_time, peak_memory = self._cost_stop(start)
+                self.cost_log.record_batch(-1, self._cost_events, self._cost_voxels,
+                                           backward_time=backward_time, peak_memory=peak_memory)
         # torch.nn.utils.clip_grad_norm_(self._net.parameters(), 1.0)
-        self._optimizer.step()
+        with profiler.scope('optimizer'):
+            self._optimizer.step()
 
     def save_state(self, iteration):
-        tstart = time.time()
         filename = '%s-%d.ckpt' % (self._weight_prefix, iteration)
-        torch.save({
-            'global_step': iteration,
-            'state_dict': self._net.state_dict(),
-            'optimizer': self._optimizer.state_dict()
-        }, filename)
-        self.tspent['save'] = time.time() - tstart
+        with profiler.scope('save', always=True):
+            torch.save({
+                'global_step': iteration,
+                'state_dict': self._net.state_dict(),
+                'optimizer': self._optimizer.state_dict()
+            }, filename)
+
+    def num_minibatches(self):
+        return int(self._batch_size / (self._minibatch_size * self._num_devices))
 
     def train_step(self, data_blob):
         """
@@ -59,13 +107,18 @@ class trainval(object):
         It is a dictionary where data_blob[key] = list of length
         BATCH_SIZE / (MINIBATCH_SIZE * len(GPUS))
         """
-        tstart = time.time()
         self._loss = []  # Initialize loss accumulator
-        res_combined = self.forward(data_blob)
-        # Run backward once for all the previous forward
-        self.backward()
-        self.tspent['train'] = time.time() - tstart
-        self.tspent_sum['train'] += self.tspent['train']
+        with profiler.scope('train', always=True):
+            if self._accumulate:
+                # Gradients are accumulated by _forward, one minibatch at a time
+                self._optimizer.zero_grad()
+                res_combined = self.forward(data_blob)
+                with profiler.scope('optimizer'):
+                    self._optimizer.step()
+            else:
+                res_combined = self.forward(data_blob)
+                # Run backward once for all the previous forward
+                self.backward()
         return res_combined
 
     def forward(self, data_blob):
@@ -74,11 +127,20 @@ class trainval(object):
         flags.BATCH_SIZE / (flags.MINIBATCH_SIZE * len(flags.GPUS)) times
         """
         res_combined = {}
-        for idx in range(int(self._batch_size / (self._minibatch_size * len(self._gpus)))):
+        # Events of this batch: less than batch_size at the end of a stream
+        num_events = self._batch_size
+        if 'index' in data_blob:
+            num_events = sum([len(d) for minibatch in data_blob['index'] for d in minibatch])
+        if self.cost_log is not None:
+            self.cost_log.next_batch()
+            self._cost_events, self._cost_voxels = 0, 0
+        # Usually num_minibatches(), can be less for the last batch of a stream
+        num_minibatches = len(data_blob[list(data_blob.keys())[0]])
+        for idx in range(num_minibatches):
             blob = {}
             for key in data_blob.keys():
                 blob[key] = data_blob[key][idx]
-            res = self._forward(blob)
+            res = self._forward(blob, minibatch=idx)
             for key in res.keys():
                 if key not in res_combined:
                     res_combined[key] = []
@@ -86,16 +148,68 @@ class trainval(object):
         # Average loss and acc over all the events in this batch
         # Keys of format %s_count are special and used as counters
         # e.g. for PPN when there are no particle labels in event
+        # Values stay on device, running sums go to self.metrics until
+        # they are materialized at report time.
         for key in res_combined:
             if "_count" not in key:
                 if ('analysis_keys' not in self._model_config or key not in self._model_config['analysis_keys']):
-                    if key + "_count" not in res_combined:
-                        res_combined[key] = np.array(res_combined[key]).sum() / self._batch_size
-                    else:
-                        res_combined[key] = np.array(res_combined[key]).sum() / res_combined[key + '_count']
+                    counted = key + "_count" in res_combined
+                    total = sum(res_combined[key])
+                    count = sum(res_combined[key + '_count']) if counted else num_events
+                    self.metrics.add(key, total, count, report_count=counted)
+                    res_combined[key] = total / count if count > 0 else float('nan')
+        for key in res_combined:
+            if "_count" in key:
+                res_combined[key] = sum(res_combined[key])
+        # One host copy per batch for the analysis keys
+        if 'analysis_keys' in self._model_config:
+            for key in self._model_config['analysis_keys']:
+                res_combined[key] = [s.cpu().numpy() for s in res_combined[key]]
         return res_combined
 
-    def _forward(self, data_blob):
+    def _cost_start(self):
+        if self.cost_log is None:
+            return None
+        if self._device.type == 'cuda':
+            torch.cuda.synchronize(self._device)
+            torch.cuda.reset_peak_memory_stats(self._device)
+        return time.perf_counter()
+
+    def _cost_stop(self, start):
+        """
+        Returns the time since _cost_start and the peak memory in GB (nan on CPU)
+        """
+        peak_memory = float('nan')
+        if self._device.type == 'cuda':
+            torch.cuda.synchronize(self._device)
+            peak_memory = torch.cuda.max_memory_allocated(self._device) / 1.e9
+        return time.perf_counter() - start, peak_memory
+
+    def _record_events(self, data_blob, segmentation, minibatch):
+        """
+        Sizes of the events of this minibatch (host data), see CostLog
+        """
+        events, voxels = 0, 0
+        candidates = self._cost_keys.get('candidates', None)
+        clusters_key = self._cost_keys.get('clusters', None)
+        for i, data in enumerate(data_blob[self._input_keys[0]]):
+            data = expand(data)
+            entries = [idx[0] for idx in data_blob['index'][i]] if 'index' in data_blob \
+                else [-1] * (int(data[:, self._data_dim].max()) + 1 if len(data) else 0)
+            mask = None
+            if candidates is not None and len(segmentation[candidates]) > i:
+                mask = (segmentation[candidates][i].detach() > 0).reshape(-1).cpu().numpy()
+                if len(mask) != len(data):
+                    raise ValueError('cost_log_keys.candidates: output %d is not a mask of the input voxels' % candidates)
+            n, v = self.cost_log.record_events(
+                minibatch, i, entries, data,
+                sites=data_blob['active_sites'][i] if 'active_sites' in data_blob else None,
+                candidates=mask,
+                clusters=expand(data_blob[clusters_key][i]) if clusters_key in data_blob else None)
+            events, voxels = events + n, voxels + v
+        return events, voxels
+
+    def _forward(self, data_blob, minibatch=0):
         """
         data/label/weight are lists of size minibatch size.
         For sparse uresnet:
@@ -106,58 +220,117 @@ class trainval(object):
         """
         input_keys = self._input_keys
         loss_keys = self._loss_keys
-        with torch.set_grad_enabled(self._train):
+        grad_mode = torch.inference_mode() if self._inference else torch.set_grad_enabled(self._train)
+        with grad_mode:
             # Segmentation
             # FIXME set requires_grad = false for labels/weights?
-            for key in data_blob:
-                data_blob[key] = [torch.as_tensor(d).cuda() for d in data_blob[key]]
+            # Host data, counted in the cost log once the outputs are known
+            host_blob = dict(data_blob) if self.cost_log is not None else None
+            with profiler.scope('h2d'):
+                for key in data_blob:
+                    # CompactSparseTensor: one copy of the packed batch, expanded on device
+                    data_blob[key] = [d.to(self._device) if isinstance(d, CompactSparseTensor)
+                                      else torch.as_tensor(d).to(self._device) for d in data_blob[key]]
+                join_shared(data_blob, self._shared, self._data_dim)
             data = []
-            for i in range(len(self._gpus)):
+            # Can be fewer than devices for the last batch of a stream
+            for i in range(len(data_blob[input_keys[0]])):
                 data.append([data_blob[key][i] for key in input_keys])
-            tstart = time.time()
-            segmentation = self._net(data)
+            with profiler.scope('forward', always=True):
+                start = self._cost_start()
+                segmentation = self._net(data)
+                if self.cost_log is not None:
+                    forward_time, peak_memory = self._cost_stop(start)
+                    backward_time = float('nan')
+            if self.cost_log is not None:
+                events, voxels = self._record_events(host_blob, segmentation, minibatch)
+                self._cost_events, self._cost_voxels = self._cost_events + events, self._cost_voxels + voxels
 
             # Compute the loss
-            if loss_keys:
-                loss_acc = self._criterion(segmentation, *tuple([data_blob[key] for key in loss_keys]))
-                if self._train:
+            loss_acc = {}
+            if self._compute_loss:
+                with profiler.scope('loss'):
+                    if self._gather or len(self._gpus) < 2:
+                        loss_acc = self._loss_step(segmentation, data_blob)
+                    else:
+                        loss_acc = self._device_loss(segmentation, data_blob)
+                if self._train and self._accumulate:
+                    # Free this minibatch graph right away, same scaling
+                    # as the average computed in backward()
+                    with profiler.scope('backward'):
+                        start = self._cost_start()
+                        (loss_acc['loss_seg'] / self.num_minibatches()).backward()
+                        if self.cost_log is not None:
+                            backward_time, backward_memory = self._cost_stop(start)
+                            peak_memory = max(peak_memory, backward_memory)
+                elif self._train:
                     self._loss.append(loss_acc['loss_seg'])
+            if self.cost_log is not None:
+                self.cost_log.record_batch(minibatch, events, voxels, forward_time=forward_time,
+                                           backward_time=backward_time, peak_memory=peak_memory)
 
-            self.tspent['forward'] = time.time() - tstart
-            self.tspent_sum['forward'] += self.tspent['forward']
-
-            # Record results
+            # Record results (no host copy here, see MetricsAccumulator)
             res = {}
             for label in loss_acc:
-                res[label] = [loss_acc[label].cpu().item() if not isinstance(loss_acc[label], float) else loss_acc[label]]
-            # Use analysis keys to also get tensors
+                res[label] = [loss_acc[label].detach() if isinstance(loss_acc[label], torch.Tensor) else loss_acc[label]]
+            # Use analysis keys to also get tensors (copied to host by forward)
             if 'analysis_keys' in self._model_config:
                 for key in self._model_config['analysis_keys']:
-                    res[key] = [s.cpu().detach().numpy() for s in segmentation[self._model_config['analysis_keys'][key]]]
+                    res[key] = [s.detach() for s in segmentation[self._model_config['analysis_keys'][key]]]
             return res
 
+    def _loss_step(self, segmentation, data_blob):
+        loss_kwargs = dict([(arg, data_blob[key]) for arg, key in self._loss_kwargs.items() if key in data_blob])
+        if self._label_source is not None:
+            loss_kwargs['coordinates'] = data_blob[self._label_source]
+        return self._criterion(segmentation, *tuple([data_blob[key] for key in self._loss_keys]), **loss_kwargs)
+
+    def _device_loss(self, segmentation, data_blob):
+        """
+        Loss of each device on the outputs it computed (training.gather
+        False), its labels are copied there. The results are sums over
+        events, they are added up on the main device.
+        """
+        loss_acc = {}
+        for i, device_id in enumerate(self._net.device_ids[:len(data_blob[self._input_keys[0]])]):
+            device = torch.device('cuda', device_id)
+            blob = dict([(key, [data_blob[key][i].to(device)]) for key in data_blob])
+            res = self._loss_step([s[i:i+1] for s in segmentation], blob)
+            for key in res:
+                value = res[key].to(self._device) if isinstance(res[key], torch.Tensor) else res[key]
+                loss_acc[key] = loss_acc[key] + value if key in loss_acc else value
+        return loss_acc
+
     def initialize(self):
         # To use DataParallel all the inputs must be on devices[0] first
         model = None
+        self._criterion = None
         if self._model_name in models:
             model, criterion = models[self._model_name]
-            self._criterion = criterion(self._model_config).cuda()
+            if self._compute_loss:
+                self._criterion = criterion(self._model_config).to(self._device)
         else:
             raise Exception("Unknown model name provided")
 
-        self.tspent_sum['forward'] = self.tspent_sum['train'] = self.tspent_sum['save'] = 0.
-        self.tspent['forward'] = self.tspent['train'] = self.tspent['save'] = 0.
+        self.metrics.reset()
 
         self._net = DataParallel(model(self._model_config),
                                       device_ids=self._gpus,
-                                      dense=False) # FIXME
+                                      dense=False, # FIXME
+                                      gather=self._gather)
 
         if self._train:
-            self._net.train().cuda()
+            self._net.train().to(self._device)
         else:
-            self._net.eval().cuda()
+            self._net.eval().to(self._device)
+
+        # In inference mode, only compute the outputs listed in analysis_keys
+        if self._inference and not self._compute_loss and hasattr(self._net.module, 'requested_outputs'):
+            self._net.module.requested_outputs = set(self._model_config.get('analysis_keys', {}).values())
 
-        self._optimizer = torch.optim.Adam(self._net.parameters(), lr=self._learning_rate)
+        self._optimizer = None
+        if self._train:
+            self._optimizer = torch.optim.Adam(self._net.parameters(), lr=self._learning_rate)
         self._softmax = torch.nn.Softmax(dim=1 if 'sparse' in self._model_name else 0)
 
         iteration = 0
@@ -174,10 +347,13 @@ class trainval(object):
                     raise ValueError('File not found: %s for module %s\n' % (model_path, module))
                 print('Restoring weights from %s...' % model_path)
                 with open(model_path, 'rb') as f:
-                    checkpoint = torch.load(f)
-                    # Edit checkpoint variable names
+                    checkpoint = torch.load(f, map_location=self._device)
+                    # Edit checkpoint variable names: module.<module>.x is module.x in the checkpoint
+                    prefix = 'module.%s.' % module
                     for name in self._net.state_dict():
-                        other_name = re.sub(module + '.', '', name)
+                        if module == '' or not name.startswith(prefix):
+                            continue
+                        other_name = 'module.' + name[len(prefix):]
                         # print(module, name, other_name, other_name in checkpoint['state_dict'])
                         if other_name in checkpoint['state_dict']:
                             checkpoint['state_dict'][name] = checkpoint['state_dict'].pop(other_name)
@@ -196,4 +372,19 @@ class trainval(object):
                         iteration = checkpoint['global_step'] + 1
                 print('Done.')
 
+        if self._tiling is not None:
+            from mlreco.models.tiled import TiledInference, POINT_OUTPUTS
+            modules = self._model_config.get('modules', {}).values()
+            num_strides = next((m['num_strides'] for m in modules if 'num_strides' in m), 1)
+            spatial_size = next((m['spatial_size'] for m in modules if 'spatial_size' in m), None)
+            self._net.module = TiledInference(self._net.module,
+                                              tile_size=self._tiling['tile_size'],
+                                              overlap=self._tiling.get('overlap', 0),
+                                              tiles_per_forward=self._tiling.get('tiles_per_forward', 8),
+                                              max_voxels=self._tiling.get('max_voxels', 0),
+                                              policy=self._tiling.get('policy', 'center'),
+                                              point_outputs=self._tiling.get('point_outputs', POINT_OUTPUTS.get(self._model_name, [])),
+                                              alignment=2**(num_strides-1),
+                                              spatial_size=spatial_size)
+
         return iteration
@@ -0,0 +1,140 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+import json
+import numpy as np
+
+# Measurements of a unit of work (minibatch, or whole batch for backward)
+TARGETS = ('forward_time', 'backward_time', 'peak_memory')
+
+
+def active_sites(voxels, num_strides):
+    """
+    Number of active sites of an event at strides 2, 4, ... 2**(num_strides-1),
+    i.e. of distinct voxels once the coordinates are divided by the stride
+    (what a strided sparse convolution with filter size = stride keeps)
+    """
+    voxels = np.asarray(voxels, dtype=np.int64)
+    return [len(np.unique(voxels // 2**s, axis=0)) for s in range(1, num_strides)]
+
+
+class CostLog(object):
+    """
+    Side log of the size and cost of what the trainer processes, two CSV
+    files with a fixed set of columns:
+      <prefix>_events-<iteration>.csv: batch, minibatch, device, entry,
+        voxels, sites_1 ... (see active_sites), candidates, clusters
+      <prefix>_batches-<iteration>.csv: batch, minibatch, events, voxels,
+        forward_time, backward_time, peak_memory
+    A minibatch -1 row is the whole batch, for the backward pass when it
+    runs once per batch. Missing measurements are nan (e.g. peak_memory on
+    CPU), missing counts -1. Rows are buffered and written at flush.
+    data_dim is the number of coordinates, followed by the batch id in the
+    collated arrays.
+    """
+    def __init__(self, prefix, iteration, num_strides=1, data_dim=3):
+        self.num_strides = num_strides
+        self.data_dim = data_dim
+        self._events = open('%s_events-%07d.csv' % (prefix, iteration), 'w')
+        self._batches = open('%s_batches-%07d.csv' % (prefix, iteration), 'w')
+        sites = ','.join(['sites_%d' % s for s in range(1, num_strides)])
+        self._events.write('batch,minibatch,device,entry,voxels,%scandidates,clusters\n' % (sites + ',' if sites else ''))
+        self._batches.write('batch,minibatch,events,voxels,%s\n' % ','.join(TARGETS))
+        self.batch = 0
+        self._buffer = []
+
+    def record_events(self, minibatch, device, entries, voxels, sites=None, candidates=None, clusters=None):
+        """
+        voxels is the collated (N, >=data_dim+1) input of one device (batch
+        id in column data_dim), sites the collated active_sites data chunk (see
+        iotools.sites, batch id in the last column), candidates a (N,)
+        boolean mask of the voxels selected by the network (e.g. PPN
+        attention) and clusters the collated array whose distinct values of
+        the last column are counted per event.
+        Returns the number of events and voxels.
+        """
+        num_events = len(entries)
+        batch_ids = voxels[:, self.data_dim].astype(np.int64)
+        counts = np.bincount(batch_ids, minlength=num_events)
+        if candidates is not None:
+            candidates = np.bincount(batch_ids[candidates], minlength=num_events)
+        if sites is not None:
+            sites = dict([(int(row[-1]), [int(v) for v in row[:-1]]) for row in sites])
+        for b, entry in enumerate(entries):
+            row = [self.batch, minibatch, device, entry, int(counts[b])]
+            row += sites[b] if sites is not None else [-1] * (self.num_strides - 1)
+            row.append(int(candidates[b]) if candidates is not None else -1)
+            row.append(len(np.unique(clusters[clusters[:, self.data_dim] == b, -1])) if clusters is not None else -1)
+            self._buffer.append((self._events, row))
+        return num_events, len(voxels)
+
+    def record_batch(self, minibatch, events, voxels, forward_time=np.nan,
+                     backward_time=np.nan, peak_memory=np.nan):
+        self._buffer.append((self._batches, [self.batch, minibatch, events, voxels,
+                                             forward_time, backward_time, peak_memory]))
+
+    def next_batch(self):
+        self.batch += 1
+
+    def flush(self):
+        for f, row in self._buffer:
+            f.write(','.join(['%g' % v if isinstance(v, float) else str(v) for v in row]) + '\n')
+        self._buffer = []
+        self._events.flush()
+        self._batches.flush()
+
+    def close(self):
+        self.flush()
+        self._events.close()
+        self._batches.close()
+
+
+class CostModel(object):
+    """
+    Cost of a unit of work as a linear function of its size:
+        cost = intercept + per_event * events + per_voxel * voxels
+    for each of TARGETS, fitted by least squares on the batches files of a
+    CostLog. Used by training.balance (cost of each event), and the
+    inference server (time budget of a minibatch).
+    """
+    def __init__(self, coefficients):
+        self.coefficients = dict([(target, tuple(c)) for target, c in coefficients.items()])
+
+    def predict(self, voxels, events=1, target='forward_time'):
+        intercept, per_event, per_voxel = self.coefficients[target]
+        return intercept + per_event * events + per_voxel * voxels
+
+    def event_cost(self, voxels, target='forward_time'):
+        """
+        Marginal cost of one more event of this size in a minibatch
+        """
+        _, per_event, per_voxel = self.coefficients[target]
+        return per_event + per_voxel * voxels
+
+    @staticmethod
+    def fit(filenames, targets=TARGETS):
+        """
+        Fits each target on the rows of the batches files where it was
+        measured. Targets without any measurement are left out.
+        """
+        if isinstance(filenames, str):
+            filenames = [filenames]
+        tables = [np.genfromtxt(f, delimiter=',', names=True, ndmin=1) for f in filenames]
+        rows = np.concatenate([t for t in tables if t.size])
+        coefficients = {}
+        for target in targets:
+            measured = rows[np.isfinite(rows[target])]
+            if not len(measured):
+                continue
+            design = np.stack([np.ones(len(measured)), measured['events'], measured['voxels']], axis=1)
+            coefficients[target] = np.linalg.lstsq(design, measured[target], rcond=None)[0].tolist()
+        return CostModel(coefficients)
+
+    def save(self, filename):
+        with open(filename, 'w') as f:
+            json.dump(self.coefficients, f, indent=2)
+
+    @staticmethod
+    def load(filename):
+        with open(filename) as f:
+            return CostModel(json.load(f))
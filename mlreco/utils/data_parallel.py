@@ -1,27 +1,151 @@
 from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
+import heapq
+import numpy as np
 import torch
 from torch.nn.parallel.scatter_gather import scatter, gather
 
+# Parsers collated as plain arrays (batch id in the last column), the
+# others return (voxels, values) tuples (batch id after the coordinates)
+ARRAY_PARSERS = ('parse_sparse3d', 'parse_tensor3d')
+
+
+def partition(costs, num_devices):
+    """
+    Longest processing time first: events by decreasing cost, each one to
+    the device with the smallest total cost so far. Returns the indices of
+    the events of each device, in increasing order.
+    """
+    loads = [(0., d) for d in range(num_devices)]
+    parts = [[] for _ in range(num_devices)]
+    for e in sorted(range(len(costs)), key=lambda e: -costs[e]):
+        load, d = heapq.heappop(loads)
+        parts[d].append(e)
+        heapq.heappush(loads, (load + costs[e], d))
+    return [sorted(p) for p in parts]
+
+
+def batch_columns(cfg):
+    """
+    Where to find the events in each data key once collated (CollateSparse):
+    the column of the batch id (after the data_dim coordinates of the model),
+    None for per-event lists (index) or the name of the source for keys
+    sharing its voxels (see iotools.shared).
+    """
+    modules = cfg.get('model', {}).get('modules', {}).values()
+    data_dim = next((m['data_dim'] for m in modules if 'data_dim' in m), 3)
+    dataset_cfg = cfg['iotool']['dataset']
+    schema = dataset_cfg.get('schema', {})
+    shared = dataset_cfg.get('shared_coordinates', None) or {}
+    columns = {}
+    for key in cfg['data_keys']:
+        if key in shared:
+            columns[key] = shared[key]
+        elif key == 'index':
+            columns[key] = None
+        elif key in ('offset', 'active_sites') or (key in schema and schema[key][0] in ARRAY_PARSERS):
+            columns[key] = -1
+        else:
+            columns[key] = data_dim
+    return columns
+
+
+def balance(minibatch, columns, cost_key, cost=None):
+    """
+    Moves events between the devices of one minibatch (key -> list of
+    collated numpy arrays, one per device) so that the number of voxels of
+    cost_key is as even as possible (see partition), or the total cost with
+    cost a function of the number of voxels of an event (e.g.
+    CostModel.event_cost). The number of events per device can differ,
+    batch ids are renumbered from 0 on each device. With fewer events than
+    devices, the devices left without events are dropped (the network then
+    runs on fewer devices, see DataParallel.scatter).
+    """
+    num_devices = len(minibatch[cost_key])
+    # Rows of each event (device, batch id) for each key with a batch column
+    rows = {}
+    for key, column in columns.items():
+        if column is None or column in columns:
+            continue
+        rows[key] = []
+        for d in minibatch[key]:
+            if not isinstance(d, np.ndarray):
+                raise ValueError('training.balance: %s is not a collated array' % key)
+            batch_ids = d[:, column].astype(np.int64)
+            rows[key].append([np.flatnonzero(batch_ids == b) for b in range(int(batch_ids.max()) + 1 if len(d) else 0)])
+    # Events per device: per-event lists when there is one, else batch ids
+    lists = [key for key, column in columns.items() if column is None]
+    num_events = [len(d) for d in minibatch[lists[0]]] if lists else [len(r) for r in rows[cost_key]]
+    events = [(d, b) for d in range(num_devices) for b in range(num_events[d])]
+    costs = [len(rows[cost_key][d][b]) if b < len(rows[cost_key][d]) else 0 for d, b in events]
+    if cost is not None:
+        costs = [cost(c) for c in costs]
+    parts = [part for part in partition(costs, num_devices) if part] or [[]]
+
+    balanced = {}
+    for key, column in columns.items():
+        balanced[key] = []
+        for part in parts:
+            if column is None:
+                balanced[key].append([minibatch[key][d][b] for d, b in (events[e] for e in part)])
+                continue
+            source = column if column in columns else key
+            chunks = []
+            for new_b, (d, b) in enumerate(events[e] for e in part):
+                event_rows = rows[source][d][b] if b < len(rows[source][d]) else np.empty(0, dtype=np.int64)
+                chunk = minibatch[key][d][event_rows]
+                if source == key:
+                    chunk[:, column] = new_b
+                chunks.append(chunk)
+            balanced[key].append(np.concatenate(chunks, axis=0) if chunks else minibatch[key][0][:0])
+    return balanced
+
 
 class DataParallel(torch.nn.parallel.DataParallel):
     # FIXME TODO Assumes network has a single input for now
     # TODO add a case for dict
 
-    def __init__(self, module, device_ids=None, output_device=None, dim=0, dense=True):
-        super(DataParallel, self).__init__(module,
-                                                device_ids=device_ids,
-                                                output_device=output_device,
-                                                dim=dim)
+    def __init__(self, module, device_ids=None, output_device=None, dim=0, dense=True, gather=True):
+        if device_ids is not None and len(device_ids) == 0:
+            # CPU: no scatter/replicate, the module runs in this process
+            torch.nn.Module.__init__(self)
+            self.module = module
+            self.device_ids = []
+            self.output_device = None
+            self.dim = dim
+        else:
+            super(DataParallel, self).__init__(module,
+                                                    device_ids=device_ids,
+                                                    output_device=output_device,
+                                                    dim=dim)
         self._is_dense = dense
+        # False: outputs stay on the device that computed them
+        self._gather = gather
+
+    def forward(self, *inputs, **kwargs):
+        if self.device_ids:
+            return super(DataParallel, self).forward(*inputs, **kwargs)
+        # Same input and output layout as with a single GPU
+        input_0 = inputs[0]
+        if self._is_dense:
+            input_0 = torch.stack(input_0)
+        elif len(input_0) == 1:
+            input_0 = input_0[0]
+        return self.module(input_0, **kwargs)
 
     def scatter(self, inputs, kwargs, device_ids):
         """
         len(inputs) = how many inputs the network takes
         len(inputs[0]) = #GPUs * mbs
+        For sparse networks each device gets its own collated minibatch,
+        their numbers of events can differ (see balance). With fewer
+        minibatches than devices (e.g. last batch of a stream), only the
+        first devices are used.
         """
         final_inputs = []
+        if not self._is_dense and len(inputs[0]) < len(device_ids):
+            device_ids = device_ids[:len(inputs[0])]
         if len(inputs[0]) % len(device_ids) != 0:
             raise Exception("Number of inputs must be a multiple of number of devices")
 
@@ -52,13 +176,14 @@ class DataParallel(torch.nn.parallel.DataParallel):
         len(outputs[0]) = minibatch size for dense
         Returns a tuple of length the number of objects returned by network
         Length of tuple[0] = number of gpus
+        Without gather the tensors are left on their device.
         """
         results = []
         num_outputs = len(outputs[0])
         for i in range(num_outputs):
             results.append([])
         for output in outputs:  # Iterate over GPUs
-            network_outputs = gather([output], output_device, dim=self.dim)
+            network_outputs = gather([output], output_device, dim=self.dim) if self._gather else output
             for i in range(num_outputs):
                 results[i].extend(network_outputs[i])
         return results
@@ -0,0 +1,85 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+import os
+import torch
+
+
+def parse_gpus(gpus):
+    """
+    training.gpus string -> (device type, list of device ids)
+    '0,1' -> ('cuda', [0, 1]) after CUDA_VISIBLE_DEVICES is set,
+    '', 'cpu' or '-1' -> ('cpu', [])
+    """
+    gpus = str(gpus).strip()
+    if gpus in ['', 'cpu', '-1']:
+        return 'cpu', []
+    return 'cuda', list(range(len(gpus.split(','))))
+
+
+def num_devices(cfg):
+    """
+    Number of minibatches processed in parallel (1 on CPU)
+    """
+    return max(len(cfg['training']['gpus']), 1)
+
+
+def get_device(cfg):
+    if cfg['training'].get('device', 'cuda') == 'cpu':
+        return torch.device('cpu')
+    return torch.device('cuda', cfg['training']['gpus'][0])
+
+
+def configure_threads(num_threads=None, num_interop_threads=None):
+    """
+    Intra-op (OpenMP / MKL) and inter-op thread pools for CPU execution.
+    The inter-op pool can only be set before any parallel work started.
+    """
+    if num_threads:
+        torch.set_num_threads(int(num_threads))
+    if num_interop_threads:
+        try:
+            torch.set_num_interop_threads(int(num_interop_threads))
+        except RuntimeError as e:
+            print('Cannot set inter-op threads:', e)
+
+
+def available_cores():
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count()))
+
+
+def split_cores(num_replicas, cores=None):
+    """
+    Splits cores in num_replicas contiguous groups of (almost) equal size.
+    """
+    cores = available_cores() if cores is None else cores
+    if num_replicas > len(cores):
+        raise ValueError('Cannot run %d replicas on %d cores' % (num_replicas, len(cores)))
+    size, extra = divmod(len(cores), num_replicas)
+    groups, start = [], 0
+    for i in range(num_replicas):
+        end = start + size + (1 if i < extra else 0)
+        groups.append(cores[start:end])
+        start = end
+    return groups
+
+
+def pin_cores(cores):
+    """
+    Restricts the current process (and the processes it starts later, e.g.
+    DataLoader workers) to the given cores. No-op where unsupported.
+    """
+    if hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, cores)
+
+
+def max_memory(device):
+    """
+    Peak memory in GB: allocated by torch on GPU, resident set size on CPU.
+    """
+    if device.type == 'cuda':
+        return torch.cuda.max_memory_allocated() / 1.e9
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1.e6
@@ -0,0 +1,66 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+import sys
+import time
+
+LEVELS = {'debug': 10, 'info': 20, 'warning': 30, 'error': 40}
+
+
+def _noop(msg, *args):
+    pass
+
+
+class Logger(object):
+    """
+    Leveled console messages for the hot path:
+
+        logger.debug('%d clusters', len(clusters))
+
+    Methods of the disabled levels are replaced by a no-op, so a disabled
+    call costs one function call and its arguments are not formatted. Guard
+    arguments that are expensive to compute with enabled('debug').
+    report() is for periodic reports, printed at most once every interval
+    seconds (0: always).
+    """
+    def __init__(self, level='info', interval=0.):
+        self._last_report = None
+        self.configure(level=level, interval=interval)
+
+    def configure(self, level=None, interval=None):
+        if level is not None:
+            if level not in LEVELS:
+                raise ValueError('Unknown log level %s, expected one of %s' % (level, sorted(LEVELS)))
+            self.level = level
+        if interval is not None:
+            self.interval = float(interval)
+        for name in LEVELS:
+            setattr(self, name, self._writer(name) if self.enabled(name) else _noop)
+
+    def enabled(self, level):
+        return LEVELS[level] >= LEVELS[self.level]
+
+    def _writer(self, level):
+        error = LEVELS[level] >= LEVELS['warning']
+
+        def write(msg, *args):
+            print(msg % args if args else msg, file=sys.stderr if error else sys.stdout)
+        return write
+
+    def report(self, msg, *args):
+        """
+        Rate-limited info message, returns whether it was printed
+        """
+        if not self.enabled('info'):
+            return False
+        now = time.time()
+        if self._last_report is not None and now - self._last_report < self.interval:
+            return False
+        self._last_report = now
+        print(msg % args if args else msg)
+        sys.stdout.flush()
+        return True
+
+
+# Shared by the training loop, models and output formatters
+logger = Logger()
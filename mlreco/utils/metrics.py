@@ -0,0 +1,176 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+import io
+import zipfile
+import threading
+import numpy as np
+import torch
+
+
+class MetricsAccumulator(object):
+    """
+    Running sums and counts of scalar metrics (losses, accuracies).
+    Values that are tensors stay on their device: nothing is copied to the
+    host until materialize() is called, so adding metrics never drains the
+    GPU queue.
+    """
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self._sums = {}
+        self._counts = {}
+        self._counted = set()
+
+    def __len__(self):
+        return len(self._sums)
+
+    def add(self, key, value, count, report_count=False):
+        """
+        value is a sum over `count` events (tensor or float).
+        If report_count is True, the total count is also reported as the
+        `%s_count` key (e.g. PPN metrics, only defined for some events).
+        """
+        if report_count:
+            self._counted.add(key)
+        if isinstance(value, torch.Tensor):
+            value = value.detach()
+        if key in self._sums:
+            self._sums[key] = self._sums[key] + value
+            self._counts[key] = self._counts[key] + count
+        else:
+            self._sums[key] = value
+            self._counts[key] = count
+
+    def materialize(self):
+        """
+        Returns a dictionary of host floats: the mean of each metric since the
+        last reset, and the `%s_count` total for counted metrics.
+        All device values are moved to the host with a single transfer.
+        """
+        keys = list(self._sums.keys())
+        values = [self._sums[key] for key in keys] + [self._counts[key] for key in keys]
+        device = None
+        for v in values:
+            if isinstance(v, torch.Tensor):
+                device = v.device
+                break
+        if device is not None:
+            stacked = torch.stack([torch.as_tensor(v, dtype=torch.float64).to(device).reshape(())
+                                   for v in values]).cpu().numpy()
+        else:
+            stacked = [float(v) for v in values]
+        result = {}
+        n = len(keys)
+        for i, key in enumerate(keys):
+            total, count = float(stacked[i]), float(stacked[n+i])
+            result[key] = total / count if count > 0 else float('nan')
+            if key in self._counted:
+                result[key + '_count'] = count
+        return result
+
+
+class MetricsSink(object):
+    """
+    Log of one row of scalar metrics per call of record(), for the training
+    loop. Rows go to a ring buffer of flush_every rows; when it is full they
+    are written by a background thread, so record() does no formatting or
+    I/O. Columns can appear (or be missing) in any row.
+
+    The file is a zip (numpy .npz) with one array per column and chunk of
+    rows, <chunk>/<column>.npy; read it with read_metrics().
+    """
+    def __init__(self, filename, flush_every=100):
+        self.filename = filename
+        self._rows = [None] * max(int(flush_every), 1)
+        self._size = 0
+        self._num_chunks = 0
+        self._pending = []
+        self._cond = threading.Condition()
+        self._closed = False
+        self._error = None
+        zipfile.ZipFile(filename, 'w').close()
+        self._thread = threading.Thread(target=self._write_loop)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def record(self, row):
+        """
+        row: dictionary column -> scalar
+        """
+        self._rows[self._size] = row
+        self._size += 1
+        if self._size == len(self._rows):
+            self.flush()
+
+    def flush(self, wait=False):
+        """
+        Hands the buffered rows to the writer thread. With wait, returns once
+        they are in the file.
+        """
+        with self._cond:
+            if self._error is not None:
+                raise self._error
+            if self._size:
+                self._pending.append(self._rows[:self._size])
+                self._size = 0
+                self._cond.notify()
+            while wait and self._pending:
+                self._cond.wait()
+
+    def close(self):
+        self.flush(wait=True)
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._thread.join()
+
+    def _write_loop(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._closed:
+                    self._cond.wait()
+                if not self._pending:
+                    return
+                rows = self._pending[0]
+            try:
+                self._write(rows)
+            except Exception as e:
+                self._error = e
+            with self._cond:
+                self._pending.pop(0)
+                self._cond.notify_all()
+
+    def _write(self, rows):
+        columns = []
+        for row in rows:
+            columns.extend([key for key in row if key not in columns])
+        with zipfile.ZipFile(self.filename, 'a') as f:
+            for key in columns:
+                values = np.array([row.get(key, np.nan) for row in rows], dtype=np.float64)
+                buffer = io.BytesIO()
+                np.save(buffer, values)
+                f.writestr('%06d/%s.npy' % (self._num_chunks, key), buffer.getvalue())
+        self._num_chunks += 1
+
+
+def read_metrics(filename):
+    """
+    Columns of a MetricsSink file: dictionary column -> array over all the
+    rows, nan where the column was missing
+    """
+    chunks = {}
+    with np.load(filename) as f:
+        for name in f.files:
+            chunk, key = name.split('/', 1)
+            chunks.setdefault(chunk, {})[key] = f[name]
+    columns = []
+    for chunk in sorted(chunks):
+        columns.extend([key for key in chunks[chunk] if key not in columns])
+    result = dict([(key, []) for key in columns])
+    for chunk in sorted(chunks):
+        size = len(next(iter(chunks[chunk].values())))
+        for key in columns:
+            result[key].append(chunks[chunk].get(key, np.full(size, np.nan)))
+    return dict([(key, np.concatenate(values)) for key, values in result.items()])
@@ -80,3 +80,18 @@ def get_ppn_info(particle_v, meta, point_type="3d", min_voxel_count=5, min_energ
                 gt_positions.append([x, y, gt_type])
 
     return np.array(gt_positions)
+
+
+def target_mask(sites, targets):
+    """
+    Boolean mask of the rows of sites (N, 3) whose integer coordinates are
+    in targets (M, 3), e.g. the positive sites precomputed by
+    iotools.ppn_targets. Both are tensors on the same device.
+    """
+    import torch
+    if not len(targets) or not len(sites):
+        return torch.zeros(len(sites), dtype=torch.bool, device=sites.device)
+    sites, targets = sites.long(), targets.long()
+    size = int(torch.max(sites.max(), targets.max())) + 1
+    keys = lambda c: (c[:, 0] * size + c[:, 1]) * size + c[:, 2]
+    return torch.isin(keys(sites), keys(targets))
@@ -0,0 +1,203 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+import os
+import time
+import json
+import random
+import threading
+import numpy as np
+
+
+class _NullScope(object):
+    """
+    Returned by Profiler.scope when profiling is disabled: does nothing.
+    """
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+_NULL_SCOPE = _NullScope()
+
+
+class _Scope(object):
+    __slots__ = ('_profiler', '_name', '_path', '_start')
+
+    def __init__(self, profiler, name):
+        self._profiler = profiler
+        self._name = name
+
+    def __enter__(self):
+        p = self._profiler
+        stack = p._stack()
+        self._path = stack[-1] + '/' + self._name if stack else self._name
+        stack.append(self._path)
+        if p.sync:
+            p._synchronize()
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        p = self._profiler
+        if p.sync:
+            p._synchronize()
+        end = time.perf_counter()
+        p._stack().pop()
+        p._record(self._path, self._start, end)
+        return False
+
+
+class _ScopeStats(object):
+    """
+    Running count/total/min/max/last of the durations of one scope path,
+    and a fixed-size uniform sample of them (reservoir) for p50/p95.
+    """
+    __slots__ = ('count', 'total', 'min', 'max', 'last', 'sample', '_random')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.
+        self.min = float('inf')
+        self.max = 0.
+        self.last = 0.
+        self.sample = []
+        self._random = random.Random(0)
+
+    def add(self, duration, size):
+        self.count += 1
+        self.total += duration
+        self.min = min(self.min, duration)
+        self.max = max(self.max, duration)
+        self.last = duration
+        if len(self.sample) < size:
+            self.sample.append(duration)
+        else:
+            i = self._random.randrange(self.count)
+            if i < size:
+                self.sample[i] = duration
+
+
+class Profiler(object):
+    """
+    Nestable timing scopes for the hot path:
+
+        with profiler.scope('forward'):
+            with profiler.scope('encoder'):
+                ...
+
+    records a duration for 'forward' and for 'forward/encoder'.
+    Each scope path keeps its count, total, last, min/max, and p50/p95 of a
+    sample of at most reservoir durations, so memory does not grow with the
+    number of iterations. The trace keeps the first max_events scopes.
+    If sync is True, CUDA is synchronized at scope boundaries so that
+    GPU time is attributed to the right scope (slower).
+    When disabled, scope() returns a shared no-op context, except for the
+    scopes opened with always=True (the iteration, I/O, train, forward and
+    save timings of the training log).
+    """
+    def __init__(self, enabled=True, sync=False, max_events=100000, reservoir=1024):
+        self.enabled = enabled
+        self.sync = sync
+        self.max_events = max_events
+        self.reservoir = reservoir
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.reset()
+
+    def configure(self, enabled=True, sync=False):
+        self.enabled = enabled
+        self.sync = sync
+
+    def reset(self):
+        self._stats = {}
+        self._events = []
+        self._origin = time.perf_counter()
+
+    def scope(self, name, always=False):
+        if not self.enabled and not always:
+            return _NULL_SCOPE
+        return _Scope(self, name)
+
+    def _stack(self):
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def _synchronize(self):
+        import torch
+        if torch.cuda.is_available():
+            torch.cuda.synchronize()
+
+    def _record(self, path, start, end):
+        with self._lock:
+            stats = self._stats.get(path)
+            if stats is None:
+                stats = self._stats[path] = _ScopeStats()
+            stats.add(end - start, self.reservoir)
+            if len(self._events) < self.max_events:
+                self._events.append((path, start, end - start, threading.get_ident()))
+
+    def last(self, path):
+        s = self._stats.get(path)
+        return s.last if s is not None else 0.
+
+    def total(self, path):
+        s = self._stats.get(path)
+        return s.total if s is not None else 0.
+
+    def stats(self):
+        """
+        Returns a dictionary path -> dict of count/total/mean/min/p50/p95/max
+        (percentiles estimated on the reservoir sample)
+        """
+        result = {}
+        for path, s in list(self._stats.items()):
+            sample = np.array(s.sample)
+            result[path] = {
+                'count': s.count,
+                'total': s.total,
+                'mean': s.total / s.count,
+                'min': s.min,
+                'p50': float(np.percentile(sample, 50)),
+                'p95': float(np.percentile(sample, 95)),
+                'max': s.max
+            }
+        return result
+
+    def to_csv(self, filename):
+        columns = ('count', 'total', 'mean', 'min', 'p50', 'p95', 'max')
+        with open(filename, 'w') as f:
+            f.write('scope,' + ','.join(columns) + '\n')
+            for path, s in sorted(self.stats().items()):
+                f.write(path + ',' + ','.join(['%g' % s[c] for c in columns]) + '\n')
+
+    def to_chrome_trace(self, filename):
+        """
+        Writes the recorded scopes in Chrome trace format
+        (open with chrome://tracing or Perfetto).
+        """
+        pid = os.getpid()
+        events = []
+        for path, start, duration, tid in self._events:
+            events.append({
+                'name': path.split('/')[-1],
+                'cat': 'mlreco',
+                'ph': 'X',
+                'ts': (start - self._origin) * 1.e6,
+                'dur': duration * 1.e6,
+                'pid': pid,
+                'tid': tid,
+                'args': {'path': path}
+            })
+        with open(filename, 'w') as f:
+            json.dump({'traceEvents': events}, f)
+
+
+# Process-wide profiler, configured by main_funcs.prepare
+profiler = Profiler()
@@ -0,0 +1,73 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+import importlib
+
+
+def _resolve(target):
+    """
+    'package.module:attribute' -> object, importing the module
+    """
+    if not isinstance(target, str):
+        return target
+    module, attribute = target.split(':')
+    return getattr(importlib.import_module(module), attribute)
+
+
+class Registry(object):
+    """
+    String-keyed registry that imports a module only when one of its
+    entries is requested, so that importing mlreco (and spawning DataLoader
+    workers) does not pay for torch extensions, sklearn, larcv... that the
+    configuration never uses.
+
+    Entries are 'package.module:attribute' strings (or tuples of them,
+    resolved to a tuple of objects). If module is given, any other name is
+    looked up as an attribute of that module.
+
+        models = Registry('model', {
+            'uresnet': ('mlreco.models.uresnet:UResNet', 'mlreco.models.uresnet:SegmentationLoss')
+        })
+        model, loss = models['uresnet']
+    """
+    def __init__(self, kind, entries=None, module=None):
+        self.kind = kind
+        self.module = module
+        self._entries = dict(entries) if entries is not None else {}
+        self._cache = {}
+
+    def register(self, name, target):
+        self._entries[name] = target
+        self._cache.pop(name, None)
+
+    def keys(self):
+        return list(self._entries.keys())
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __contains__(self, name):
+        if name in self._entries:
+            return True
+        if self.module is not None:
+            return hasattr(importlib.import_module(self.module), name)
+        return False
+
+    def __getitem__(self, name):
+        if name in self._cache:
+            return self._cache[name]
+        if name in self._entries:
+            target = self._entries[name]
+            if isinstance(target, tuple):
+                value = tuple([_resolve(t) for t in target])
+            else:
+                value = _resolve(target)
+        elif self.module is not None and hasattr(importlib.import_module(self.module), name):
+            value = getattr(importlib.import_module(self.module), name)
+        else:
+            raise KeyError('Unknown %s %s, available: %s' % (self.kind, name, ', '.join(sorted(self.keys()))))
+        self._cache[name] = value
+        return value
+
+    def get(self, name, default=None):
+        return self[name] if name in self else default
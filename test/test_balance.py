@@ -0,0 +1,58 @@
+import os
+import sys
+import numpy as np
+TOP_DIR = os.path.dirname(os.path.abspath(__file__))
+TOP_DIR = os.path.dirname(TOP_DIR)
+sys.path.insert(0, TOP_DIR)
+
+
+def test_balance():
+    from mlreco.iotools.synthetic import SyntheticEventGenerator
+    from mlreco.iotools.collates import CollateSparse
+    from mlreco.utils.data_parallel import partition, balance
+
+    assert partition([5, 1, 4, 2, 3], 2) == [[0, 1, 3], [2, 4]]
+
+    # Two devices: a large and a small event on one, two small ones on the other
+    generator = SyntheticEventGenerator(spatial_size=256, seed=0)
+    batches = []
+    for sizes in [(2000, 100), (100, 100)]:
+        batch = []
+        for size in sizes:
+            event = generator.generate(size)
+            batch.append((generator.parse(event, 'parse_sparse3d_scn'),
+                          generator.parse(event, 'parse_sparse3d_scn_values', 'sparse3d_fivetypes'),
+                          [len(batches) * 2 + len(batch)]))
+        batches.append(CollateSparse(batch))
+    minibatch = dict([(key, [b[i] for b in batches]) for i, key in enumerate(['input_data', 'segment_label', 'index'])])
+    columns = {'input_data': 3, 'segment_label': 'input_data', 'index': None}
+    balanced = balance(minibatch, columns, 'input_data')
+
+    assert [[idx[0] for idx in d] for d in balanced['index']] == [[0], [1, 2, 3]]
+    for d, data in enumerate(balanced['input_data']):
+        assert np.unique(data[:, 3]).tolist() == list(range(len(balanced['index'][d])))
+        assert len(balanced['segment_label'][d]) == len(data)
+    # Same voxels and values, moved with their event
+    first = minibatch['input_data'][0]
+    assert np.array_equal(balanced['input_data'][0], first[first[:, 3] == 0])
+    assert np.array_equal(balanced['segment_label'][0], minibatch['segment_label'][0][first[:, 3] == 0])
+
+    # Fewer events than devices: the devices left empty are dropped
+    batch = batches[1]
+    sparse = dict([(key, [batch[i], batch[i][:0], batch[i][:0]]) for i, key in enumerate(['input_data', 'segment_label'])])
+    sparse['index'] = [batch[2], [], []]
+    balanced = balance(sparse, columns, 'input_data')
+    assert sorted([[idx[0] for idx in d] for d in balanced['index']]) == [[2], [3]]
+    assert [len(np.unique(d[:, 3])) for d in balanced['input_data']] == [1, 1]
+
+    # Cost log of 2D events: batch id in column 2
+    import tempfile
+    from mlreco.utils.cost_model import CostLog
+    prefix = os.path.join(tempfile.mkdtemp(), 'cost')
+    log = CostLog(prefix, 0, data_dim=2)
+    voxels = np.array([[0, 0, 0, 1], [1, 0, 0, 1], [5, 5, 1, 1]], dtype=np.float32)
+    assert log.record_events(0, 0, [7, 8], voxels, clusters=voxels) == (2, 3)
+    log.close()
+    rows = np.genfromtxt(prefix + '_events-0000000.csv', delimiter=',', names=True)
+    assert rows['entry'].tolist() == [7, 8] and rows['voxels'].tolist() == [2, 1]
+    return True
@@ -0,0 +1,39 @@
+import os
+import sys
+import numpy as np
+TOP_DIR = os.path.dirname(os.path.abspath(__file__))
+TOP_DIR = os.path.dirname(TOP_DIR)
+sys.path.insert(0, TOP_DIR)
+
+
+def test_cache():
+    from mlreco.iotools.factories import loader_factory
+    from mlreco.iotools.cache import find_cache
+    from mlreco.iotools.datasets import SyntheticDataset
+
+    cfg = {'iotool': {'batch_size': 2, 'shuffle': False, 'num_workers': 2, 'collate_fn': 'CollateSparse',
+                      'dataset': {'name': 'SyntheticDataset', 'num_events': 8, 'num_voxels': 100, 'cache_mb': 64,
+                                  'schema': {'input_data': ['parse_sparse3d_scn', 'sparse3d_data']}}}}
+    loader, _ = loader_factory(cfg)
+    cache = find_cache(loader.dataset)
+    first = [data[0] for data in loader]
+    assert cache.stats()['misses'] == 8 and cache.stats()['hits'] == 0
+    second = [data[0] for data in loader]  # Workers of the second epoch read what the first ones wrote
+    assert cache.stats()['hits'] == 8 and cache.stats()['misses'] == 8
+    for a, b in zip(first, second):
+        assert np.array_equal(a, b)
+
+    # Room for 2 events: the least recently used ones are evicted
+    ds = SyntheticDataset(cfg['iotool']['dataset']['schema'], num_events=4, num_voxels=100)
+    from mlreco.iotools.cache import CachedDataset
+    import pickle
+    size = len(pickle.dumps(ds[0], protocol=pickle.HIGHEST_PROTOCOL))
+    cached = CachedDataset(ds, int(2.5 * size))
+    cached[0], cached[1], cached[0], cached[2]
+    stats = cached.cache.stats()
+    assert stats['evictions'] == 1 and stats['bytes'] <= 2.5 * size
+    cached[0]  # 0 was used more recently than 1
+    assert cached.cache.stats()['hits'] == 2
+    cache.close()
+    cached.cache.close()
+    return True
@@ -0,0 +1,26 @@
+import os
+import sys
+import copy
+import torch
+TOP_DIR = os.path.dirname(os.path.abspath(__file__))
+TOP_DIR = os.path.dirname(TOP_DIR)
+sys.path.insert(0, TOP_DIR)
+
+
+def test_checkpoint():
+    from mlreco.models.layers.checkpoint import checkpoint_module
+
+    torch.manual_seed(0)
+    block = torch.nn.Sequential(torch.nn.Linear(4, 8), torch.nn.BatchNorm1d(8), torch.nn.ReLU(), torch.nn.Linear(8, 2))
+    checkpointed = copy.deepcopy(block)
+    x = torch.randn(32, 4)
+    block(x).sum().backward()
+    checkpointed_x = x.clone().requires_grad_()
+    checkpoint_module(checkpointed, checkpointed, checkpointed_x).sum().backward()
+
+    # Same gradients, running statistics updated once
+    for p, q in zip(block.parameters(), checkpointed.parameters()):
+        assert torch.allclose(p.grad, q.grad, atol=1e-6)
+    for name, buf in block[1].named_buffers():
+        assert torch.equal(buf, getattr(checkpointed[1], name)), name
+    return True
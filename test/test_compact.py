@@ -0,0 +1,29 @@
+import os
+import sys
+import numpy as np
+TOP_DIR = os.path.dirname(os.path.abspath(__file__))
+TOP_DIR = os.path.dirname(TOP_DIR)
+sys.path.insert(0, TOP_DIR)
+
+
+def test_compact():
+    from mlreco.iotools.synthetic import SyntheticEventGenerator
+    from mlreco.iotools.collates import CollateSparse
+    from mlreco.iotools.compact import CompactSparse, CompactSparseTensor
+
+    generator = SyntheticEventGenerator(spatial_size=768, seed=0)
+    batch = []
+    for _ in range(3):
+        event = generator.generate(1000)
+        batch.append((generator.parse(event, 'parse_sparse3d_scn'),
+                      generator.parse(event, 'parse_sparse3d_scn', 'sparse3d_fivetypes'), [len(batch)]))
+    expected = CollateSparse(batch)
+    compact = CompactSparse(batch)
+    for c, e in zip(compact[:2], expected[:2]):
+        assert isinstance(c, CompactSparseTensor)
+        assert np.array_equal(c.numpy(), e.astype(np.float32))
+        assert np.array_equal(c.to('cpu').numpy(), e.astype(np.float32))
+        assert c.nbytes < e.nbytes / 2
+    assert compact[0].coord_dtype == np.int16 and compact[1].value_dtype == np.uint8
+    assert compact[2] == expected[2]
+    return True
@@ -0,0 +1,111 @@
+import os
+import sys
+import glob
+import tempfile
+import numpy as np
+import torch
+TOP_DIR = os.path.dirname(os.path.abspath(__file__))
+TOP_DIR = os.path.dirname(TOP_DIR)
+sys.path.insert(0, TOP_DIR)
+
+
+class PointNet(torch.nn.Module):
+    """
+    Per-voxel linear classifier, to run the train loop without sparseconvnet.
+    The second output masks the voxels of the upper half in x (candidates).
+    """
+    def __init__(self, cfg):
+        super(PointNet, self).__init__()
+        self.linear = torch.nn.Linear(4, cfg['modules']['uresnet_lonely']['num_classes'])
+
+    def forward(self, input):
+        point_cloud, = input
+        x = torch.cat([point_cloud[:, :3] / 512., point_cloud[:, -1:]], dim=1).float()
+        return [[self.linear(x)], [point_cloud[:, :1] >= 256]]
+
+
+def test_cpu():
+    from mlreco.main_funcs import process_config, train, prepare, get_data_minibatched, run_inference
+    from mlreco.models import models
+    from mlreco.models.uresnet_lonely import SegmentationLoss
+    from mlreco.iotools.samplers import ShardSampler
+    from mlreco.utils.device import split_cores
+    from mlreco.utils.cost_model import CostModel, active_sites
+    from mlreco.iotools.factories import dataset_factory
+    from mlreco.utils.metrics import read_metrics
+
+    models.register('test_cpu', (PointNet, SegmentationLoss))
+    log_dir = tempfile.mkdtemp()
+    cfg = {
+        'iotool': {
+            'batch_size': 4, 'shuffle': False, 'num_workers': 0, 'collate_fn': 'CollateSparse',
+            'dataset': {'name': 'SyntheticDataset', 'num_events': 16, 'num_voxels': 100,
+                        'schema': {'input_data': ['parse_sparse3d_scn', 'sparse3d_data'],
+                                   'segment_label': ['parse_sparse3d_scn', 'sparse3d_fivetypes']}}
+        },
+        'model': {'name': 'test_cpu', 'modules': {'uresnet_lonely': {'num_classes': 5, 'num_strides': 3}},
+                  'network_input': ['input_data'], 'loss_input': ['segment_label']},
+        'training': {'seed': 0, 'learning_rate': 0.01, 'gpus': 'cpu', 'num_threads': 1,
+                     'weight_prefix': os.path.join(log_dir, 'weights/snapshot'), 'iterations': 3,
+                     'report_step': 2, 'checkpoint_step': 2, 'log_dir': log_dir, 'model_path': '',
+                     'train': True, 'debug': False, 'minibatch_size': 2, 'cost_log': True,
+                     'cost_log_keys': {'candidates': 1}}
+    }
+    process_config(cfg)
+    assert cfg['training']['device'] == 'cpu' and cfg['training']['gpus'] == []
+    train(cfg)
+    # Timings at each iteration, metrics at the report step (iteration 1) and
+    # those of iteration 2 in a last row
+    log = read_metrics(os.path.join(log_dir, 'train_log-0000000.npz'))
+    assert log['iter'].tolist() == [0, 1, 2, 2] and (log['titer'][:3] > 0).all()
+    assert np.isnan(log['loss_seg'][[0, 2]]).all() and np.isfinite(log['loss_seg'][[1, 3]]).all()
+    # Cost log: one row per event, per minibatch and per batch (backward)
+    rows = np.genfromtxt(os.path.join(log_dir, 'cost_events-0000000.csv'), delimiter=',', names=True)
+    assert len(rows) == 3 * 4
+    ds = dataset_factory(cfg)
+    assert 'active_sites' in ds.data_keys()
+    for row in rows:
+        voxels = ds[int(row['entry'])][0][0]
+        assert [row['sites_1'], row['sites_2']] == active_sites(voxels, 3)
+        assert row['candidates'] == (voxels[:, 0] >= 256).sum()
+    model = CostModel.fit(os.path.join(log_dir, 'cost_batches-0000000.csv'))
+    assert sorted(model.coefficients) == ['backward_time', 'forward_time']
+    assert abs(model.predict(100, 1) - model.coefficients['forward_time'][0] - model.event_cost(100)) < 1.e-9
+
+    # Lean inference without labels: no loss, no optimizer
+    cfg['training'].update({'gpus': 'cpu', 'train': False, 'inference_mode': True, 'iterations': 1,
+                            'model_path': os.path.join(log_dir, 'weights/snapshot-1.ckpt')})
+    cfg['iotool']['batch_size'] = 4
+    cfg['training']['minibatch_size'] = 2
+    del cfg['iotool']['dataset']['schema']['segment_label']
+    cfg['model']['analysis_keys'] = {'segmentation': 0}
+    process_config(cfg)
+    handlers = prepare(cfg)
+    assert handlers.trainer._criterion is None and handlers.trainer._optimizer is None
+    res = handlers.trainer.forward(get_data_minibatched(handlers.data_io_iter, cfg))
+    assert 'loss_seg' not in res
+    assert len(res['segmentation']) == 2 and res['segmentation'][0].shape[1] == 5
+
+    # Streaming: resumes from the journal, each entry is processed once
+    stream_dir = os.path.join(log_dir, 'stream')
+    os.makedirs(stream_dir)
+    journal = os.path.join(stream_dir, 'journal-0-of-1.txt')
+    with open(journal, 'w') as f:
+        f.write('0\n1\n2\n3\n')
+    cfg['training'].update({'gpus': 'cpu', 'streaming': True, 'log_dir': stream_dir, 'profile': False})
+    process_config(cfg)
+    run_inference(cfg)
+    # Log timings without the profiler
+    stream_log, = glob.glob(os.path.join(stream_dir, 'inference_log-*.npz'))
+    assert (read_metrics(stream_log)['titer'] > 0).all()
+    with open(journal) as f:
+        assert sorted(int(line) for line in f) == list(range(16))
+    run_inference(cfg)
+    with open(journal) as f:
+        assert len(f.readlines()) == 16
+
+    shards = [list(ShardSampler(10, 3, i)) for i in range(3)]
+    assert sorted(sum(shards, [])) == list(range(10))
+    groups = split_cores(2, cores=[0, 1, 2, 3, 4])
+    assert groups == [[0, 1, 2], [3, 4]]
+    return True
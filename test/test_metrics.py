@@ -0,0 +1,46 @@
+import os
+import sys
+TOP_DIR = os.path.dirname(os.path.abspath(__file__))
+TOP_DIR = os.path.dirname(TOP_DIR)
+sys.path.insert(0, TOP_DIR)
+
+
+def test_metrics():
+    from mlreco.utils.metrics import MetricsAccumulator
+    import torch
+
+    m = MetricsAccumulator()
+    m.add('loss_seg', torch.tensor(3.0), 2)
+    m.add('loss_seg', torch.tensor(1.0), 2)
+    m.add('ppn_acc', torch.tensor(0.5), 1, report_count=True)
+    m.add('ppn_acc', 0., 0, report_count=True)
+    m.add('loss_ppn1', 0., 0, report_count=True)
+    res = m.materialize()
+    assert res['loss_seg'] == 1.0
+    assert 'loss_seg_count' not in res
+    assert res['ppn_acc'] == 0.5 and res['ppn_acc_count'] == 1
+    assert res['loss_ppn1'] != res['loss_ppn1']  # nan when never counted
+    m.reset()
+    assert m.materialize() == {}
+
+    # Metrics log: columns can appear later, written by chunks
+    from mlreco.utils.metrics import MetricsSink, read_metrics
+    import numpy as np
+    import tempfile
+    filename = os.path.join(tempfile.mkdtemp(), 'log.npz')
+    sink = MetricsSink(filename, flush_every=2)
+    sink.record({'iter': 0, 'loss_seg': 1.})
+    sink.record({'iter': 1, 'loss_seg': 2., 'loss_ppn1_count': 3})
+    sink.record({'iter': 2})
+    sink.close()
+    log = read_metrics(filename)
+    assert log['iter'].tolist() == [0, 1, 2] and np.isnan(log['loss_seg'][2])
+    assert np.isnan(log['loss_ppn1_count'][0]) and log['loss_ppn1_count'][1] == 3
+
+    # Disabled levels are no-ops
+    from mlreco.utils.logger import Logger
+    logger = Logger(level='warning', interval=60.)
+    assert not logger.enabled('debug') and logger.debug('%d', None) is None
+    logger.configure(level='info')
+    assert logger.report('first') and not logger.report('second')
+    return True
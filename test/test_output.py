@@ -0,0 +1,54 @@
+import os
+import sys
+import tempfile
+import numpy as np
+TOP_DIR = os.path.dirname(os.path.abspath(__file__))
+TOP_DIR = os.path.dirname(TOP_DIR)
+sys.path.insert(0, TOP_DIR)
+
+
+def test_output():
+    from mlreco.iotools.factories import dataset_factory
+    from mlreco.iotools.collates import CollateSparse
+    from mlreco.output_formatters import output, formatters
+
+    cfg = {
+        'iotool': {'dataset': {'name': 'SyntheticDataset', 'num_events': 2, 'num_voxels': 2000, 'spatial_size': 128,
+                               'schema': {'input_data': ['parse_sparse3d_scn', 'sparse3d_data'],
+                                          'particles_label': ['parse_particles', 'sparse3d_data', 'particle_mcst']},
+                               'crop': {'spatial_size': 96}, 'ppn_targets': {'num_strides': 5}}},
+        'model': {'modules': {'uresnet_ppn': {'num_strides': 5}}, 'analysis_keys': {'ppn1': 1, 'ppn2': 2}},
+        'training': {'log_dir': tempfile.mkdtemp()}
+    }
+    ds = dataset_factory(cfg)
+    keys = ds.data_keys()
+    assert keys == ['input_data', 'particles_label', 'offset', 'ppn_targets', 'index']
+    batch = CollateSparse([ds[0], ds[1]])
+    data_blob = dict([(key, [[batch[i]]]) for i, key in enumerate(keys)])
+
+    # Coarse outputs (x, y, z, batch id, score) at the PPN1 and PPN2 strides
+    data = batch[0]
+    res = {}
+    for key, stride in [('ppn1', 16), ('ppn2', 4)]:
+        sites = np.unique(np.concatenate([np.floor(data[:, :3] / stride), data[:, 3:4]], axis=1), axis=0)
+        res[key] = [np.concatenate([sites, np.ones((len(sites), 1))], axis=1)]
+
+    events = []
+    formatters.register('test_output', lambda csv_logger, d, r: events.append((d, r)))
+    output(['test_output'], data_blob, res, cfg, 0)
+    assert len(events) == 2
+    for b, (event_data, event_res) in enumerate(events):
+        offset = ds[b][2][0, :3]
+        assert np.all(offset % 16 == 0)  # Coarsest stride 2**(5-1)
+        assert np.array_equal(event_data['input_data'][:, :3], data[data[:, 3] == b][:, :3] + offset)
+        assert np.array_equal(event_data['offset'][:, :3], ds[b][2])
+        for key, stride in [('ppn1', 16), ('ppn2', 4)]:
+            cropped = res[key][0][res[key][0][:, 3] == b]
+            assert np.array_equal(event_res[key][:, :3], cropped[:, :3] + offset // stride)
+            assert np.array_equal(event_res[key][:, 3:], cropped[:, 3:])
+        targets = batch[3][batch[3][:, 3] == b]
+        for level, stride in [(0, 1), (1, 16), (2, 4)]:
+            rows = targets[:, -1] == level
+            assert np.allclose(event_data['ppn_targets'][rows, :3], targets[rows, :3] + offset / stride)
+            assert np.array_equal(event_data['ppn_targets'][:, 3:], targets[:, 3:])
+    return True
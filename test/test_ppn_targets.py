@@ -0,0 +1,35 @@
+import os
+import sys
+import numpy as np
+import torch
+TOP_DIR = os.path.dirname(os.path.abspath(__file__))
+TOP_DIR = os.path.dirname(TOP_DIR)
+sys.path.insert(0, TOP_DIR)
+
+
+def test_ppn_targets():
+    from mlreco.iotools.datasets import SyntheticDataset
+    from mlreco.iotools.ppn_targets import PPNTargetsDataset
+    from mlreco.iotools.collates import CollateSparse
+    from mlreco.utils.ppn import target_mask
+
+    schema = {'input_data': ['parse_sparse3d_scn', 'sparse3d_data'],
+              'particles_label': ['parse_particles', 'sparse3d_data', 'particle_mcst']}
+    ds = PPNTargetsDataset(SyntheticDataset(schema, num_events=2, num_voxels=3000), num_strides=5)
+    assert ds.data_keys() == ['input_data', 'particles_label', 'ppn_targets', 'index']
+    data, particles, targets, _ = [torch.as_tensor(d) if isinstance(d, np.ndarray) else d
+                                   for d in CollateSparse([ds[0], ds[1]])]
+    for b in range(2):
+        event_data = data[data[:, 3] == b][:, :3]
+        event_label = particles[particles[:, -2] == b][:, :3]
+        event_targets = targets[targets[:, -2] == b]
+        # Same positives as the distance computations of the PPN losses
+        d_true = torch.cdist(event_label.double(), event_data.double())
+        expected = (d_true < 5).any(dim=0)
+        assert expected.any()
+        assert torch.equal(target_mask(event_data, event_targets[event_targets[:, -1] == 0][:, :-2]), expected)
+        for level, stride in [(1, 16), (2, 4)]:
+            sites = torch.unique(torch.floor(event_data / stride), dim=0)
+            expected = (torch.cdist(event_label.double() / stride, sites.double()) < 1).any(dim=0)
+            assert torch.equal(target_mask(sites, event_targets[event_targets[:, -1] == level][:, :-2]), expected)
+    return True
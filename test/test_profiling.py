@@ -0,0 +1,51 @@
+import os
+import sys
+import json
+import tempfile
+TOP_DIR = os.path.dirname(os.path.abspath(__file__))
+TOP_DIR = os.path.dirname(TOP_DIR)
+sys.path.insert(0, TOP_DIR)
+
+
+def test_profiling():
+    from mlreco.utils.profiling import Profiler
+
+    p = Profiler()
+    for _ in range(3):
+        with p.scope('train'):
+            with p.scope('forward'):
+                pass
+    stats = p.stats()
+    assert stats['train']['count'] == 3
+    assert stats['train/forward']['count'] == 3
+    assert p.total('train') >= p.total('train/forward')
+
+    d = tempfile.mkdtemp()
+    p.to_csv(os.path.join(d, 'profile.csv'))
+    p.to_chrome_trace(os.path.join(d, 'profile.json'))
+    trace = json.load(open(os.path.join(d, 'profile.json')))
+    assert len(trace['traceEvents']) == 6
+
+    # Bounded memory: a fixed-size sample per scope, exact count/total/max
+    p = Profiler(reservoir=10, max_events=5)
+    for _ in range(100):
+        with p.scope('step'):
+            pass
+    stats = p.stats()
+    assert stats['step']['count'] == 100
+    assert len(p._stats['step'].sample) == 10
+    assert len(p._events) == 5
+    assert stats['step']['min'] <= stats['step']['p50'] <= stats['step']['max']
+    assert abs(stats['step']['mean'] * 100 - p.total('step')) < 1e-9
+
+    p.configure(enabled=False)
+    with p.scope('disabled'):
+        pass
+    assert 'disabled' not in p.stats()
+    # Timings of the training log are kept
+    with p.scope('iteration', always=True):
+        with p.scope('disabled'):
+            with p.scope('io', always=True):
+                pass
+    assert 'disabled' not in p.stats() and p.stats()['iteration/io']['count'] == 1
+    return True
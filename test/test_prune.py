@@ -0,0 +1,25 @@
+import os
+import sys
+import torch
+TOP_DIR = os.path.dirname(os.path.abspath(__file__))
+TOP_DIR = os.path.dirname(TOP_DIR)
+sys.path.insert(0, TOP_DIR)
+
+
+def test_prune():
+    from mlreco.models.layers.extract_feature_map import prune_rows
+
+    torch.manual_seed(0)
+    coords = torch.randint(0, 16, (3000, 3))
+    batch = torch.randint(0, 2, (3000, 1))
+    locations = torch.unique(torch.cat([coords, batch], dim=1), dim=0)
+    locations = locations[torch.randperm(len(locations))]
+    selected = torch.rand(len(locations)) < 0.01
+    rows, _, _ = prune_rows(locations, selected, torch.LongTensor([16, 16, 16]), radius=2)
+    # Brute force: same batch and within 2 voxels of a selected site
+    centers = locations[selected]
+    distance = (locations[:, None, :3] - centers[None, :, :3]).abs().max(dim=2)[0]
+    near = ((distance <= 2) & (locations[:, None, 3] == centers[None, :, 3])).any(dim=1)
+    assert torch.equal(rows, torch.nonzero(near).flatten())
+    assert 0 < len(rows) < len(locations)
+    return True
@@ -0,0 +1,29 @@
+import os
+import sys
+import numpy as np
+TOP_DIR = os.path.dirname(os.path.abspath(__file__))
+TOP_DIR = os.path.dirname(TOP_DIR)
+sys.path.insert(0, TOP_DIR)
+
+
+def test_reduce():
+    from mlreco.iotools.reduce import reduce_voxels
+    from mlreco.iotools.factories import dataset_factory
+
+    voxels = np.array([[4, 0, 1], [0, 0, 0], [4, 0, 1], [1, 1, 1], [5, 1, 0]], dtype=np.int32)
+    values = np.array([[1.], [2.], [3.], [4.], [5.]], dtype=np.float32)
+    v, s = reduce_voxels(voxels, values, reduce='sum')
+    assert v.tolist() == [[0, 0, 0], [1, 1, 1], [4, 0, 1], [5, 1, 0]] and s[:, 0].tolist() == [2, 4, 4, 5]
+    v, m = reduce_voxels(voxels, values, pitch=2, reduce='max')
+    assert v.tolist() == [[0, 0, 0], [2, 0, 0]] and m[:, 0].tolist() == [4, 5]
+    v, m = reduce_voxels(voxels, values, pitch=2, reduce='mean')
+    assert m[:, 0].tolist() == [3, 3] and m.dtype == np.float32
+
+    # Keys sharing coordinates stay aligned
+    cfg = {'iotool': {'dataset': {'name': 'SyntheticDataset', 'num_events': 2, 'num_voxels': 500, 'voxels': {'pitch': 4},
+                                  'schema': {'input_data': ['parse_sparse3d_scn', 'sparse3d_data'],
+                                             'segment_label': ['parse_sparse3d_scn', 'sparse3d_fivetypes']}}}}
+    event = dataset_factory(cfg)[0]
+    assert np.array_equal(event[0][0], event[1][0]) and len(event[0][0]) < 500
+    assert len(np.unique(event[0][0], axis=0)) == len(event[0][0])
+    return True
@@ -0,0 +1,28 @@
+import os
+import sys
+TOP_DIR = os.path.dirname(os.path.abspath(__file__))
+TOP_DIR = os.path.dirname(TOP_DIR)
+sys.path.insert(0, TOP_DIR)
+
+
+def test_registry():
+    from mlreco.utils.registry import Registry
+    from mlreco.models import models
+    from mlreco.iotools.factories import collates
+    from mlreco.analysis import scripts
+
+    assert 'uresnet_ppn' in models and 'unknown' not in models
+    model, loss = models['uresnet_lonely']
+    assert model.__name__ == 'UResNet' and loss.__name__ == 'SegmentationLoss'
+    assert 'CollateSparse' in collates and callable(collates['CollateSparse'])
+    assert scripts['track_clustering'].__name__ == 'track_clustering'
+
+    r = Registry('test', module='os.path')
+    r.register('join', 'os.path:join')
+    assert r['join'] is os.path.join and r['dirname'] is os.path.dirname
+    try:
+        r['not_there']
+        assert False
+    except KeyError:
+        pass
+    return True
@@ -0,0 +1,50 @@
+import os
+import sys
+import tempfile
+import torch
+TOP_DIR = os.path.dirname(os.path.abspath(__file__))
+TOP_DIR = os.path.dirname(TOP_DIR)
+sys.path.insert(0, TOP_DIR)
+
+
+class TwoHeads(torch.nn.Module):
+    """
+    Two modules whose names share a prefix, restored from their own checkpoints
+    """
+    def __init__(self, cfg):
+        super(TwoHeads, self).__init__()
+        self.ppn = torch.nn.Linear(4, 2)
+        self.ppn_type = torch.nn.Linear(4, 2)
+
+    def forward(self, input):
+        return [[self.ppn(input[0])], [self.ppn_type(input[0])]]
+
+
+def test_restore():
+    from mlreco.main_funcs import process_config
+    from mlreco.trainval import trainval
+    from mlreco.models import models
+
+    models.register('test_restore', (TwoHeads, None))
+    log_dir = tempfile.mkdtemp()
+    # Checkpoints of each module trained alone: module.weight, module.bias
+    heads = {}
+    for name in ['ppn', 'ppn_type']:
+        heads[name] = torch.nn.Linear(4, 2)
+        torch.save({'global_step': 0, 'state_dict': torch.nn.DataParallel(heads[name]).state_dict()},
+                   os.path.join(log_dir, '%s.ckpt' % name))
+    cfg = {
+        'iotool': {'batch_size': 1, 'dataset': {}},
+        'model': {'name': 'test_restore', 'network_input': ['input_data'], 'loss_input': [],
+                  'modules': dict([(name, {'model_path': os.path.join(log_dir, '%s.ckpt' % name)}) for name in heads])},
+        'training': {'seed': 0, 'learning_rate': 0.01, 'gpus': 'cpu', 'weight_prefix': '', 'log_dir': log_dir,
+                     'model_path': '', 'train': False, 'minibatch_size': 1}
+    }
+    process_config(cfg)
+    trainer = trainval(cfg)
+    trainer.initialize()
+    net = trainer._net.module
+    for name in heads:
+        assert torch.equal(getattr(net, name).weight, heads[name].weight)
+        assert torch.equal(getattr(net, name).bias, heads[name].bias)
+    return True
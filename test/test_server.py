@@ -0,0 +1,78 @@
+import os
+import sys
+import numpy as np
+import torch
+TOP_DIR = os.path.dirname(os.path.abspath(__file__))
+TOP_DIR = os.path.dirname(TOP_DIR)
+sys.path.insert(0, TOP_DIR)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_server():
+    from test_cpu import PointNet
+    from mlreco.models import models
+    from mlreco.models.uresnet_lonely import SegmentationLoss
+    from mlreco.server import InferenceServer, InferenceClient
+    from mlreco.iotools.synthetic import SyntheticEventGenerator
+
+    models.register('test_server', (PointNet, SegmentationLoss))
+    cfg = {
+        'iotool': {'batch_size': 1, 'collate_fn': 'CollateSparse'},
+        'model': {'name': 'test_server', 'modules': {'uresnet_lonely': {'num_classes': 5}},
+                  'network_input': ['input_data'], 'loss_input': ['segment_label'],
+                  'analysis_keys': {'segmentation': 0}},
+        'training': {'gpus': 'cpu', 'seed': 0, 'learning_rate': 0.001, 'weight_prefix': '',
+                     'model_path': '', 'train': False, 'minibatch_size': 1}
+    }
+    # Voxel budget of 2 events of 100 voxels per minibatch
+    torch.manual_seed(0)
+    authkey = os.urandom(16)
+    if 'MLRECO_AUTHKEY' not in os.environ:
+        try:
+            InferenceServer(cfg)
+            assert False
+        except ValueError as e:
+            assert 'MLRECO_AUTHKEY' in str(e)
+    server = InferenceServer(cfg, authkey=authkey, max_latency=0.5, max_voxels=250).start()
+    generator = SyntheticEventGenerator(seed=0)
+    events = [{'input_data': generator.parse(generator.generate(100), 'parse_sparse3d_scn')} for _ in range(5)]
+    client = InferenceClient(server.address, authkey=authkey)
+    results = client.infer_many(events)
+    assert len(results) == 5
+    for result in results:
+        assert result['segmentation'].shape == (100, 5)
+    assert server.num_events == 5 and server.num_batches == 3
+    # Malformed events get an error reply instead of a hang
+    for event in [{}, {'input_data': None}]:
+        try:
+            client.infer(event)
+            assert False
+        except RuntimeError as e:
+            assert 'Error' in str(e)
+    assert client.infer(events[0])['segmentation'].shape == (100, 5)
+    # An event failing in the network fails only its own request
+    voxels, values = events[1]['input_data']
+    ids = [client.submit(events[0]), client.submit({'input_data': (voxels, values[:50])}), client.submit(events[2])]
+    replies = {}
+    for _ in ids:
+        try:
+            request_id, result = client.receive()
+            replies[request_id] = result
+        except RuntimeError as e:
+            assert 'request %d' % ids[1] in str(e)
+    assert sorted(replies) == [ids[0], ids[2]]
+    assert np.allclose(replies[ids[2]]['segmentation'], results[2]['segmentation'])
+    client.close()
+    server.close()
+
+    # Compact batches are split by event on the host
+    cfg['iotool']['collate_fn'] = 'CompactSparse'
+    torch.manual_seed(0)
+    server = InferenceServer(cfg, authkey=authkey, max_latency=0.5, max_voxels=250).start()
+    client = InferenceClient(server.address, authkey=authkey)
+    compact_results = client.infer_many(events)
+    for result, expected in zip(compact_results, results):
+        assert np.allclose(result['segmentation'], expected['segmentation'])
+    client.close()
+    server.close()
+    return True
@@ -0,0 +1,29 @@
+import os
+import sys
+import numpy as np
+TOP_DIR = os.path.dirname(os.path.abspath(__file__))
+TOP_DIR = os.path.dirname(TOP_DIR)
+sys.path.insert(0, TOP_DIR)
+
+
+def test_synthetic():
+    from mlreco.iotools.synthetic import SyntheticEventGenerator
+    from mlreco.iotools.collates import CollateSparse
+
+    generator = SyntheticEventGenerator(seed=0)
+    samples = []
+    for num_voxels in [10, 1000]:
+        event = generator.generate(num_voxels)
+        voxels, data = generator.parse(event, 'parse_sparse3d_scn')
+        assert voxels.shape == (num_voxels, 3)
+        assert data.shape == (num_voxels, 1)
+        assert len(np.unique(voxels, axis=0)) == num_voxels
+        assert voxels.min() >= 0 and voxels.max() < generator.spatial_size
+        particles, types = generator.parse(event, 'parse_particles')
+        assert particles.shape[1] == 3 and len(particles) == len(types)
+        samples.append((generator.parse(event, 'parse_sparse3d_scn'),
+                        generator.parse(event, 'parse_sparse3d_scn', is_label=True)))
+    data, label = CollateSparse(samples)
+    assert data.shape == (1010, 5)
+    assert label[:, -1].max() < 5
+    return True
@@ -0,0 +1,90 @@
+import os
+import sys
+import tempfile
+import numpy as np
+import torch
+TOP_DIR = os.path.dirname(os.path.abspath(__file__))
+TOP_DIR = os.path.dirname(TOP_DIR)
+sys.path.insert(0, TOP_DIR)
+
+
+def test_synthetic_dataset():
+    import yaml
+    from mlreco.iotools.factories import loader_factory
+    from mlreco.iotools.datasets import SyntheticDataset
+
+    cfg = yaml.load(open(os.path.join(TOP_DIR, 'config/test_synthetic.cfg')), Loader=yaml.Loader)
+    cfg['iotool']['dataset'].update({'num_events': 8, 'num_voxels': 100})
+    cfg['iotool']['num_workers'] = 0
+    cfg['iotool']['batch_size'] = 4
+    cfg['iotool']['sampler']['batch_size'] = 4
+    loader, data_keys = loader_factory(cfg)
+    assert data_keys == ['input_data', 'segment_label', 'particles_label', 'index']
+    for data in loader:
+        assert data[0].shape[1] == 5
+        assert data[0].shape[0] == data[1].shape[0]
+        assert np.all(data[1][:, -1] < 5)
+
+    # Same seed, same events
+    ds = SyntheticDataset.create(cfg['iotool']['dataset'])
+    a, b = ds[3], ds[3]
+    assert np.array_equal(a[0][0], b[0][0]) and np.array_equal(a[2][0], b[2][0])
+    assert not np.array_equal(ds[4][0][0], a[0][0])
+
+    # Event index and query: only the matching entries are read
+    from mlreco.iotools.index import build_index
+    path = os.path.join(tempfile.mkdtemp(), 'index.npz')
+    cfg['iotool']['dataset']['size_distribution'] = 'uniform'
+    ds = SyntheticDataset.create(cfg['iotool']['dataset'])
+    index = build_index(ds, cfg['iotool']['dataset']['schema'], path, num_workers=0)
+    assert len(index) == 8 and index.table['class_counts'].shape == (8, 5)
+    assert np.array_equal(index.table['num_voxels'], [len(ds[i][0][0]) for i in range(8)])
+    min_voxels = int(np.median(index.table['num_voxels']))
+    cfg['iotool']['dataset'].update({'index': path, 'query': {'min_voxels': min_voxels}})
+    del cfg['iotool']['sampler']
+    cfg['iotool']['shuffle'] = False
+    loader, _ = loader_factory(cfg)
+    entries = [idx[0] for data in loader for idx in data[-1]]
+    assert entries == list(np.nonzero(index.table['num_voxels'] >= min_voxels)[0])
+    # Index of another dataset, out-of-range class id
+    for check in [lambda: index.check(SyntheticDataset.create(dict(cfg['iotool']['dataset'], num_events=9))),
+                  lambda: index.select({'classes': [5]})]:
+        try:
+            check()
+            assert False
+        except ValueError as e:
+            assert 'entries' in str(e) or 'Class 5' in str(e)
+
+    # Cropping: coordinates in the smaller box, offset key to map them back
+    from mlreco.iotools.factories import dataset_factory
+    del cfg['iotool']['dataset']['query']
+    cfg['iotool']['dataset']['crop'] = {'spatial_size': 128}
+    cropped = dataset_factory(cfg)
+    assert cropped.data_keys() == ['input_data', 'segment_label', 'particles_label', 'offset', 'index']
+    event, full = cropped[0], ds[0]
+    assert np.all(event[0][0] >= 0) and np.all(event[0][0] < 128) and len(event[0][0]) <= len(full[0][0])
+    restored = set(map(tuple, event[0][0] + event[3][0].astype(np.int32)))
+    assert restored.issubset(set(map(tuple, full[0][0])))
+
+    # Shared coordinates: segment_label only carries its values, joined on device
+    from mlreco.iotools.collates import CollateSparse
+    from mlreco.iotools.shared import join_shared
+    cfg['iotool']['dataset']['shared_coordinates'] = {'segment_label': 'input_data'}
+    shared = dataset_factory(cfg)
+    event = shared[0]
+    assert len(event[1]) == 1 and np.array_equal(event[1][0], cropped[0][1][1])
+    batch = [shared[i] for i in range(3)]
+    collated = CollateSparse(batch)
+    assert collated[1].shape == (len(collated[0]), 1)
+    joined = join_shared({'input_data': [torch.as_tensor(collated[0])], 'segment_label': [torch.as_tensor(collated[1])]},
+                         cfg['iotool']['dataset']['shared_coordinates'])
+    assert np.array_equal(joined['segment_label'][0].numpy(), CollateSparse([cropped[i] for i in range(3)])[1])
+    # Losses take the values and the coordinates of the source instead
+    from mlreco.models.uresnet_lonely import SegmentationLoss
+    loss = SegmentationLoss({'modules': {'uresnet_lonely': {'data_dim': 3}}})
+    segmentation = [[torch.randn(len(collated[0]), 5)]]
+    expected = loss(segmentation, joined['segment_label'])
+    result = loss(segmentation, [torch.as_tensor(collated[1])], coordinates=[torch.as_tensor(collated[0])])
+    assert torch.allclose(result['loss_seg'], expected['loss_seg'])
+    assert torch.allclose(result['accuracy'], expected['accuracy'])
+    return True
@@ -0,0 +1,57 @@
+import os
+import sys
+import torch
+TOP_DIR = os.path.dirname(os.path.abspath(__file__))
+TOP_DIR = os.path.dirname(TOP_DIR)
+sys.path.insert(0, TOP_DIR)
+
+
+class VoxelModel(torch.nn.Module):
+    """
+    Outputs: per-voxel scores from the feature only, input coordinates,
+    and a non per-voxel output
+    """
+    def __init__(self, tile_size):
+        super(VoxelModel, self).__init__()
+        self.linear = torch.nn.Linear(1, 3)
+        self.tile_size = tile_size
+
+    def forward(self, input):
+        point_cloud = input[0]
+        assert point_cloud[:, :3].max() < self.tile_size and point_cloud[:, :3].min() >= 0
+        return [[self.linear(point_cloud[:, -1:])], [point_cloud[:, :3]], [point_cloud[:1]]]
+
+
+def test_tiling():
+    from mlreco.iotools.synthetic import SyntheticEventGenerator
+    from mlreco.iotools.collates import CollateSparse
+    from mlreco.models.tiled import TiledInference
+
+    generator = SyntheticEventGenerator(spatial_size=512, seed=0)
+    events = [generator.parse(generator.generate(2000), 'parse_sparse3d_scn') for _ in range(2)]
+    point_cloud = torch.as_tensor(CollateSparse([(e,) for e in events])[0]).float()
+    model = VoxelModel(tile_size=128)
+    with torch.no_grad():
+        expected = model.linear(point_cloud[:, -1:])
+        for policy in ['center', 'mean']:
+            tiled = TiledInference(model, tile_size=128, overlap=16, tiles_per_forward=3, policy=policy)
+            num_tiles = len(tiled.tiles(point_cloud))
+            scores, coords, other = tiled([point_cloud])
+            assert tiled.num_forwards == (num_tiles + 2) // 3
+            assert torch.allclose(scores[0], expected, atol=1e-6)
+            assert other == []
+        # 'center': each voxel gets the output of a single tile, here its local coordinates
+        local = TiledInference(model, tile_size=128, overlap=16, policy='center')([point_cloud])[1][0]
+        assert (local >= 0).all() and (local < 128).all()
+        assert num_tiles > 2 and (local != point_cloud[:, :3]).any()
+        # Origins aligned to the coarsest stride, same outputs
+        aligned = TiledInference(model, tile_size=128, overlap=20, policy='mean', alignment=16)
+        assert all([(origin % 16 == 0).all() for origin, _ in aligned.tiles(point_cloud)])
+        assert torch.allclose(aligned([point_cloud])[0][0], expected, atol=1e-6)
+    for kwargs in [{'spatial_size': 64}, {'alignment': 48}]:
+        try:
+            TiledInference(model, tile_size=128, **kwargs)
+            assert False
+        except ValueError:
+            pass
+    return True
@@ -0,0 +1,68 @@
+import os
+import sys
+import copy
+import numpy as np
+TOP_DIR = os.path.dirname(os.path.abspath(__file__))
+TOP_DIR = os.path.dirname(TOP_DIR)
+sys.path.insert(0, TOP_DIR)
+
+
+def test_transport():
+    from mlreco.iotools.factories import loader_factory
+
+    cfg = {'iotool': {'batch_size': 2, 'shuffle': False, 'num_workers': 2, 'collate_fn': 'CollateSparse',
+                      'dataset': {'name': 'SyntheticDataset', 'num_events': 8, 'num_voxels': 100,
+                                  'schema': {'input_data': ['parse_sparse3d_scn', 'sparse3d_data'],
+                                             'segment_label': ['parse_sparse3d_scn', 'sparse3d_fivetypes']}}}}
+    loader, _ = loader_factory(cfg)
+    expected = [data for data in loader]
+
+    shm_cfg = copy.deepcopy(cfg)
+    shm_cfg['iotool']['shared_memory'] = {'slab_mb': 1, 'hold': 2}
+    loader, _ = loader_factory(shm_cfg)
+    for epoch in range(2):
+        for data, ref in zip(loader, expected):
+            assert not data[0].flags['OWNDATA']  # View of a slab
+            for a, b in zip(data, ref):
+                if isinstance(a, np.ndarray):
+                    assert a.dtype == b.dtype and np.array_equal(a, b)
+                else:
+                    assert a == b
+
+    # Held batches stay valid across epochs: iterations of 2 batches over 5
+    # events, so that every other iteration spans two epochs
+    import time
+    from mlreco.main_funcs import cycle
+    from mlreco.iotools.collates import CollateSparse
+    epoch_cfg = copy.deepcopy(cfg)
+    epoch_cfg['iotool'].update({'batch_size': 1, 'shuffle': True, 'shared_memory': {'slab_mb': 1, 'hold': 2}})
+    epoch_cfg['iotool']['dataset']['num_events'] = 5
+    loader, _ = loader_factory(epoch_cfg)
+    data_io = cycle(loader)
+    for iteration in range(10):
+        batches = [next(data_io), next(data_io)]
+        time.sleep(0.05)  # Let the workers prefetch the next batches
+        for data in batches:
+            ref = CollateSparse([loader.dataset[data[-1][0][0]]])
+            assert np.array_equal(data[0], ref[0]) and np.array_equal(data[1], ref[1])
+
+    # Compact batches: only the layout of their buffer goes through the pipe
+    import pickle
+    from mlreco.iotools.compact import CompactSparseTensor, CompactSparse
+    from mlreco.iotools.transport import SlabCollate
+    loader, _ = loader_factory(dict(shm_cfg, iotool=dict(shm_cfg['iotool'], collate_fn='CompactSparse')))
+    for data, ref in zip(loader, expected):
+        assert isinstance(data[0], CompactSparseTensor) and not data[0].buffer.flags['OWNDATA']
+        assert np.array_equal(data[0].numpy(), ref[0].astype(np.float32))
+    batch = [loader.dataset[i] for i in range(2)]
+    slab_batch = SlabCollate(loader.ring, CompactSparse)(batch)
+    assert len(pickle.dumps(slab_batch)) < 1000
+    loader.ring.release(slab_batch.slab)
+
+    # Batches too large for a slab go through the usual pickling
+    shm_cfg['iotool']['shared_memory'] = {'slab_mb': 0.001}
+    shm_cfg['iotool']['num_workers'] = 0
+    loader, _ = loader_factory(shm_cfg)
+    data = next(iter(loader))
+    assert data[0].flags['OWNDATA'] and np.array_equal(data[0], expected[0][0])
+    return True